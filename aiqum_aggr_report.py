@@ -18,62 +18,63 @@
 ################################################################################
 
 import mysql.connector
+import aiqum_common
+from aiqum_common import ReportWriter, aiqum_fetch_batches
+from aiqum_common import aiqum_add_batch_args, aiqum_in_list
+from aiqum_common import aiqum_db_connect
+from aiqum_common import aiqum_add_connection_args, aiqum_connection_options
+from aiqum_common import aiqum_add_profile_args, aiqum_profile_start
+from aiqum_common import aiqum_profile_connection, aiqum_profile_report
+from aiqum_common import aiqum_phase
+from aiqum_common import aiqum_add_fleet_args, aiqum_fleet_hosts
+from aiqum_common import aiqum_fleet_report
+from aiqum_common import aiqum_add_delta_args, aiqum_delta_report
 import sys
-import datetime
 from argparse import ArgumentParser
 from getpass import getpass
 
-# Connection setup for AIQUM.
-def aiqum_db_connect(aiq_host,aiq_user,aiq_password):
-    try:
-        cnx = mysql.connector.connect(host=aiq_host,
-                                      user=aiq_user,
-                                      password=aiq_password,
-                                      database='netapp_model_view'
-                                     )
-    except:
-        print()
-        print("Error connecting to AIQUM Database. Exiting.")
-        print()
-        raise
+# Report columns.
+AGGR_COLUMNS = [("Cluster",None),("Node",None),("Model",None),
+                ("Aggregate",None),("PercentUsed",None),
+                ("Size(GB)","gb"),("UsedSize(GB)","gb"),
+                ("CloudTierUsed(GB)","gb0"),("LastUpdated","ms")]
 
-    return cnx
-
-# Query AIQUM for aggr data and print in CSV format.
-def aiqum_aggregates(cnx):
-    cursor = cnx.cursor()
+# Query AIQUM for aggr data and yield it in batches of rows, one per
+# aggregate: an aggregate with several object stores has their used space
+# summed, so that its objid is not repeated (--since-state keys rows on it).
+# With clusterids (for --since-state), only those clusters are queried and
+# each row ends with the aggregate and cluster objids.
+def aiqum_aggregate_batches(cnx,clusterids=None):
+    cursor = cnx.cursor(buffered=False)
     query = ("SELECT cluster.name,node.name,node.model,"
              "aggr.name,aggr.sizeUsedPercent,aggr.sizeTotal,aggr.sizeUsed,"
              "aggr_obj_cm.usedSpace,cluster.lastUpdateTime "
+            )
+    if clusterids:
+        query = query + ",aggr.objid,cluster.objid "
+    query = (query +
              "FROM aggregate AS aggr "
              "INNER JOIN node ON aggr.nodeId = node.objid "
              "INNER JOIN cluster ON aggr.clusterId = cluster.objid "
-             "LEFT JOIN aggregate_objectstore_config_mapping AS aggr_obj_cm \
-              ON aggr.objid = aggr_obj_cm.aggregateid "
+             "LEFT JOIN (SELECT aggregateid,"
+             "CAST(SUM(usedSpace) AS SIGNED) AS usedSpace "
+             "FROM aggregate_objectstore_config_mapping "
+             "GROUP BY aggregateid) AS aggr_obj_cm "
+             "ON aggr.objid = aggr_obj_cm.aggregateid "
             )
-    cursor.execute(query)
+    if clusterids:
+        query = (query + "WHERE cluster.objid IN " +
+                 aiqum_in_list(clusterids))
+    cursor.execute(query, clusterids)
+    yield from aiqum_fetch_batches(cursor)
 
-    print("Cluster,Node,Model,"
-          "Aggregate,PercentUsed,Size(GB),UsedSize(GB),"
-          "CloudTierUsed(GB),LastUpdated")
-    for row in cursor:
-        SizeGB      = "%.1f" % (row[5]  / (1024*1024*1024))
-        UsedGB      = "%.1f" % (row[6]  / (1024*1024*1024))
-        if (row[7]):
-            CloudUsedGB = "%.1f" % (row[7]  / (1024*1024*1024))
-        else:
-            CloudUsedGB = 0
-        epochtime   = "%i" % (row[8] / 1000)
-        lastupdated = datetime.datetime.fromtimestamp(int(epochtime))
-        print("%s,%s,%s,"
-              "%s,%s,%s,%s,"
-              "%s,%s"
-              %
-              (row[0],row[1],row[2],
-               row[3],row[4],SizeGB,UsedGB,
-               CloudUsedGB,lastupdated
-              )
-             )
+# Query AIQUM for aggr data and write it in CSV format
+# to output (default stdout).
+def aiqum_aggregates(cnx,output=None):
+    writer = ReportWriter(AGGR_COLUMNS,path=output)
+    for rows in aiqum_aggregate_batches(cnx):
+        writer.write_batch(rows)
+    writer.close()
 
     return 1
 
@@ -81,23 +82,52 @@ def aiqum_aggregates(cnx):
 # MAIN
 # -----------------------------------------------------------------------------
 
-# Parse the command line
-parser = ArgumentParser(
-    usage="%(prog)s [options]",
-    description="Sample code to pull aggr details from the AIQUM Datbase."
-)
-parser.add_argument(
-    '-a', '--aiqumhost', nargs='?', required=True, help='AIQUM Host'
-)
-parser.add_argument(
-    '-u', '--username', nargs='?', required=True, help='AIQUM Username'
-)
-parser.add_argument(
-    '-p', '--password', nargs='?', help='Password for AIQUM username'
-)
-args = parser.parse_args()
-if not args.password: args.password = getpass()
+if __name__ == "__main__":
+    # Parse the command line
+    parser = ArgumentParser(
+        usage="%(prog)s [options]",
+        description="Sample code to pull aggr details from the AIQUM Datbase."
+    )
+    parser.add_argument(
+        '-a', '--aiqumhost', nargs='?',
+        help='AIQUM Host, or a CSV list of hosts to report on together'
+    )
+    parser.add_argument(
+        '-u', '--username', nargs='?', required=True, help='AIQUM Username'
+    )
+    parser.add_argument(
+        '-p', '--password', nargs='?', help='Password for AIQUM username'
+    )
+    aiqum_add_batch_args(parser)
+    aiqum_add_connection_args(parser)
+    aiqum_add_profile_args(parser)
+    aiqum_add_fleet_args(parser)
+    aiqum_add_delta_args(parser)
+    args = parser.parse_args()
+    aiqum_common.BATCH_SIZE = args.batch_size
+    aiqum_connection_options(args)
+    hosts = aiqum_fleet_hosts(parser,args)
+    if args.since_state and (len(hosts) > 1 or args.hosts_file):
+        parser.error("--since-state works with a single AIQUM host")
+    if not args.password: args.password = getpass()
+    aiqum_profile_start(args)
 
-# Connect to AIQUM and print the aggr details.
-cnx = aiqum_db_connect(args.aiqumhost,args.username,args.password)
-aiqum_aggregates(cnx)
+    # With several hosts, query them all at once and merge the aggr details.
+    # Otherwise connect to AIQUM and print the aggr details.
+    if len(hosts) > 1 or args.hosts_file:
+        failed = aiqum_fleet_report(hosts,args.username,args.password,
+                                    aiqum_aggregate_batches,AGGR_COLUMNS,
+                                    timeout=args.host_timeout)
+    else:
+        with aiqum_phase('connect'):
+            cnx = aiqum_db_connect(hosts[0],args.username,args.password)
+        cnx = aiqum_profile_connection(cnx)
+        if args.since_state:
+            aiqum_delta_report(cnx,aiqum_aggregate_batches,AGGR_COLUMNS,
+                               args.since_state)
+        else:
+            aiqum_aggregates(cnx)
+        failed = []
+    aiqum_profile_report(args)
+    if failed:
+        sys.exit(1)
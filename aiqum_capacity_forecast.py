@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+################################################################################
+#
+# This sample code shows how to keep periodic capacity snapshots of the
+# aggregates and volumes in the AIQUM Database in a local SQLite file, and
+# forecast from them how many days each has until it is full.
+#
+# Modes (all take --store FILE):
+#   snapshot - query the used and total size of every aggregate and volume
+#              (RW and DP, as in aiqum_volume_report.py) and add them to the
+#              store as one snapshot, e.g. daily from cron
+#   forecast - fit a linear trend of used space over the last --days of
+#              snapshots for every object and write the objects that are
+#              growing, ranked by days until they reach --threshold percent
+#
+# The trend is an ordinary least squares fit of used bytes against time.  It
+# is computed for all objects at once in a single SQL statement, from the
+# per-object sums of x, y, xx and xy, so that no Python code runs per object
+# or per snapshot.  Days until full are from the latest snapshot's used and
+# total size and the fitted growth per day.
+#
+# AIQUM Requirements:
+#   1. AIQUM 9.7 or higher.
+#   2. An AIQUM "Database User" account with the "Report Schema" role.
+#
+# Python Requirements:
+#   1. The mysql-connector-python module must be installed.
+#
+# AIQUM Database Schema documentation is on the NetApp Support Site:
+# https://mysupport.netapp.com/documentation/docweb/index.html?productID=63834
+#
+################################################################################
+
+import mysql.connector
+import aiqum_common
+from aiqum_common import aiqum_report_writer, aiqum_fetch_batches
+from aiqum_common import aiqum_add_batch_args, aiqum_db_connect
+from aiqum_common import aiqum_add_connection_args, aiqum_connection_options
+from aiqum_common import aiqum_open_sqlite
+from aiqum_common import aiqum_add_output_args, aiqum_check_output_args
+import sys
+import time
+from argparse import ArgumentParser
+from getpass import getpass
+
+# Store schema.  Objects are aggregates (container is the node) and volumes
+# (container is the vserver).  Snapshot times are epoch seconds, sizes bytes.
+STORE_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS object ("
+    "id INTEGER PRIMARY KEY,kind TEXT,cluster TEXT,container TEXT,name TEXT,"
+    "UNIQUE (kind,cluster,container,name))",
+    "CREATE TABLE IF NOT EXISTS snapshot (time INTEGER PRIMARY KEY)",
+    "CREATE TABLE IF NOT EXISTS usage ("
+    "time INTEGER,object INTEGER,used INTEGER,total INTEGER,"
+    "PRIMARY KEY (time,object)) WITHOUT ROWID",
+]
+
+# Queries for each kind of object: cluster, container and object names, used
+# and total bytes.
+CAPACITY_QUERIES = {
+    'aggr': ("SELECT cluster.name,node.name,aggr.name,"
+             "aggr.sizeUsed,aggr.sizeTotal "
+             "FROM aggregate AS aggr "
+             "INNER JOIN node ON aggr.nodeId = node.objid "
+             "INNER JOIN cluster ON aggr.clusterId = cluster.objid"),
+    'volume': ("SELECT cluster.name,vserver.name,vol.name,"
+               "vol.sizeUsed,vol.sizeTotal "
+               "FROM volume AS vol "
+               "INNER JOIN cluster ON vol.clusterId = cluster.objid "
+               "INNER JOIN vserver ON vol.vserverId = vserver.objid "
+               "WHERE (vol.volType='RW' or vol.volType='DP')"),
+}
+
+# Objects further than this from full, in days, are not reported: their
+# growth is too small to plan for (and their dates would not fit a datetime).
+FORECAST_MAX_DAYS = 3650
+
+# Report columns.
+FORECAST_COLUMNS = [("Kind","name"),("Cluster","name"),
+                    ("NodeOrVserver","name"),("Name","name"),
+                    ("Samples","int"),("Used(GB)","gb"),("Size(GB)","gb"),
+                    ("PercentUsed","float"),("Growth(GB/day)","float"),
+                    ("DaysUntilFull","float"),("FullDate","ms")]
+
+# Query AIQUM for the used and total size of the aggregates and volumes and
+# add them to the store as one snapshot taken now.  Objects without sizes are
+# skipped.  Returns the number of objects added.
+def aiqum_capacity_snapshot(cnx,store,keepdays=None):
+    now = int(time.time())
+    objects = {}
+    for row in store.execute("SELECT kind,cluster,container,name,id "
+                             "FROM object"):
+        objects[tuple(row[:4])] = row[4]
+
+    count = 0
+    with store:
+        store.execute("INSERT OR IGNORE INTO snapshot (time) VALUES (?)",
+                      (now,))
+        for kind, query in CAPACITY_QUERIES.items():
+            cursor = cnx.cursor(buffered=False)
+            cursor.execute(query)
+            for rows in aiqum_fetch_batches(cursor):
+                rows = [row for row in rows
+                        if row[3] is not None and row[4]]
+                new = [key for key in ((kind,) + tuple(row[:3])
+                                       for row in rows)
+                       if key not in objects]
+                if new:
+                    store.executemany("INSERT OR IGNORE INTO object "
+                                      "(kind,cluster,container,name) "
+                                      "VALUES (?,?,?,?)", new)
+                    for row in store.execute("SELECT kind,cluster,"
+                                             "container,name,id FROM object "
+                                             "WHERE id > ?",
+                                             (max(objects.values(),
+                                                  default=0),)):
+                        objects[tuple(row[:4])] = row[4]
+                store.executemany("INSERT OR REPLACE INTO usage "
+                                  "(time,object,used,total) VALUES (?,?,?,?)",
+                                  [(now, objects[(kind,) + tuple(row[:3])],
+                                    row[3], row[4]) for row in rows])
+                count += len(rows)
+            cursor.close()
+        if keepdays:
+            cutoff = now - keepdays * 86400
+            store.execute("DELETE FROM usage WHERE time < ?", (cutoff,))
+            store.execute("DELETE FROM snapshot WHERE time < ?", (cutoff,))
+
+    return count
+
+# Fit the used space trend of every object over the snapshots of the last
+# days and write the growing objects, soonest to fill first.  Full is
+# threshold percent of the total size.  Objects with fewer than minsamples
+# snapshots in the window, or that fill further out than within days (or
+# FORECAST_MAX_DAYS), are left out.
+def aiqum_capacity_forecast(store,days=30,threshold=100,minsamples=3,
+                            within=None,kind=None,fmt="csv",output=None):
+    now = int(time.time())
+    start = now - days * 86400
+    query = ("WITH fit AS ("
+             "SELECT object,COUNT(*) AS n,SUM(x) AS sx,SUM(used) AS sy,"
+             "SUM(x * x) AS sxx,SUM(x * used) AS sxy,MAX(time) AS last "
+             "FROM (SELECT object,time,used,(time - ?) / 86400.0 AS x "
+             "FROM usage WHERE time >= ?) "
+             "GROUP BY object HAVING COUNT(*) >= ?), "
+             "growth AS ("
+             "SELECT object,n,last,"
+             "(n * sxy - sx * sy) / (n * sxx - sx * sx) AS perday "
+             "FROM fit WHERE n * sxx - sx * sx > 0), "
+             "forecast AS ("
+             "SELECT growth.*,cur.used,cur.total,"
+             "(cur.total * ? / 100.0 - cur.used) / perday AS daysleft "
+             "FROM growth INNER JOIN usage AS cur "
+             "ON cur.time = growth.last AND cur.object = growth.object "
+             "WHERE perday > 0) "
+             "SELECT o.kind,o.cluster,o.container,o.name,n,used,total,"
+             "ROUND(100.0 * used / total,1),ROUND(perday / 1073741824,3),"
+             "ROUND(MAX(daysleft,0),1),"
+             "CAST((? + MAX(daysleft,0) * 86400) * 1000 AS INTEGER) "
+             "FROM forecast INNER JOIN object AS o ON forecast.object = o.id ")
+    if within is None or within > FORECAST_MAX_DAYS:
+        within = FORECAST_MAX_DAYS
+    query = query + "WHERE daysleft <= ? "
+    params = [start, start, minsamples, threshold, now, within]
+    if kind:
+        query = query + "AND o.kind = ? "
+        params.append(kind)
+    query = query + "ORDER BY daysleft,o.kind,o.cluster,o.container,o.name"
+
+    cursor = store.execute(query, params)
+    writer = aiqum_report_writer(FORECAST_COLUMNS,fmt,output)
+    while True:
+        rows = cursor.fetchmany(aiqum_common.BATCH_SIZE)
+        if not rows:
+            break
+        writer.write_batch(rows)
+    writer.close()
+
+    return 1
+
+# -----------------------------------------------------------------------------
+# MAIN
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    # Parse the command line
+    parser = ArgumentParser(
+        usage="%(prog)s --store FILE [snapshot|forecast] [options]",
+        description="Sample code to forecast aggr and volume capacity from the AIQUM Datbase."
+    )
+    parser.add_argument(
+        'mode', nargs='?', choices=['snapshot','forecast'],
+        default='snapshot', help='What to do (default snapshot)'
+    )
+    parser.add_argument(
+        '--store', required=True, help='SQLite file holding the snapshots'
+    )
+    parser.add_argument(
+        '-a', '--aiqumhost', nargs='?', help='AIQUM Host (snapshot)'
+    )
+    parser.add_argument(
+        '-u', '--username', nargs='?', help='AIQUM Username (snapshot)'
+    )
+    parser.add_argument(
+        '-p', '--password', nargs='?', help='Password for AIQUM username'
+    )
+    parser.add_argument(
+        '--keep-days', type=int, metavar='DAYS',
+        help='Delete snapshots older than this (snapshot, default keep all)'
+    )
+    parser.add_argument(
+        '--days', type=int, default=30,
+        help='Days of snapshots to fit the trend to (forecast, default 30)'
+    )
+    parser.add_argument(
+        '--threshold', type=float, default=100, metavar='PERCENT',
+        help='Percent used that counts as full (forecast, default 100)'
+    )
+    parser.add_argument(
+        '--min-samples', type=int, default=3,
+        help='Snapshots an object needs in the window (forecast, default 3)'
+    )
+    parser.add_argument(
+        '--within', type=float, metavar='DAYS',
+        help='Only objects full within this many days (forecast)'
+    )
+    parser.add_argument(
+        '--kind', choices=['aggr','volume'],
+        help='Only aggregates or only volumes (forecast, default both)'
+    )
+    aiqum_add_output_args(parser)
+    aiqum_add_batch_args(parser)
+    aiqum_add_connection_args(parser)
+    args = parser.parse_args()
+    aiqum_common.BATCH_SIZE = args.batch_size
+    aiqum_connection_options(args)
+    aiqum_check_output_args(parser,args)
+    if args.mode == 'snapshot' and not (args.aiqumhost and args.username):
+        parser.error("snapshot requires -a/--aiqumhost and -u/--username")
+    if args.min_samples < 2:
+        parser.error("--min-samples must be at least 2")
+
+    store = aiqum_open_sqlite(args.store,STORE_SCHEMA)
+    if args.mode == 'forecast':
+        aiqum_capacity_forecast(store,args.days,args.threshold,
+                                args.min_samples,args.within,args.kind,
+                                args.format,args.output)
+    else:
+        # Connect to AIQUM and take a capacity snapshot.
+        if not args.password: args.password = getpass()
+        cnx = aiqum_db_connect(args.aiqumhost,args.username,args.password)
+        count = aiqum_capacity_snapshot(cnx,store,args.keep_days)
+        print("Added %i aggregates and volumes." % count, file=sys.stderr)
+    store.close()
@@ -0,0 +1,1205 @@
+################################################################################
+#
+# Shared helpers for the AIQUM sample scripts.
+#
+# This module is imported by the report scripts in this directory and is not
+# meant to be run directly.
+#
+################################################################################
+
+import mysql.connector
+import mysql.connector.pooling
+import sys
+import os
+import io
+import csv
+import gzip
+import json
+import time
+import pickle
+import random
+import sqlite3
+import hashlib
+import datetime
+import tempfile
+import threading
+import contextlib
+from array import array
+from bisect import bisect_left
+from itertools import islice
+
+# pyarrow is only needed for Parquet output.
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Rows per cursor fetchmany() call and per writer batch.
+BATCH_SIZE = 10000
+
+# Report output formats.
+FORMATS = ("csv", "csv.gz", "parquet")
+
+# Output buffer size for report files and stdout.
+WRITE_BUFFER = 1024 * 1024
+
+# -----------------------------------------------------------------------------
+# Connections
+# -----------------------------------------------------------------------------
+
+# Connection options, set from the command line by aiqum_connection_options().
+# The timeouts are in seconds, None for the connector's defaults.  With
+# COMPRESS the connection asks for protocol compression, which the server
+# uses if it supports it.  Failed connects and statements are retried up to
+# RETRIES times, RETRY_DELAY seconds after the first failure and doubling up
+# to RETRY_DELAY_MAX.
+CONNECT_TIMEOUT = None
+READ_TIMEOUT = None
+COMPRESS = False
+RETRIES = 4
+RETRY_DELAY = 1
+RETRY_DELAY_MAX = 30
+
+# MySQL errors worth retrying: the server could not be reached, went away,
+# dropped the connection or had too many, or a statement lost a deadlock or
+# timed out waiting for a lock.
+RETRY_ERRORS = (2002, 2003, 2006, 2013, 1040, 1205, 1213)
+
+# Return the mysql.connector.connect() arguments for an AIQUM host, which may
+# be given as host:port.
+def aiqum_connect_args(aiq_host,aiq_user,aiq_password,aiq_db):
+    args = {'host': aiq_host, 'user': aiq_user, 'password': aiq_password,
+            'database': aiq_db}
+    if aiq_host.count(":") == 1:
+        args['host'], port = aiq_host.split(":")
+        args['port'] = int(port)
+    if CONNECT_TIMEOUT:
+        args['connection_timeout'] = CONNECT_TIMEOUT
+    if READ_TIMEOUT:
+        args['read_timeout'] = READ_TIMEOUT
+    if COMPRESS:
+        args['compress'] = True
+    return args
+
+# Return whether a failed connect or statement is worth retrying.  A pool
+# reconnects a dropped connection when it is taken, with the connector's
+# reconnect(), which raises the connect error as the cause of its own.
+def aiqum_retryable(error):
+    if isinstance(error, (mysql.connector.errors.ConnectionTimeoutError,
+                          mysql.connector.errors.ReadTimeoutError,
+                          mysql.connector.errors.WriteTimeoutError)):
+        return True
+    if isinstance(error.__cause__, mysql.connector.Error):
+        return aiqum_retryable(error.__cause__)
+    return error.errno in RETRY_ERRORS
+
+# Return function(), calling it again after a backoff delay when it fails
+# with a retryable error, up to RETRIES times.  what names the operation in
+# the messages on stderr.  The delays are jittered so that parallel workers
+# do not retry in step.
+def aiqum_retry(function,what):
+    attempt = 0
+    while True:
+        try:
+            return function()
+        except mysql.connector.Error as error:
+            if attempt >= RETRIES or not aiqum_retryable(error):
+                raise
+            delay = (min(RETRY_DELAY * 2 ** attempt, RETRY_DELAY_MAX) *
+                     random.uniform(0.5, 1.0))
+            attempt += 1
+            print("%s failed (%s), retry %i of %i in %.1fs."
+                  % (what, error, attempt, RETRIES, delay), file=sys.stderr)
+            time.sleep(delay)
+
+# Cursor that re-runs a failed statement on a reconnected connection.  The
+# real cursor is only made inside the retried execute(), from a connection
+# that is known to be up: after a drop, mysql.connector refuses to make a
+# cursor with an error that says nothing about why.  Only execute() is
+# retried: once rows have been fetched from a result they cannot be taken
+# back, so an error while fetching is raised to the caller, but it marks the
+# connection for a reconnect before the next statement.  The scripts only
+# read, so running a statement again is safe.
+class ResilientCursor:
+    def __init__(self, connection, args, kwargs):
+        self.connection = connection
+        self.args = args
+        self.kwargs = kwargs
+        self.cursor = None
+        self.generation = None
+
+    def execute(self, query, params=None):
+        connection = self.connection
+        def run():
+            try:
+                if connection.down():
+                    connection.reconnect()
+                if self.generation != connection.generation:
+                    self.cursor = connection.cnx.cursor(*self.args,
+                                                        **self.kwargs)
+                    self.generation = connection.generation
+                return self.cursor.execute(query, params)
+            except mysql.connector.Error as error:
+                connection.failed = aiqum_retryable(error)
+                raise
+        result = aiqum_retry(run,"Query")
+        if query.lstrip()[:4].upper() == "SET ":
+            connection.session[query] = params
+        return result
+
+    # Call a fetch method of the real cursor, marking the connection for a
+    # reconnect if it fails with a retryable error.
+    def fetch(self, method, *args):
+        try:
+            return getattr(self.cursor, method)(*args)
+        except mysql.connector.Error as error:
+            if aiqum_retryable(error):
+                self.connection.failed = True
+            raise
+
+    def fetchone(self):
+        return self.fetch("fetchone")
+
+    def fetchmany(self, size=1):
+        return self.fetch("fetchmany", size)
+
+    def fetchall(self):
+        return self.fetch("fetchall")
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def close(self):
+        if self.cursor is not None:
+            self.cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+# Connection whose cursors are ResilientCursors.  The SET statements run on
+# it are kept (once each, by statement text, as the reports repeat them per
+# cluster) and run again after a reconnect, so that session settings (e.g.
+# group_concat_max_len) survive.  failed is set when a statement or fetch
+# lost the connection, and generation counts the reconnects, so that cursors
+# made before one are made again.  Everything else is passed to the wrapped
+# connection.
+class ResilientConnection:
+    def __init__(self, cnx):
+        self.cnx = cnx
+        self.session = {}
+        self.failed = False
+        self.generation = 0
+
+    def cursor(self, *args, **kwargs):
+        return ResilientCursor(self, args, kwargs)
+
+    # Return whether the connection needs a reconnect.  is_connected() pings
+    # the server, which cannot be done while a result is still being read, so
+    # a connection in the middle of a result counts as up.
+    def down(self):
+        return self.failed or (not self.cnx.unread_result and
+                               not self.cnx.is_connected())
+
+    # Reconnect and replay the session.  The connector's own reconnect() hides
+    # the error of a failed connect in one that cannot be told apart, so the
+    # connection is closed and opened here, for aiqum_retry() to see it.
+    def reconnect(self):
+        self.failed = True
+        self.generation += 1
+        self.cnx.disconnect()
+        self.cnx.connect()
+        cursor = self.cnx.cursor()
+        for query, params in self.session.items():
+            cursor.execute(query, params)
+        cursor.close()
+        self.failed = False
+
+    # Closing a dropped connection can fail (a pooled one resets its session
+    # first), but the connection is closed, or back in its pool, all the
+    # same, so the error is not raised.
+    def close(self):
+        try:
+            self.cnx.close()
+        except mysql.connector.Error:
+            pass
+
+    def __getattr__(self, name):
+        return getattr(self.cnx, name)
+
+# Connection pool whose connections are ResilientConnections.  Taking a
+# connection is retried, as the pool reconnects a connection that has
+# dropped while idle.
+class ResilientPool(mysql.connector.pooling.MySQLConnectionPool):
+    def get_connection(self):
+        return ResilientConnection(
+                   aiqum_retry(super().get_connection,"Connect"))
+
+# Connection setup for AIQUM, with the connection options above.  The
+# connect is retried, and so are the connection's statements (see
+# ResilientCursor).
+def aiqum_db_connect(aiq_host,aiq_user,aiq_password,
+                     aiq_db="netapp_model_view"):
+    args = aiqum_connect_args(aiq_host,aiq_user,aiq_password,aiq_db)
+    try:
+        cnx = aiqum_retry(lambda: mysql.connector.connect(**args),"Connect")
+    except:
+        print()
+        print("Error connecting to AIQUM Database. Exiting.")
+        print()
+        raise
+
+    return ResilientConnection(cnx)
+
+# Connection pool setup for AIQUM, for scripts that run queries in parallel.
+def aiqum_db_pool(aiq_host,aiq_user,aiq_password,aiq_db,size,
+                  pool_name="aiqum"):
+    args = aiqum_connect_args(aiq_host,aiq_user,aiq_password,aiq_db)
+    try:
+        pool = aiqum_retry(lambda: ResilientPool(pool_name=pool_name,
+                                                 pool_size=size,**args),
+                           "Connect")
+    except:
+        print()
+        print("Error connecting to AIQUM Database. Exiting.")
+        print()
+        raise
+
+    return pool
+
+# Add the connection options to a script's parser.
+def aiqum_add_connection_args(parser):
+    parser.add_argument(
+        '--connect-timeout', type=int, metavar='SECONDS',
+        help='Give up connecting to AIQUM after this long'
+    )
+    parser.add_argument(
+        '--read-timeout', type=int, metavar='SECONDS',
+        help='Give up waiting for AIQUM to send data after this long'
+    )
+    parser.add_argument(
+        '--retries', type=int, default=RETRIES,
+        help='Retry a failed connect or statement this many times, with '
+             'exponential backoff (default %i)' % RETRIES
+    )
+    parser.add_argument(
+        '--compress', action='store_true',
+        help='Ask AIQUM for a compressed connection (for large reports over '
+             'slow links)'
+    )
+
+# Set the connection options from the parsed arguments.
+def aiqum_connection_options(args):
+    global CONNECT_TIMEOUT, READ_TIMEOUT, COMPRESS, RETRIES
+    CONNECT_TIMEOUT = args.connect_timeout
+    READ_TIMEOUT = args.read_timeout
+    COMPRESS = args.compress
+    RETRIES = args.retries
+
+# Compact map of volume objids and QoS workload objids to the cluster, vserver
+# and volume names, for estates with hundreds of thousands of volumes.
+#
+# Names are interned once in a single name table and each volume is a row of
+# four parallel arrays (volume objid and the name table index of its cluster,
+# vserver and volume name).  QoS objids are kept in a sorted array alongside
+# the volume row they resolve to, so a lookup is a binary search and no
+# per-volume Python objects are kept.
+#
+# Build the map with add_volume() and add_qos(), then call freeze() once
+# before using lookup(), names() or cluster_qosids().
+class VolumeMap:
+    def __init__(self):
+        self.nametable = []
+        self.nameindex = {}
+        self.volids = array('q')
+        self.clusters = array('l')
+        self.vservers = array('l')
+        self.volumes = array('l')
+        self.qosids = array('q')
+        self.qosrows = array('l')
+        self.clusterqos = {}
+
+    def __len__(self):
+        return len(self.volids)
+
+    # Return the name table index for name, adding it if needed.
+    def intern(self, name):
+        index = self.nameindex.setdefault(name, len(self.nametable))
+        if index == len(self.nametable):
+            self.nametable.append(name)
+        return index
+
+    def add_volume(self, volid, cluster, vserver, name):
+        self.volids.append(volid)
+        self.clusters.append(self.intern(cluster))
+        self.vservers.append(self.intern(vserver))
+        self.volumes.append(self.intern(name))
+
+    # Record a QoS workload and its holder volume objid.  Until freeze() the
+    # volume objid is kept in qosrows and resolved to a row afterwards.
+    def add_qos(self, qosid, volid):
+        self.qosids.append(qosid)
+        self.qosrows.append(volid)
+
+    # Sort the volume rows by objid, resolve each QoS workload to its volume
+    # row (dropping workloads whose holder is not a known volume), sort the QoS
+    # workloads by objid and group them by cluster.
+    def freeze(self):
+        order = sorted(range(len(self.volids)), key=self.volids.__getitem__)
+        self.volids = array('q', (self.volids[x] for x in order))
+        self.clusters = array('l', (self.clusters[x] for x in order))
+        self.vservers = array('l', (self.vservers[x] for x in order))
+        self.volumes = array('l', (self.volumes[x] for x in order))
+
+        # A throwaway objid to row dict makes resolving the holders linear.
+        rows = dict(zip(self.volids, range(len(self.volids))))
+        pairs = sorted((qosid, rows[volid])
+                       for qosid, volid in zip(self.qosids, self.qosrows)
+                       if volid in rows)
+        del rows
+        self.qosids = array('q', (pair[0] for pair in pairs))
+        self.qosrows = array('l', (pair[1] for pair in pairs))
+
+        self.nameindex = {}
+        self.group_qosids()
+
+    # Group the sorted QoS objids by cluster name.
+    def group_qosids(self):
+        self.clusterqos = {}
+        for qosid, row in zip(self.qosids, self.qosrows):
+            cluster = self.nametable[self.clusters[row]]
+            if cluster not in self.clusterqos:
+                self.clusterqos[cluster] = array('q')
+            self.clusterqos[cluster].append(qosid)
+
+    # Binary search for value in a sorted array, returning its index or -1.
+    @staticmethod
+    def find(values, value):
+        index = bisect_left(values, value)
+        if index < len(values) and values[index] == value:
+            return index
+        return -1
+
+    # Return the volume row for a QoS objid, or -1 if it is not a volume
+    # workload.
+    def lookup(self, qosid):
+        index = self.find(self.qosids, qosid)
+        if index < 0:
+            return -1
+        return self.qosrows[index]
+
+    # Return (cluster, vserver, volume) names for a volume row.
+    def names(self, row):
+        nametable = self.nametable
+        return (nametable[self.clusters[row]],
+                nametable[self.vservers[row]],
+                nametable[self.volumes[row]])
+
+    # Return the sorted QoS objids of the volume workloads in a cluster.
+    def cluster_qosids(self, cluster):
+        return self.clusterqos.get(cluster, array('q'))
+
+    # Plain lists for serializing a frozen map, e.g. to JSON.
+    def to_dict(self):
+        return {'nametable': self.nametable,
+                'volids': self.volids.tolist(),
+                'clusters': self.clusters.tolist(),
+                'vservers': self.vservers.tolist(),
+                'volumes': self.volumes.tolist(),
+                'qosids': self.qosids.tolist(),
+                'qosrows': self.qosrows.tolist()}
+
+    # Load a frozen map from the output of to_dict().
+    def load(self, data):
+        self.nametable = data['nametable']
+        self.volids = array('q', data['volids'])
+        self.clusters = array('l', data['clusters'])
+        self.vservers = array('l', data['vservers'])
+        self.volumes = array('l', data['volumes'])
+        self.qosids = array('q', data['qosids'])
+        self.qosrows = array('l', data['qosrows'])
+        self.group_qosids()
+
+# -----------------------------------------------------------------------------
+# Report output
+# -----------------------------------------------------------------------------
+
+# Column conversions for CSV output, by column kind.  A report describes its
+# columns as (header, kind) pairs; columns without a kind, or with one of the
+# kinds name, str, int and float (which only matter for typed formats such as
+# Parquet), are written as is.
+#   gb   - bytes as GB with one decimal
+#   gb0  - as gb, but 0 when the value is missing or zero
+#   kbgb - KB as GB with one decimal (quota limits and usage)
+#   ms   - epoch milliseconds as local date and time
+#   lag  - seconds as a duration, blank when missing or zero
+#   list - comma separated list, written with semicolons
+def fmt_gb(value):
+    return "%.1f" % (value / (1024*1024*1024))
+
+def fmt_gb0(value):
+    if value:
+        return "%.1f" % (value / (1024*1024*1024))
+    return 0
+
+def fmt_kbgb(value):
+    return "%.1f" % (value / (1024*1024))
+
+def fmt_ms(value):
+    return datetime.datetime.fromtimestamp(int(value / 1000))
+
+def fmt_lag(value):
+    if value:
+        return str(datetime.timedelta(seconds=value)).replace(",", "")
+    return ""
+
+def fmt_list(value):
+    return str(value).replace(",", ";")
+
+CSV_CONVERSIONS = {
+    'gb': fmt_gb,
+    'gb0': fmt_gb0,
+    'kbgb': fmt_kbgb,
+    'ms': fmt_ms,
+    'lag': fmt_lag,
+    'list': fmt_list,
+}
+
+# The writers convert a whole column of a batch at a time.  The batch versions
+# below give the same text as the fmt_ functions, without a function call per
+# value; the rest are the fmt_ functions mapped over the column.
+def batch_gb(values):
+    return ["%.1f" % (value / 1073741824) for value in values]
+
+def batch_gb0(values):
+    return ["%.1f" % (value / 1073741824) if value else 0
+            for value in values]
+
+def batch_kbgb(values):
+    return ["%.1f" % (value / 1048576) for value in values]
+
+# Epoch milliseconds repeat a lot: every sample of a perf interval has the
+# same timestamp, and every volume of a cluster the same lastUpdateTime.  Each
+# distinct value is converted to its date and time text once, and kept in
+# MS_CACHE for later batches (up to MS_CACHE_MAX values).
+MS_CACHE = {}
+MS_CACHE_MAX = 100000
+
+def batch_ms(values):
+    if len(MS_CACHE) > MS_CACHE_MAX:
+        MS_CACHE.clear()
+    for value in set(values).difference(MS_CACHE):
+        MS_CACHE[value] = str(fmt_ms(value))
+    return list(map(MS_CACHE.__getitem__, values))
+
+BATCH_CONVERSIONS = {
+    'gb': batch_gb,
+    'gb0': batch_gb0,
+    'kbgb': batch_kbgb,
+    'ms': batch_ms,
+}
+
+# Return the batch conversion for a column kind, or None.
+def batch_conversion(kind):
+    if kind in BATCH_CONVERSIONS:
+        return BATCH_CONVERSIONS[kind]
+    if kind in CSV_CONVERSIONS:
+        convert = CSV_CONVERSIONS[kind]
+        return lambda values: list(map(convert, values))
+    return None
+
+# Return the pct percentile of a list of numbers, interpolating linearly
+# between the closest ranks (the same method as numpy's default).
+def aiqum_percentile(values,pct):
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+# Return a parenthesized list of %s placeholders for the values, for a
+# parameterized IN (...) clause.
+def aiqum_in_list(values):
+    return "(" + ",".join(["%s"] * len(values)) + ")"
+
+# Yield lists of up to size (default BATCH_SIZE) rows from a cursor using
+# fetchmany().  Used with unbuffered cursors, only one batch of the result is
+# held in memory at a time.
+def aiqum_fetch_batches(cursor,size=None):
+    size = size or BATCH_SIZE
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield rows
+
+# Buffered CSV writer shared by the reports.  Rows are written in batches;
+# each batch is converted a column at a time and handed to csv.writer in one
+# writerows() call, which also takes care of quoting.
+#
+# stream defaults to a large buffer over stdout.  With path, a file is opened
+# (and closed by close()).  header=False skips the header row, for appending.
+# compress=True gzips the output written to path or stdout.
+class ReportWriter:
+    def __init__(self, columns, stream=None, path=None, header=True,
+                 compress=False):
+        self.conversions = [(index, batch_conversion(column[1]))
+                            for index, column in enumerate(columns)
+                            if batch_conversion(column[1])]
+        self.owned = stream is None
+        if path and compress:
+            stream = gzip.open(path, "wt", compresslevel=6, newline="")
+        elif path:
+            stream = open(path, "w", buffering=WRITE_BUFFER, newline="")
+        elif stream is None:
+            sys.stdout.flush()
+            if compress:
+                stream = io.TextIOWrapper(
+                             gzip.GzipFile(fileobj=sys.stdout.buffer,
+                                           mode="wb", compresslevel=6),
+                             encoding=sys.stdout.encoding, newline="")
+            else:
+                stream = open(sys.stdout.fileno(), "w",
+                              buffering=WRITE_BUFFER,
+                              encoding=sys.stdout.encoding, newline="",
+                              closefd=False)
+        self.stream = stream
+        self.counter = None
+        if PROFILE is not None:
+            self.counter = stream = CountingStream(stream)
+        self.writer = csv.writer(stream, lineterminator="\n")
+        self.rows = 0
+        if header:
+            with aiqum_phase('write'):
+                self.writer.writerow([column[0] for column in columns])
+
+    # Convert and write one batch (a list of row sequences).  convert=False
+    # writes the values as they are, e.g. for rows that are mostly None.
+    def write_batch(self, rows, convert=True):
+        if not rows:
+            return
+        self.rows += len(rows)
+        if self.counter is not None:
+            return self.profile_batch(rows, convert)
+        if self.conversions and convert:
+            columns = list(zip(*rows))
+            for index, convert in self.conversions:
+                columns[index] = convert(columns[index])
+            rows = zip(*columns)
+        self.writer.writerows(rows)
+
+    # write_batch() when profiling: the conversions are done up front rather
+    # than as the rows are written, so that the two can be timed apart.
+    def profile_batch(self, rows, convert=True):
+        with aiqum_phase('convert', len(rows)):
+            if self.conversions and convert:
+                columns = list(zip(*rows))
+                for index, convert in self.conversions:
+                    columns[index] = convert(columns[index])
+                rows = list(zip(*columns))
+        count = self.counter.count
+        start = time.perf_counter()
+        self.writer.writerows(rows)
+        PROFILE.add('write', time.perf_counter() - start, len(rows),
+                    self.counter.count - count)
+
+    # Write any iterable of rows, in batches of BATCH_SIZE.
+    def write_rows(self, rows):
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, BATCH_SIZE))
+            if not batch:
+                return
+            self.write_batch(batch)
+
+    def flush(self):
+        with aiqum_phase('write'):
+            self.stream.flush()
+
+    def close(self):
+        with aiqum_phase('write'):
+            if self.owned:
+                self.stream.close()
+            else:
+                self.stream.flush()
+
+# Typed column conversions for Parquet output, by column kind.  Sizes are
+# written as unrounded GB, times as epoch seconds and durations as seconds.
+def typed_gb(value):
+    if value is None:
+        return None
+    return value / (1024*1024*1024)
+
+def typed_gb0(value):
+    if value:
+        return value / (1024*1024*1024)
+    return 0.0
+
+def typed_kbgb(value):
+    if value is None:
+        return None
+    return value / (1024*1024)
+
+def typed_ms(value):
+    if value is None:
+        return None
+    return int(value // 1000)
+
+def typed_float(value):
+    if value is None:
+        return None
+    return float(value)
+
+TYPED_CONVERSIONS = {
+    'gb': typed_gb,
+    'gb0': typed_gb0,
+    'kbgb': typed_kbgb,
+    'ms': typed_ms,
+    'float': typed_float,
+    'list': fmt_list,
+}
+
+# Arrow type per column kind; kinds not listed are strings.
+def arrow_type(kind):
+    if kind == 'name':
+        return pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    if kind in ('gb', 'gb0', 'kbgb', 'float'):
+        return pyarrow.float64()
+    if kind in ('ms', 'lag', 'int'):
+        return pyarrow.int64()
+    return pyarrow.string()
+
+# Parquet writer with the same interface as ReportWriter.  Each batch becomes
+# a row group of typed columns, with names (kind "name") dictionary encoded.
+class ParquetReportWriter(ReportWriter):
+    def __init__(self, columns, path):
+        self.kinds = [column[1] for column in columns]
+        self.schema = pyarrow.schema([(column[0], arrow_type(column[1]))
+                                      for column in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        self.path = path
+        self.rows = 0
+
+    def write_batch(self, rows, convert=True):
+        if not rows:
+            return
+        self.rows += len(rows)
+        with aiqum_phase('convert', len(rows)):
+            table = self.typed_table(rows, convert)
+        with aiqum_phase('write', len(rows)):
+            self.writer.write_table(table)
+
+    # Convert a batch to a table of typed columns.
+    def typed_table(self, rows, convert=True):
+        arrays = []
+        for kind, field, values in zip(self.kinds, self.schema,
+                                       zip(*rows)):
+            if convert and kind in TYPED_CONVERSIONS:
+                values = map(TYPED_CONVERSIONS[kind], values)
+            elif kind not in ('int', 'lag'):
+                values = (None if value is None else str(value)
+                          for value in values)
+            if kind == 'name':
+                arrays.append(pyarrow.array(values, pyarrow.string())
+                              .dictionary_encode())
+            else:
+                arrays.append(pyarrow.array(values, field.type))
+        return pyarrow.Table.from_arrays(arrays, schema=self.schema)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        start = time.perf_counter()
+        self.writer.close()
+        if PROFILE is not None:
+            PROFILE.add('write', time.perf_counter() - start,
+                        nbytes=os.path.getsize(self.path))
+
+# Return the writer for a report format: a ReportWriter for csv and csv.gz,
+# or a ParquetReportWriter for parquet (which needs a path).
+def aiqum_report_writer(columns, fmt="csv", path=None):
+    if fmt == "parquet":
+        return ParquetReportWriter(columns, path)
+    return ReportWriter(columns, path=path, compress=(fmt == "csv.gz"))
+
+# Add the -b/--batch-size option to a report's parser.  The script sets
+# aiqum_common.BATCH_SIZE from it.
+def aiqum_add_batch_args(parser):
+    parser.add_argument(
+        '-b', '--batch-size', type=int, default=BATCH_SIZE,
+        help='Rows fetched and written per batch (default %i)' % BATCH_SIZE
+    )
+
+# Add the -o/--output and -f/--format options to a report's parser.
+def aiqum_add_output_args(parser):
+    parser.add_argument(
+        '-o', '--output', help='Write the report to this file instead of stdout'
+    )
+    parser.add_argument(
+        '-f', '--format', choices=FORMATS, default="csv",
+        help='Output format (default csv; parquet requires pyarrow and -o)'
+    )
+
+# Check the -o/--output and -f/--format options after parsing.
+def aiqum_check_output_args(parser, args):
+    if args.format == "parquet":
+        if pyarrow is None:
+            parser.error("--format parquet requires the pyarrow module")
+        if not args.output:
+            parser.error("--format parquet requires -o/--output")
+
+# -----------------------------------------------------------------------------
+# Profiling
+# -----------------------------------------------------------------------------
+
+# Per-phase instrumentation for --profile and --stats-json.  It is off (None)
+# unless a script calls aiqum_profile_start().  The phases are:
+#   connect - opening connections, and taking them from a pool
+#   query   - cursor execute() calls
+#   fetch   - fetching rows, with the row count and approximate bytes
+#   convert - the writers' column conversions
+#   write   - writing and flushing the output, with the bytes written
+#             (before compression for csv.gz; the file size for Parquet)
+# Each SQL statement is also recorded with its own execute and fetch times.
+# Scripts can time other steps as phases of their own with aiqum_phase().
+PROFILE = None
+
+# Longest SQL text kept per statement in the summary.
+PROFILE_SQL_MAX = 240
+
+class Profile:
+    def __init__(self):
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.phases = {}
+        self.statements = []
+
+    # Add to a phase's totals.
+    def add(self, phase, seconds, rows=0, nbytes=0):
+        with self.lock:
+            if phase not in self.phases:
+                self.phases[phase] = {'seconds': 0.0, 'calls': 0,
+                                      'rows': 0, 'bytes': 0}
+            stats = self.phases[phase]
+            stats['seconds'] += seconds
+            stats['calls'] += 1
+            stats['rows'] += rows
+            stats['bytes'] += nbytes
+
+    # Record a new statement and return its entry, which the cursor updates
+    # as rows are fetched.
+    def statement(self, query, seconds):
+        entry = {'sql': " ".join(query.split())[:PROFILE_SQL_MAX],
+                 'execute_seconds': seconds, 'fetch_seconds': 0.0,
+                 'rows': 0, 'bytes': 0}
+        with self.lock:
+            self.statements.append(entry)
+        return entry
+
+    def summary(self):
+        with self.lock:
+            return {'script': os.path.basename(sys.argv[0]),
+                    'started': datetime.datetime.fromtimestamp(
+                                   self.started).isoformat(),
+                    'seconds': time.time() - self.started,
+                    'phases': self.phases,
+                    'statements': self.statements}
+
+# Time a block as a phase, when profiling.
+@contextlib.contextmanager
+def aiqum_phase(phase, rows=0, nbytes=0):
+    if PROFILE is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        PROFILE.add(phase, time.perf_counter() - start, rows, nbytes)
+
+# Approximate size of fetched rows: the length of each text value, and eight
+# bytes for anything else.
+def row_bytes(rows):
+    return sum(len(value) if isinstance(value, (str, bytes, bytearray))
+               else 8
+               for row in rows for value in row)
+
+# Cursor wrapper that records each statement and its fetches.  Iterating over
+# the cursor fetches BATCH_SIZE rows at a time.
+class ProfiledCursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.entry = None
+
+    def execute(self, query, params=None):
+        start = time.perf_counter()
+        result = self.cursor.execute(query, params)
+        seconds = time.perf_counter() - start
+        PROFILE.add('query', seconds)
+        self.entry = PROFILE.statement(query, seconds)
+        return result
+
+    def fetched(self, start, rows):
+        seconds = time.perf_counter() - start
+        nbytes = row_bytes(rows)
+        PROFILE.add('fetch', seconds, len(rows), nbytes)
+        if self.entry is not None:
+            self.entry['fetch_seconds'] += seconds
+            self.entry['rows'] += len(rows)
+            self.entry['bytes'] += nbytes
+        return rows
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self.cursor.fetchone()
+        self.fetched(start, [row] if row is not None else [])
+        return row
+
+    def fetchmany(self, size=1):
+        start = time.perf_counter()
+        return self.fetched(start, self.cursor.fetchmany(size))
+
+    def fetchall(self):
+        start = time.perf_counter()
+        return self.fetched(start, self.cursor.fetchall())
+
+    def __iter__(self):
+        return (row for rows in aiqum_fetch_batches(self) for row in rows)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+# Connection wrapper that hands out ProfiledCursors.
+class ProfiledConnection:
+    def __init__(self, cnx):
+        self.cnx = cnx
+
+    def cursor(self, *args, **kwargs):
+        return ProfiledCursor(self.cnx.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self.cnx, name)
+
+# Pool wrapper that times get_connection() and hands out
+# ProfiledConnections.
+class ProfiledPool:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def get_connection(self):
+        with aiqum_phase('connect'):
+            return ProfiledConnection(self.pool.get_connection())
+
+    def __getattr__(self, name):
+        return getattr(self.pool, name)
+
+# Return cnx (a connection or a pool) wrapped for profiling, or as is when
+# not profiling.
+def aiqum_profile_connection(cnx):
+    if PROFILE is None:
+        return cnx
+    if isinstance(cnx, mysql.connector.pooling.MySQLConnectionPool):
+        return ProfiledPool(cnx)
+    return ProfiledConnection(cnx)
+
+# Output stream wrapper that counts the characters written through it.
+class CountingStream:
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def write(self, text):
+        self.count += len(text)
+        return self.stream.write(text)
+
+# Add the --profile and --stats-json options to a report's parser.
+def aiqum_add_profile_args(parser):
+    parser.add_argument(
+        '--profile', action='store_true',
+        help='Print per-phase timings, row and byte counts as JSON to stderr'
+    )
+    parser.add_argument(
+        '--stats-json', metavar='FILE',
+        help='Write the --profile JSON summary to FILE instead'
+    )
+
+# Turn profiling on if --profile or --stats-json was given.
+def aiqum_profile_start(args):
+    global PROFILE
+    if args.profile or args.stats_json:
+        PROFILE = Profile()
+
+# Write the profile summary to --stats-json, or to stderr.
+def aiqum_profile_report(args):
+    if PROFILE is None:
+        return
+    summary = PROFILE.summary()
+    if args.stats_json:
+        with open(args.stats_json, "w") as f:
+            json.dump(summary, f, indent=1)
+    else:
+        json.dump(summary, sys.stderr, indent=1)
+        print(file=sys.stderr)
+
+# -----------------------------------------------------------------------------
+# Fleet reports
+# -----------------------------------------------------------------------------
+
+# Default time limit in seconds for each AIQUM host in a fleet report.
+FLEET_TIMEOUT = 600
+
+# Add the --hosts-file and --host-timeout options to a report's parser, for
+# running it against several AIQUM hosts (given to -a as a CSV list, or one per
+# line in the hosts file).
+def aiqum_add_fleet_args(parser):
+    parser.add_argument(
+        '--hosts-file', metavar='FILE',
+        help='Query the AIQUM hosts listed in FILE, one per line'
+    )
+    parser.add_argument(
+        '--host-timeout', type=int, default=FLEET_TIMEOUT, metavar='SECONDS',
+        help='Give up on a host after this long (default %i)' % FLEET_TIMEOUT
+    )
+
+# Return the list of AIQUM hosts from -a and --hosts-file.
+def aiqum_fleet_hosts(parser, args):
+    hosts = []
+    if args.aiqumhost:
+        hosts = [host for host in args.aiqumhost.split(",") if host]
+    if args.hosts_file:
+        with open(args.hosts_file) as f:
+            for line in f:
+                line = line.split("#")[0].strip()
+                if line:
+                    hosts.append(line)
+    if not hosts:
+        parser.error("one of -a/--aiqumhost or --hosts-file is required")
+    return hosts
+
+# Fleet worker: run a report's query on one host and spool its batches, each
+# row prefixed with the host name, to a temporary file.  The connect and every
+# read from the server time out on the same deadline (connection_timeout only
+# covers the connect with the C extension), and the fetch stops once the
+# deadline has passed.
+def aiqum_fleet_host(host,user,password,batches,deadline):
+    args = aiqum_connect_args(host,user,password,"netapp_model_view")
+    remaining = max(1, int(deadline - time.time()))
+    args['connection_timeout'] = remaining
+    args['read_timeout'] = min(args.get('read_timeout', remaining), remaining)
+    with aiqum_phase('connect'):
+        cnx = mysql.connector.connect(**args)
+    cnx = aiqum_profile_connection(cnx)
+    spool = tempfile.TemporaryFile()
+    try:
+        for rows in batches(cnx):
+            if time.time() > deadline:
+                raise TimeoutError("timed out")
+            pickle.dump([(host,) + tuple(row) for row in rows], spool)
+    except:
+        spool.close()
+        raise
+    finally:
+        cnx.close()
+    spool.seek(0)
+    return spool
+
+# Run a report against several AIQUM hosts at once and write the merged rows,
+# host by host in the order given, with an AIQUMHost column first.
+# batches(cnx) yields the report's rows in batches and columns describes them.
+# A host that fails, or has not finished within timeout seconds, is reported
+# on stderr and left out.  Returns the list of hosts that were left out.
+#
+# Each host runs in a daemon thread rather than a thread pool, whose threads
+# are joined when the interpreter exits: a host that hangs past the deadline
+# must not keep the script from exiting.
+def aiqum_fleet_report(hosts,user,password,batches,columns,fmt="csv",
+                       output=None,timeout=FLEET_TIMEOUT):
+    deadline = time.time() + timeout
+    writer = aiqum_report_writer([("AIQUMHost","name")] + columns,fmt,output)
+    failed = []
+    results = {}
+    def run(host):
+        try:
+            results[host] = (aiqum_fleet_host(host,user,password,batches,
+                                              deadline), None)
+        except BaseException as error:
+            results[host] = (None, error)
+    threads = [(host, threading.Thread(target=run, args=(host,), daemon=True))
+               for host in hosts]
+    for host, thread in threads:
+        thread.start()
+    for host, thread in threads:
+        thread.join(max(0, deadline - time.time()))
+        if thread.is_alive():
+            print("AIQUM host " + host + " timed out. Skipping.",
+                  file=sys.stderr)
+            failed.append(host)
+            continue
+        spool, error = results[host]
+        if isinstance(error, (mysql.connector.Error, OSError)):
+            print("Error querying AIQUM host " + host + ": " + str(error) +
+                  ". Skipping.", file=sys.stderr)
+            failed.append(host)
+            continue
+        elif error:
+            raise error
+        with spool:
+            while True:
+                try:
+                    writer.write_batch(pickle.load(spool))
+                except EOFError:
+                    break
+    writer.close()
+
+    return failed
+
+# -----------------------------------------------------------------------------
+# Delta reports
+# -----------------------------------------------------------------------------
+
+# Columns written before a report's own columns in a delta report.
+DELTA_COLUMNS = [("Change","name"),("ObjId","int")]
+
+# Atomically replace a JSON file.
+def aiqum_save_json(path,data):
+    tmpfile = path + ".tmp"
+    with open(tmpfile, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmpfile, path)
+
+# Load a delta state file: per cluster objid, the cluster name, its
+# lastUpdateTime and the objids and row digests seen in the last run, as
+# sorted parallel arrays.
+def aiqum_load_delta_state(statefile):
+    if not os.path.exists(statefile):
+        return {}
+    with open(statefile) as f:
+        data = json.load(f)
+    return {int(clusterid): {'name': cluster['name'],
+                             'lastUpdateTime': cluster['lastUpdateTime'],
+                             'objids': array('q', cluster['objids']),
+                             'digests': array('q', cluster['digests'])}
+            for clusterid, cluster in data['clusters'].items()}
+
+def aiqum_save_delta_state(statefile,state):
+    aiqum_save_json(statefile, {'clusters': {
+        str(clusterid): {'name': cluster['name'],
+                         'lastUpdateTime': cluster['lastUpdateTime'],
+                         'objids': cluster['objids'].tolist(),
+                         'digests': cluster['digests'].tolist()}
+        for clusterid, cluster in state.items()}})
+
+# 64-bit digest of a row's values, leaving out the ignored column indexes.
+def aiqum_row_digest(values,ignore):
+    text = repr([value for index, value in enumerate(values)
+                 if index not in ignore])
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8)
+                          .digest(), "big", signed=True)
+
+# Write only what changed since the last run, keyed by objid, with a Change
+# column of added, changed or removed and an ObjId column first.
+#
+# Clusters whose lastUpdateTime has not moved since the state was saved are
+# not queried at all.  For the others, batches(cnx,clusterids) yields their
+# rows with the row's objid and cluster objid appended, and each row is
+# compared with the digest saved for its objid.  The LastUpdated column is
+# left out of the digests, so a cluster update alone does not mark its rows
+# as changed.  Removed rows only have their cluster name (the first column).
+# The state file is replaced when the report is complete.
+def aiqum_delta_report(cnx,batches,columns,statefile,fmt="csv",output=None):
+    state = aiqum_load_delta_state(statefile)
+    cursor = cnx.cursor()
+    cursor.execute("SELECT objid,name,lastUpdateTime FROM cluster")
+    clusters = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+    cursor.close()
+    changed = [clusterid for clusterid in clusters
+               if clusterid not in state or
+               state[clusterid]['lastUpdateTime'] != clusters[clusterid][1]]
+    ignore = {index for index, column in enumerate(columns)
+              if column[0] == "LastUpdated"}
+    writer = aiqum_report_writer(DELTA_COLUMNS + columns,fmt,output)
+
+    # Compare the rows of the updated clusters with the saved digests.  The
+    # digests left over in old afterwards belong to removed rows.
+    old = {}
+    seen = {}
+    for clusterid in changed:
+        old[clusterid] = {}
+        if clusterid in state:
+            old[clusterid] = dict(zip(state[clusterid]['objids'],
+                                      state[clusterid]['digests']))
+        seen[clusterid] = {}
+    if changed:
+        for rows in batches(cnx,changed):
+            delta = []
+            for row in rows:
+                values = row[:-2]
+                objid = row[-2]
+                digest = aiqum_row_digest(values,ignore)
+                seen[row[-1]][objid] = digest
+                previous = old[row[-1]].pop(objid, None)
+                if previous is None:
+                    delta.append(("added",objid) + tuple(values))
+                elif previous != digest:
+                    delta.append(("changed",objid) + tuple(values))
+            writer.write_batch(delta)
+
+    # Rows of the updated clusters that are gone, and of removed clusters.
+    blank = (None,) * (len(columns) - 1)
+    for clusterid in changed:
+        writer.write_batch([("removed",objid,clusters[clusterid][0]) + blank
+                            for objid in old[clusterid]], convert=False)
+    for clusterid in state:
+        if clusterid not in clusters:
+            writer.write_batch([("removed",objid,state[clusterid]['name']) +
+                                blank
+                                for objid in state[clusterid]['objids']],
+                               convert=False)
+    writer.close()
+
+    # The saved state of unchanged clusters is kept as is.
+    newstate = {clusterid: state[clusterid] for clusterid in clusters
+                if clusterid not in seen}
+    for clusterid in changed:
+        objids = sorted(seen[clusterid])
+        newstate[clusterid] = {
+            'name': clusters[clusterid][0],
+            'lastUpdateTime': clusters[clusterid][1],
+            'objids': array('q', objids),
+            'digests': array('q', (seen[clusterid][objid]
+                                   for objid in objids))}
+    aiqum_save_delta_state(statefile,newstate)
+
+    return 1
+
+# Add the --since-state option to a report's parser.
+def aiqum_add_delta_args(parser):
+    parser.add_argument(
+        '--since-state', metavar='FILE',
+        help='Write only rows added, changed or removed since the run that '
+             'saved FILE (the first run writes every row as added)'
+    )
+
+# -----------------------------------------------------------------------------
+# Local stores
+# -----------------------------------------------------------------------------
+
+# Open (and if needed create) a local SQLite store, such as the snapmirror
+# lag history, the capacity snapshots or the quota index.  schema is a list
+# of CREATE ... IF NOT EXISTS statements.  The store is in WAL mode, so that
+# it can be read while a sample is being added.
+def aiqum_open_sqlite(path,schema):
+    store = sqlite3.connect(path)
+    store.execute("PRAGMA journal_mode=WAL")
+    for statement in schema:
+        store.execute(statement)
+    return store
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+
+################################################################################
+#
+# This sample code shows how to serve AIQUM Database details as Prometheus
+# metrics.  It runs as a daemon: each report is refreshed in the background on
+# its own interval, over a small pool of persistent connections, and the
+# /metrics endpoint serves the last refreshed snapshot from memory.  Scrapes
+# never query the database.
+#
+# Reports and metrics:
+#   aggr       - aiqum_aggregate_{used_percent,size_bytes,used_bytes,
+#                cloud_tier_used_bytes} (the aiqum_aggr_report.py query)
+#   snapmirror - aiqum_snapmirror_lag_seconds (the aiqum_snapmirror_report.py
+#                query)
+#   perf       - aiqum_volume_iops and aiqum_volume_throughput_bytes_per_second,
+#                the latest sample per volume of the -c clusters (the
+#                aiqum_volume_perf_report.py queries)
+# and, per report, aiqum_exporter_up, aiqum_exporter_refresh_seconds,
+# aiqum_exporter_last_refresh_timestamp_seconds and
+# aiqum_exporter_refresh_errors_total.
+#
+# AIQUM Requirements:
+#   1. AIQUM 9.7 or higher.
+#   2. An AIQUM "Database User" account with the "Report Schema" role.
+#
+# Python Requirements:
+#   1. The mysql-connector-python module must be installed.
+#
+# AIQUM Database Schema documentation is on the NetApp Support Site:
+# https://mysupport.netapp.com/documentation/docweb/index.html?productID=63834
+#
+################################################################################
+
+import mysql.connector
+from aiqum_common import VolumeMap, aiqum_db_pool
+from aiqum_common import aiqum_add_connection_args, aiqum_connection_options
+import aiqum_aggr_report
+import aiqum_snapmirror_report
+import aiqum_volume_perf_report
+import sys
+import time
+import threading
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from getpass import getpass
+
+# Default listen port for /metrics.
+PORT = 9430
+
+# Time the perf report's objid to name mappings are kept before they are
+# queried again, in seconds.
+PERF_MAP_TTL = 3600
+
+# When the perf mappings were last queried.
+perf_map_time = 0
+
+# Escape a Prometheus label value.
+def aiqum_label(value):
+    return (str(value).replace("\\", "\\\\").replace("\"", "\\\"")
+            .replace("\n", "\\n"))
+
+# Render gauge metrics from report rows.  labels is a list of (label name,
+# row index) and families a list of (metric name, help text, row index of the
+# value).  Rows with no value for a metric are left out of it.
+def aiqum_render_gauges(rows,labels,families):
+    labelsets = ["{" + ",".join("%s=\"%s\"" % (name, aiqum_label(row[index]))
+                                for name, index in labels) + "}"
+                 for row in rows]
+    text = []
+    for name, helptext, index in families:
+        text.append("# HELP %s %s\n# TYPE %s gauge\n" % (name, helptext, name))
+        for labelset, row in zip(labelsets, rows):
+            if row[index] is not None:
+                text.append("%s%s %r\n" % (name, labelset, float(row[index])))
+    return "".join(text)
+
+# Aggregate capacity, from the aggr report's query.
+def aiqum_refresh_aggr(cnx,args):
+    rows = [row for rows in aiqum_aggr_report.aiqum_aggregate_batches(cnx)
+            for row in rows]
+    return aiqum_render_gauges(
+               rows,
+               [("cluster",0),("node",1),("aggregate",3)],
+               [("aiqum_aggregate_used_percent",
+                 "Aggregate space used, percent.",4),
+                ("aiqum_aggregate_size_bytes","Aggregate size.",5),
+                ("aiqum_aggregate_used_bytes","Aggregate space used.",6),
+                ("aiqum_aggregate_cloud_tier_used_bytes",
+                 "Aggregate space used in the cloud tier.",7)])
+
+# SnapMirror lag, from the snapmirror report's query.
+def aiqum_refresh_snapmirror(cnx,args):
+    rows = [row for rows in
+            aiqum_snapmirror_report.aiqum_snapmirror_batches(cnx)
+            for row in rows]
+    return aiqum_render_gauges(
+               rows,
+               [("source_vserver",0),("source_volume",1),
+                ("destination_vserver",2),("destination_volume",3),
+                ("state",4)],
+               [("aiqum_snapmirror_lag_seconds",
+                 "SnapMirror lag time of the destination volume.",6)])
+
+# Latest IOPs and throughput per volume, from the perf report's queries.  The
+# objid mappings are refreshed every PERF_MAP_TTL seconds.
+def aiqum_refresh_perf(cnx,args):
+    global perf_map_time
+    perf = aiqum_volume_perf_report
+    if time.time() - perf_map_time > PERF_MAP_TTL:
+        perf.clustermap.clear()
+        perf.vservermap.clear()
+        perf.volmap = VolumeMap()
+        perf.aiqum_object_mappings(cnx,args.clusters)
+        perf_map_time = time.time()
+
+    # Samples are in time order, so the last one per volume is the latest.
+    latest = {}
+    starttime = (int(time.time()) - args.perf_lookback) * 1000
+    for clusterid in perf.clustermap:
+        for row in perf.aiqum_cluster_perf(cnx,clusterid,starttime,None):
+            latest[row[:3]] = row
+    return aiqum_render_gauges(
+               list(latest.values()),
+               [("cluster",0),("vserver",1),("volume",2)],
+               [("aiqum_volume_iops","Volume IOPs, latest sample.",4),
+                ("aiqum_volume_throughput_bytes_per_second",
+                 "Volume throughput, latest sample.",5)])
+
+# The reports, by name: the refresh function, taking a connection and the
+# command line arguments and returning the rendered metrics.
+REPORTS = {
+    'aggr': aiqum_refresh_aggr,
+    'snapmirror': aiqum_refresh_snapmirror,
+    'perf': aiqum_refresh_perf,
+}
+
+# The last refreshed metrics of each report, and the /metrics page made from
+# them.  The page is rebuilt after every refresh, so a scrape only copies it.
+class Exporter:
+    def __init__(self, reports):
+        self.lock = threading.Lock()
+        self.reports = reports
+        self.metrics = {}
+        self.up = {name: 0 for name in reports}
+        self.seconds = {name: 0.0 for name in reports}
+        self.last = {name: 0.0 for name in reports}
+        self.errors = {name: 0 for name in reports}
+        self.page = b""
+        self.render()
+
+    # Record a refresh.  metrics is None when it failed, in which case the
+    # previous metrics are kept.
+    def update(self, name, metrics, seconds):
+        with self.lock:
+            self.seconds[name] = seconds
+            if metrics is None:
+                self.up[name] = 0
+                self.errors[name] += 1
+            else:
+                self.metrics[name] = metrics
+                self.up[name] = 1
+                self.last[name] = time.time()
+            self.render()
+
+    def render(self):
+        status = [("aiqum_exporter_up",
+                   "1 if the last refresh of the report succeeded.",self.up),
+                  ("aiqum_exporter_refresh_seconds",
+                   "Duration of the last refresh of the report.",self.seconds),
+                  ("aiqum_exporter_last_refresh_timestamp_seconds",
+                   "Time of the last successful refresh of the report.",
+                   self.last)]
+        text = [self.metrics[name] for name in self.reports
+                if name in self.metrics]
+        for metric, helptext, values in status:
+            text.append("# HELP %s %s\n# TYPE %s gauge\n"
+                        % (metric, helptext, metric))
+            for name in self.reports:
+                text.append("%s{report=\"%s\"} %r\n"
+                            % (metric, name, float(values[name])))
+        text.append("# HELP aiqum_exporter_refresh_errors_total "
+                    "Failed refreshes of the report.\n"
+                    "# TYPE aiqum_exporter_refresh_errors_total counter\n")
+        for name in self.reports:
+            text.append("aiqum_exporter_refresh_errors_total{report=\"%s\"} "
+                        "%i\n" % (name, self.errors[name]))
+        self.page = "".join(text).encode()
+
+# Refresh one report every interval seconds, on a connection from the pool.
+# Errors are logged and the report is tried again at the next interval.
+def aiqum_refresh_loop(exporter,pool,name,interval,args):
+    while True:
+        start = time.time()
+        metrics = None
+        try:
+            cnx = pool.get_connection()
+            try:
+                metrics = REPORTS[name](cnx,args)
+            finally:
+                cnx.close()
+        except Exception as error:
+            print("Error refreshing " + name + ": " + str(error),
+                  file=sys.stderr)
+        exporter.update(name,metrics,time.time() - start)
+        time.sleep(max(0, interval - (time.time() - start)))
+
+# Serves the exporter's page on /metrics.
+class MetricsHandler(BaseHTTPRequestHandler):
+    exporter = None
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        page = self.exporter.page
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+
+    def log_message(self, format, *args):
+        pass
+
+# -----------------------------------------------------------------------------
+# MAIN
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    # Parse the command line
+    parser = ArgumentParser(
+        usage="%(prog)s [options]",
+        description="Sample code to serve AIQUM Datbase details as Prometheus metrics."
+    )
+    parser.add_argument(
+        '-a', '--aiqumhost', nargs='?', required=True, help='AIQUM Host'
+    )
+    parser.add_argument(
+        '-u', '--username', nargs='?', required=True, help='AIQUM Username'
+    )
+    parser.add_argument(
+        '-p', '--password', nargs='?', help='Password for AIQUM username'
+    )
+    parser.add_argument(
+        '-c', '--clusters', nargs='?',
+        help='CSV list of clusters for the perf metrics (default: no perf)'
+    )
+    parser.add_argument(
+        '--listen', default="", help='Address to listen on (default all)'
+    )
+    parser.add_argument(
+        '--port', type=int, default=PORT,
+        help='Port to serve /metrics on (default %i)' % PORT
+    )
+    parser.add_argument(
+        '--aggr-interval', type=int, default=900, metavar='SECONDS',
+        help='Refresh the aggr metrics this often (default 900)'
+    )
+    parser.add_argument(
+        '--snapmirror-interval', type=int, default=300, metavar='SECONDS',
+        help='Refresh the snapmirror metrics this often (default 300)'
+    )
+    parser.add_argument(
+        '--perf-interval', type=int, default=300, metavar='SECONDS',
+        help='Refresh the perf metrics this often (default 300)'
+    )
+    parser.add_argument(
+        '--perf-lookback', type=int, default=900, metavar='SECONDS',
+        help='Look this far back for the latest perf samples (default 900)'
+    )
+    aiqum_add_connection_args(parser)
+    args = parser.parse_args()
+    aiqum_connection_options(args)
+    if not args.password: args.password = getpass()
+
+    intervals = {'aggr': args.aggr_interval,
+                 'snapmirror': args.snapmirror_interval}
+    if args.clusters:
+        intervals['perf'] = args.perf_interval
+
+    # One pooled connection per report, kept open between refreshes.
+    pool = aiqum_db_pool(args.aiqumhost,args.username,args.password,
+                         "netapp_model_view",len(intervals),"aiqum_exporter")
+    exporter = Exporter(list(intervals))
+    for name, interval in intervals.items():
+        threading.Thread(target=aiqum_refresh_loop,
+                         args=(exporter,pool,name,interval,args),
+                         daemon=True).start()
+
+    # Serve the metrics until interrupted.
+    MetricsHandler.exporter = exporter
+    server = ThreadingHTTPServer((args.listen, args.port), MetricsHandler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
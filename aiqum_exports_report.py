@@ -18,32 +18,28 @@
 ################################################################################
 
 import mysql.connector
+import aiqum_common
+from aiqum_common import ReportWriter, aiqum_fetch_batches
+from aiqum_common import aiqum_add_batch_args
+from aiqum_common import aiqum_db_connect
+from aiqum_common import aiqum_add_connection_args, aiqum_connection_options
+from aiqum_common import aiqum_add_profile_args, aiqum_profile_start
+from aiqum_common import aiqum_profile_connection, aiqum_profile_report
+from aiqum_common import aiqum_phase
 import sys
-import datetime
 from argparse import ArgumentParser
 from getpass import getpass
 
-# Connection setup for AIQUM.
-def aiqum_db_connect(aiq_host,aiq_user,aiq_password):
-    try:
-        cnx = mysql.connector.connect(host=aiq_host,
-                                      user=aiq_user,
-                                      password=aiq_password,
-                                      database='netapp_model_view'
-                                     )
-    except:
-        print()
-        print("Error connecting to AIQUM Database. Exiting.")
-        print()
-        raise
-
-    return cnx
-
-# Query AIQUM for exports data and print in CSV format.
-def aiqum_exports(cnx):
-    # Query for all export rules.
-    cursor = cnx.cursor()
-    query = ("SELECT cluster.name,vserver.name,export_policy.name,"
+# Query AIQUM for export rules, ordered by policy and rule objid so that each
+# policy's rules arrive together.  With volumes, the volumes using each policy
+# are included in the same query, after the policy's rules.  Each row is:
+#   policy objid, 0 (rule) or 1 (volume), rule or volume objid,
+#   cluster, vserver, policy name, client match, ro rule, rw rule, superuser
+#   (rules), or the volume name and junction path in place of the client match
+#   and ro rule (volumes).
+def aiqum_export_query(cursor,volumes=False):
+    query = ("SELECT export_policy.objid AS policyid,0 AS kind,"
+             "rule.objid AS itemid,cluster.name,vserver.name,export_policy.name,"
              "rule.clientMatch,rule.roRule,rule.rwRule,rule.superUserSecurity "
              "FROM export_rule AS rule "
              "INNER JOIN cluster ON rule.clusterId = cluster.objid "
@@ -51,37 +47,62 @@ def aiqum_exports(cnx):
              "INNER JOIN export_policy ON "
              "rule.exportPolicyId = export_policy.objid "
             )
+    if volumes:
+        query = (query +
+                 "UNION ALL "
+                 "SELECT vol.exportPolicyId,1,vol.objid,NULL,NULL,NULL,"
+                 "vol.name,vol.junctionPath,NULL,NULL "
+                 "FROM volume AS vol "
+                )
+    query = query + "ORDER BY policyid,kind,itemid"
     cursor.execute(query)
+    return cursor
+
+# Yield one row per export policy: cluster, vserver, policy name and its rules
+# joined with "; ", plus its volumes and their junction paths when volumes is
+# set.  Rows are streamed in order and each policy's parts are joined once, so
+# the time taken is linear in the number of rules.  Policies without rules are
+# left out.
+def aiqum_export_policies(cursor,volumes=False):
+    policy = None
+    for rows in aiqum_fetch_batches(cursor):
+        for row in rows:
+            if row[1] == 1:
+                # A volume, kept if its policy has rules.
+                if policy is not None and policy[0] == row[0]:
+                    policy[5].append(row[6])
+                    policy[6].append(row[7] or "")
+                continue
+            if policy is None or policy[0] != row[0]:
+                if policy is not None:
+                    yield aiqum_export_policy_row(policy,volumes)
+                policy = [row[0],row[3],row[4],row[5],[],[],[]]
+            policy[4].append("client:" + row[6] +
+                             " read-only:" + row[7] +
+                             " read-write:" + row[8] +
+                             " superuser:" + row[9])
+    if policy is not None:
+        yield aiqum_export_policy_row(policy,volumes)
+
+def aiqum_export_policy_row(policy,volumes):
+    row = (policy[1],policy[2],policy[3],"; ".join(policy[4]))
+    if volumes:
+        row = row + ("; ".join(policy[5]),"; ".join(policy[6]))
+    return row
 
-    # Save the rules for each policyName.
-    rules = {}
-    for row in cursor:
-        cluster    = row[0]
-        vserver    = row[1]
-        policyName = row[2]
-        rule = ("client:" + row[3] + 
-                " read-only:" + row[4] + 
-                " read-write:" + row[5] + 
-                " superuser:" + row[6]
-               )
-        if cluster not in rules: rules[cluster] = {}
-        if vserver not in rules[cluster]: rules[cluster][vserver] = {}
-        if policyName not in rules[cluster][vserver]:
-            rules[cluster][vserver][policyName] = rule
-        else:
-            rules[cluster][vserver][policyName] = (
-                rules[cluster][vserver][policyName] + "; " + rule)
+# Query AIQUM for exports data and write it in CSV format
+# to output (default stdout).  With volumes, the volumes using each policy and
+# their junction paths are added.
+def aiqum_exports(cnx,output=None,volumes=False):
+    cursor = aiqum_export_query(cnx.cursor(buffered=False),volumes)
 
-    # Loop through the policies and print rules for each as we go.
-    print("Cluster,Vserver,ExportPolicy,ExportRules")
-    for cluster in rules:
-        for vserver in rules[cluster]:
-            for policyName in rules[cluster][vserver]:
-                print("%s,%s,%s,%s" %
-                      (cluster,vserver,policyName,
-                       rules[cluster][vserver][policyName]
-                      )
-                     )
+    columns = [("Cluster",None),("Vserver",None),
+               ("ExportPolicy",None),("ExportRules",None)]
+    if volumes:
+        columns = columns + [("Volumes",None),("JunctionPaths",None)]
+    writer = ReportWriter(columns,path=output)
+    writer.write_rows(aiqum_export_policies(cursor,volumes))
+    writer.close()
 
     return 1
 
@@ -89,23 +110,37 @@ def aiqum_exports(cnx):
 # MAIN
 # -----------------------------------------------------------------------------
 
-# Parse the command line
-parser = ArgumentParser(
-    usage="%(prog)s [options]",
-    description="Sample code to pull export policy details from the AIQUM Datbase."
-)
-parser.add_argument(
-    '-a', '--aiqumhost', nargs='?', required=True, help='AIQUM Host'
-)
-parser.add_argument(
-    '-u', '--username', nargs='?', required=True, help='AIQUM Username'
-)
-parser.add_argument(
-    '-p', '--password', nargs='?', help='Password for AIQUM username'
-)
-args = parser.parse_args()
-if not args.password: args.password = getpass()
+if __name__ == "__main__":
+    # Parse the command line
+    parser = ArgumentParser(
+        usage="%(prog)s [options]",
+        description="Sample code to pull export policy details from the AIQUM Datbase."
+    )
+    parser.add_argument(
+        '-a', '--aiqumhost', nargs='?', required=True, help='AIQUM Host'
+    )
+    parser.add_argument(
+        '-u', '--username', nargs='?', required=True, help='AIQUM Username'
+    )
+    parser.add_argument(
+        '-p', '--password', nargs='?', help='Password for AIQUM username'
+    )
+    parser.add_argument(
+        '--with-volumes', action='store_true',
+        help='Add the volumes using each policy and their junction paths'
+    )
+    aiqum_add_batch_args(parser)
+    aiqum_add_connection_args(parser)
+    aiqum_add_profile_args(parser)
+    args = parser.parse_args()
+    aiqum_common.BATCH_SIZE = args.batch_size
+    aiqum_connection_options(args)
+    if not args.password: args.password = getpass()
+    aiqum_profile_start(args)
 
-# Connect to AIQUM and print the exports details.
-cnx = aiqum_db_connect(args.aiqumhost,args.username,args.password)
-aiqum_exports(cnx)
+    # Connect to AIQUM and print the exports details.
+    with aiqum_phase('connect'):
+        cnx = aiqum_db_connect(args.aiqumhost,args.username,args.password)
+    cnx = aiqum_profile_connection(cnx)
+    aiqum_exports(cnx,volumes=args.with_volumes)
+    aiqum_profile_report(args)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+################################################################################
+#
+# This sample code shows how to run several of the AIQUM reports in a single
+# process, sharing one pooled connection to the AIQUM Database.  Each report
+# is written as CSV to its own file in the output directory.
+#
+# By default the reports run one after another on a single connection inside
+# one read-only transaction, so they all see the same snapshot of the model.
+# With -j/--concurrent N, the model reports run in parallel on a pool of N
+# connections instead (each then has its own snapshot).
+#
+# AIQUM Requirements:
+#   1. AIQUM 9.7 or higher.
+#   2. An AIQUM "Database User" account with the "Report Schema" role.
+#
+# Python Requirements:
+#   1. The mysql-connector-python module must be installed.
+#
+# AIQUM Database Schema documentation is on the NetApp Support Site:
+# https://mysupport.netapp.com/documentation/docweb/index.html?productID=63834
+#
+################################################################################
+
+import mysql.connector
+import mysql.connector.pooling
+import aiqum_common
+from aiqum_common import aiqum_db_pool, aiqum_add_batch_args
+from aiqum_common import aiqum_add_connection_args, aiqum_connection_options
+from aiqum_common import aiqum_add_profile_args, aiqum_profile_start
+from aiqum_common import aiqum_profile_connection, aiqum_profile_report
+from aiqum_common import aiqum_phase
+import aiqum_aggr_report
+import aiqum_volume_report
+import aiqum_exports_report
+import aiqum_snapmirror_report
+import aiqum_user_quota_report
+import aiqum_volume_perf_report
+import sys
+import os
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from getpass import getpass
+
+# The model reports, by name: the report function and its output file name.
+# Each function takes the connection and an output= path.
+MODEL_REPORTS = {
+    'aggr': (aiqum_aggr_report.aiqum_aggregates, "aggr.csv"),
+    'volume': (aiqum_volume_report.aiqum_volumes, "volume.csv"),
+    'exports': (aiqum_exports_report.aiqum_exports, "exports.csv"),
+    'snapmirror': (aiqum_snapmirror_report.aiqum_snapmirrors,
+                   "snapmirror.csv"),
+    'quota': (aiqum_user_quota_report.aiqum_user_quotas, "user_quota.csv"),
+}
+
+# The volume performance report needs clusters and days, see aiqum_perf().
+PERF_REPORT = ('perf', "volume_perf.csv")
+
+# Run one model report on cnx and print how long it took.
+def aiqum_run_report(cnx,name,outdir):
+    function, filename = MODEL_REPORTS[name]
+    path = os.path.join(outdir, filename)
+    start = time.time()
+    with aiqum_phase('report:' + name):
+        function(cnx,output=path)
+    print("%s: wrote %s in %.1fs" % (name,path,time.time() - start),
+          file=sys.stderr)
+
+    return 1
+
+# Run one model report on a connection taken from the pool.
+def aiqum_run_pooled_report(pool,name,outdir):
+    cnx = pool.get_connection()
+    try:
+        return aiqum_run_report(cnx,name,outdir)
+    finally:
+        cnx.close()
+
+# Run the volume performance report for the clusters and days of history.
+def aiqum_perf(cnx,clusters,days,outdir):
+    path = os.path.join(outdir, PERF_REPORT[1])
+    start = time.time()
+    starttime = (int(time.time()) - int(days) * 86400) * 1000
+    with aiqum_phase('report:' + PERF_REPORT[0]):
+        aiqum_volume_perf_report.aiqum_object_mappings(cnx,clusters)
+        aiqum_volume_perf_report.aiqum_volumes_perf(cnx,starttime,output=path)
+    print("%s: wrote %s in %.1fs" % (PERF_REPORT[0],path,time.time() - start),
+          file=sys.stderr)
+
+    return 1
+
+# -----------------------------------------------------------------------------
+# MAIN
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    # Parse the command line
+    names = list(MODEL_REPORTS) + [PERF_REPORT[0]]
+    parser = ArgumentParser(
+        usage="%(prog)s [options]",
+        description="Sample code to run several reports against the AIQUM Datbase."
+    )
+    parser.add_argument(
+        '-a', '--aiqumhost', nargs='?', required=True, help='AIQUM Host'
+    )
+    parser.add_argument(
+        '-u', '--username', nargs='?', required=True, help='AIQUM Username'
+    )
+    parser.add_argument(
+        '-p', '--password', nargs='?', help='Password for AIQUM username'
+    )
+    parser.add_argument(
+        '-r', '--reports', default=",".join(MODEL_REPORTS),
+        help='CSV list of reports to run, from: ' + ",".join(names) +
+             ' (default: all but perf)'
+    )
+    parser.add_argument(
+        '-o', '--outdir', required=True, help='Directory for the report files'
+    )
+    parser.add_argument(
+        '-c', '--clusters', nargs='?', help='CSV list of clusters (for perf)'
+    )
+    parser.add_argument(
+        '-d', '--days', nargs='?', help='Days of history to pull (for perf)'
+    )
+    parser.add_argument(
+        '-j', '--concurrent', type=int, default=1,
+        help='Run up to this many model reports at once (default 1)'
+    )
+    aiqum_add_batch_args(parser)
+    aiqum_add_connection_args(parser)
+    aiqum_add_profile_args(parser)
+    args = parser.parse_args()
+    aiqum_common.BATCH_SIZE = args.batch_size
+    aiqum_connection_options(args)
+    reports = args.reports.split(",")
+    for name in reports:
+        if name not in names:
+            parser.error("unknown report: " + name)
+    if PERF_REPORT[0] in reports and not (args.clusters and args.days):
+        parser.error("the perf report requires -c/--clusters and -d/--days")
+    if not 1 <= args.concurrent <= mysql.connector.pooling.CNX_POOL_MAXSIZE:
+        parser.error("--concurrent must be between 1 and %i"
+                     % mysql.connector.pooling.CNX_POOL_MAXSIZE)
+    if not args.password: args.password = getpass()
+    aiqum_profile_start(args)
+    os.makedirs(args.outdir, exist_ok=True)
+
+    # One pool for the whole run, sized for the concurrent reports.
+    with aiqum_phase('connect'):
+        pool = aiqum_db_pool(args.aiqumhost,args.username,args.password,
+                             "netapp_model_view",args.concurrent,
+                             "aiqum_reports")
+    pool = aiqum_profile_connection(pool)
+    modelreports = [name for name in reports if name in MODEL_REPORTS]
+
+    if args.concurrent > 1:
+        # Run the model reports in parallel, one pooled connection each.
+        with ThreadPoolExecutor(max_workers=args.concurrent) as executor:
+            futures = [executor.submit(aiqum_run_pooled_report,
+                                       pool,name,args.outdir)
+                       for name in modelreports]
+            for future in futures:
+                future.result()
+        if PERF_REPORT[0] in reports:
+            cnx = pool.get_connection()
+            aiqum_perf(cnx,args.clusters,args.days,args.outdir)
+            cnx.close()
+    else:
+        # Run everything on one connection, in one read-only transaction.
+        cnx = pool.get_connection()
+        cnx.start_transaction(consistent_snapshot=True, readonly=True)
+        for name in modelreports:
+            aiqum_run_report(cnx,name,args.outdir)
+        if PERF_REPORT[0] in reports:
+            aiqum_perf(cnx,args.clusters,args.days,args.outdir)
+        cnx.rollback()
+        cnx.close()
+    aiqum_profile_report(args)
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+
+################################################################################
+#
+# This sample code shows how to keep a history of snapmirror lag from the
+# AIQUM Database in a local SQLite file, and answer questions about it without
+# going back to AIQUM.
+#
+# Modes (all take --store FILE):
+#   sample      - query the EXTENDED_DATA_PROTECTION relationships (the
+#                 aiqum_snapmirror_report.py query) and append their lag to
+#                 the store, once, or every --interval seconds
+#   breaches    - relationships whose lag was over --rpo in each of the last
+#                 -n samples
+#   percentiles - per-relationship lag percentiles over the last --days
+#
+# The store has one row per relationship (source and destination vserver and
+# volume, with a unique index on them) and one row per relationship and
+# sample with just the relationship id, sample time and lag.  The lag rows
+# are clustered by sample time, so samples are appended at the end and the
+# last N samples are a range scan, with a second index by relationship and
+# time for the per-relationship queries.
+#
+# AIQUM Requirements:
+#   1. AIQUM 9.7 or higher.
+#   2. An AIQUM "Database User" account with the "Report Schema" role.
+#
+# Python Requirements:
+#   1. The mysql-connector-python module must be installed.
+#
+# AIQUM Database Schema documentation is on the NetApp Support Site:
+# https://mysupport.netapp.com/documentation/docweb/index.html?productID=63834
+#
+################################################################################
+
+import mysql.connector
+import aiqum_common
+from aiqum_common import ReportWriter, aiqum_percentile
+from aiqum_common import aiqum_add_batch_args, aiqum_db_connect
+from aiqum_common import aiqum_add_connection_args, aiqum_connection_options
+from aiqum_common import aiqum_open_sqlite
+from aiqum_snapmirror_report import aiqum_snapmirror_batches
+import sys
+import time
+from argparse import ArgumentParser
+from getpass import getpass
+
+# Store schema.  Sample times are epoch seconds, lag is in seconds (NULL when
+# AIQUM has none).
+STORE_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS relationship ("
+    "id INTEGER PRIMARY KEY,"
+    "sourceVserver TEXT,sourceVolume TEXT,"
+    "destinationVserver TEXT,destinationVolume TEXT,"
+    "UNIQUE (sourceVserver,sourceVolume,destinationVserver,destinationVolume))",
+    "CREATE TABLE IF NOT EXISTS sample (time INTEGER PRIMARY KEY)",
+    "CREATE TABLE IF NOT EXISTS lag ("
+    "time INTEGER,relationship INTEGER,lag INTEGER,"
+    "PRIMARY KEY (time,relationship)) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS lag_relationship "
+    "ON lag (relationship,time,lag)",
+]
+
+# Report columns.
+RELATIONSHIP_COLUMNS = [("SourceVserver",None),("SourceVolume",None),
+                        ("DestinationVserver",None),("DestinationVolume",None)]
+BREACH_COLUMNS = RELATIONSHIP_COLUMNS + [("Samples","int"),
+                                         ("MinLagTime","lag"),
+                                         ("MaxLagTime","lag"),
+                                         ("LastSample","ms")]
+PERCENTILE_COLUMNS = RELATIONSHIP_COLUMNS + [("Samples","int"),
+                                             ("P50LagTime","lag"),
+                                             ("P95LagTime","lag"),
+                                             ("P99LagTime","lag"),
+                                             ("MaxLagTime","lag")]
+
+# Relationship ids by (source vserver, source volume, destination vserver,
+# destination volume), kept between samples.
+relationships = {}
+
+# Query AIQUM for the snapmirror lag and append it to the store as one sample
+# taken now.  Returns the number of relationships sampled.
+def aiqum_sample_lag(cnx,store,keepdays=None):
+    now = int(time.time())
+    rows = [row for rows in aiqum_snapmirror_batches(cnx) for row in rows]
+    keys = [tuple(row[:4]) for row in rows]
+
+    with store:
+        new = [key for key in set(keys) if key not in relationships]
+        if new:
+            store.executemany("INSERT OR IGNORE INTO relationship "
+                              "(sourceVserver,sourceVolume,"
+                              "destinationVserver,destinationVolume) "
+                              "VALUES (?,?,?,?)", new)
+            for row in store.execute("SELECT id,sourceVserver,sourceVolume,"
+                                     "destinationVserver,destinationVolume "
+                                     "FROM relationship"):
+                relationships[tuple(row[1:])] = row[0]
+        store.execute("INSERT OR IGNORE INTO sample (time) VALUES (?)", (now,))
+        store.executemany("INSERT OR REPLACE INTO lag (time,relationship,lag) "
+                          "VALUES (?,?,?)",
+                          [(now, relationships[key], row[6])
+                           for key, row in zip(keys, rows)])
+        if keepdays:
+            cutoff = now - keepdays * 86400
+            store.execute("DELETE FROM lag WHERE time < ?", (cutoff,))
+            store.execute("DELETE FROM sample WHERE time < ?", (cutoff,))
+
+    return len(rows)
+
+# Sample the lag every interval seconds until interrupted.  The connection
+# reconnects itself if it was dropped between samples, and a failed sample is
+# logged and tried again at the next interval.
+def aiqum_sample_loop(cnx,store,interval,keepdays=None):
+    while True:
+        start = time.time()
+        try:
+            count = aiqum_sample_lag(cnx,store,keepdays)
+            print("Sampled %i relationships." % count, file=sys.stderr)
+        except mysql.connector.Error as error:
+            print("Error sampling snapmirror lag: " + str(error),
+                  file=sys.stderr)
+        time.sleep(max(0, interval - (time.time() - start)))
+
+# Write the relationships whose lag was over rpo seconds in each of the last
+# samples samples taken, worst first.  The unary + on lag.relationship keeps
+# SQLite from scanning the whole relationship index to group by it, so only
+# the recent samples are read, through the primary key.
+def aiqum_lag_breaches(store,rpo,samples,output=None):
+    query = ("WITH recent AS "
+             "(SELECT time FROM sample ORDER BY time DESC LIMIT ?) "
+             "SELECT r.sourceVserver,r.sourceVolume,"
+             "r.destinationVserver,r.destinationVolume,"
+             "COUNT(*),MIN(lag.lag),MAX(lag.lag),MAX(lag.time) * 1000 "
+             "FROM lag INNER JOIN relationship AS r "
+             "ON +lag.relationship = r.id "
+             "WHERE lag.time >= (SELECT MIN(time) FROM recent) "
+             "AND lag.lag > ? "
+             "GROUP BY +lag.relationship HAVING COUNT(*) = ? "
+             "ORDER BY MIN(lag.lag) DESC,r.id")
+    writer = ReportWriter(BREACH_COLUMNS,path=output)
+    writer.write_batch(store.execute(query, (samples,rpo,samples)).fetchall())
+    writer.close()
+
+    return 1
+
+# Write per-relationship lag percentiles over the samples of the last days.
+# With volume, only the relationships with that source or destination volume
+# are reported, read through the relationship index.
+def aiqum_lag_percentiles(store,days,output=None,volume=None):
+    cutoff = int(time.time()) - days * 86400
+    query = ("SELECT id,sourceVserver,sourceVolume,"
+             "destinationVserver,destinationVolume FROM relationship ")
+    params = ()
+    if volume:
+        query = query + "WHERE sourceVolume = ? OR destinationVolume = ? "
+        params = (volume, volume)
+    query = (query + "ORDER BY sourceVserver,sourceVolume,"
+             "destinationVserver,destinationVolume")
+    found = store.execute(query, params).fetchall()
+
+    lags = {}
+    if volume:
+        for row in found:
+            lags[row[0]] = [lag for (lag,) in store.execute(
+                                "SELECT lag FROM lag WHERE relationship = ? "
+                                "AND time >= ? AND lag IS NOT NULL",
+                                (row[0], cutoff))]
+    else:
+        for relationship, lag in store.execute(
+                "SELECT relationship,lag FROM lag "
+                "WHERE time >= ? AND lag IS NOT NULL", (cutoff,)):
+            lags.setdefault(relationship, []).append(lag)
+
+    rows = []
+    for row in found:
+        values = lags.get(row[0])
+        if not values:
+            continue
+        rows.append(tuple(row[1:]) +
+                    (len(values),
+                     round(aiqum_percentile(values,50)),
+                     round(aiqum_percentile(values,95)),
+                     round(aiqum_percentile(values,99)),
+                     max(values)))
+    writer = ReportWriter(PERCENTILE_COLUMNS,path=output)
+    writer.write_rows(rows)
+    writer.close()
+
+    return 1
+
+# -----------------------------------------------------------------------------
+# MAIN
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    # Parse the command line
+    parser = ArgumentParser(
+        usage="%(prog)s --store FILE [sample|breaches|percentiles] [options]",
+        description="Sample code to keep and analyze a history of snapmirror lag from the AIQUM Datbase."
+    )
+    parser.add_argument(
+        'mode', nargs='?', choices=['sample','breaches','percentiles'],
+        default='sample', help='What to do (default sample)'
+    )
+    parser.add_argument(
+        '--store', required=True, help='SQLite file holding the lag history'
+    )
+    parser.add_argument(
+        '-a', '--aiqumhost', nargs='?', help='AIQUM Host (sample)'
+    )
+    parser.add_argument(
+        '-u', '--username', nargs='?', help='AIQUM Username (sample)'
+    )
+    parser.add_argument(
+        '-p', '--password', nargs='?', help='Password for AIQUM username'
+    )
+    parser.add_argument(
+        '--interval', type=int, metavar='SECONDS',
+        help='Keep sampling this often (sample, default once)'
+    )
+    parser.add_argument(
+        '--keep-days', type=int, metavar='DAYS',
+        help='Delete samples older than this (sample, default keep all)'
+    )
+    parser.add_argument(
+        '--rpo', type=int, metavar='SECONDS',
+        help='Lag over this is a breach (breaches)'
+    )
+    parser.add_argument(
+        '-n', '--samples', type=int, default=3,
+        help='Consecutive samples over --rpo to report (breaches, default 3)'
+    )
+    parser.add_argument(
+        '--days', type=int, default=7,
+        help='Days of samples to use (percentiles, default 7)'
+    )
+    parser.add_argument(
+        '--volume',
+        help='Only relationships with this source or destination volume '
+             '(percentiles)'
+    )
+    parser.add_argument(
+        '-o', '--output', help='Write the report to this file instead of stdout'
+    )
+    aiqum_add_batch_args(parser)
+    aiqum_add_connection_args(parser)
+    args = parser.parse_args()
+    aiqum_common.BATCH_SIZE = args.batch_size
+    aiqum_connection_options(args)
+    if args.mode == 'sample' and not (args.aiqumhost and args.username):
+        parser.error("sample requires -a/--aiqumhost and -u/--username")
+    if args.mode == 'breaches' and args.rpo is None:
+        parser.error("breaches requires --rpo")
+    if args.samples < 1:
+        parser.error("-n/--samples must be at least 1")
+
+    store = aiqum_open_sqlite(args.store,STORE_SCHEMA)
+    if args.mode == 'breaches':
+        aiqum_lag_breaches(store,args.rpo,args.samples,args.output)
+    elif args.mode == 'percentiles':
+        aiqum_lag_percentiles(store,args.days,args.output,args.volume)
+    else:
+        # Connect to AIQUM and sample the snapmirror lag.
+        if not args.password: args.password = getpass()
+        cnx = aiqum_db_connect(args.aiqumhost,args.username,args.password)
+        if args.interval:
+            try:
+                aiqum_sample_loop(cnx,store,args.interval,args.keep_days)
+            except KeyboardInterrupt:
+                pass
+        else:
+            aiqum_sample_lag(cnx,store,args.keep_days)
+    store.close()
@@ -18,30 +18,28 @@
 ################################################################################
 
 import mysql.connector
+import aiqum_common
+from aiqum_common import ReportWriter, aiqum_fetch_batches
+from aiqum_common import aiqum_add_batch_args
+from aiqum_common import aiqum_db_connect
+from aiqum_common import aiqum_add_connection_args, aiqum_connection_options
+from aiqum_common import aiqum_add_profile_args, aiqum_profile_start
+from aiqum_common import aiqum_profile_connection, aiqum_profile_report
+from aiqum_common import aiqum_phase
 import sys
-import datetime
 from argparse import ArgumentParser
 from getpass import getpass
 
-# Connection setup for AIQUM.
-def aiqum_db_connect(aiq_host,aiq_user,aiq_password):
-    try:
-        cnx = mysql.connector.connect(host=aiq_host,
-                                      user=aiq_user,
-                                      password=aiq_password,
-                                      database='netapp_model_view'
-                                     )
-    except:
-        print()
-        print("Error connecting to AIQUM Database. Exiting.")
-        print()
-        raise
+# Report columns.
+SNAPMIRROR_COLUMNS = [("SourceVserver",None),("SourceVolume",None),
+                      ("DestinationVserver",None),
+                      ("DestinationVolume",None),
+                      ("MirrorState",None),("MirrorType",None),
+                      ("LagTime","lag"),("LastUpdated","ms")]
 
-    return cnx
-
-# Query AIQUM for volume data and print in CSV format.
-def aiqum_snapmirrors(cnx):
-    cursor = cnx.cursor()
+# Query AIQUM for snapmirror data and yield it in batches of rows.
+def aiqum_snapmirror_batches(cnx):
+    cursor = cnx.cursor(buffered=False)
     query = ("SELECT sm.sourceVserver,sm.sourceVolume,"
              "vserver.name,volume.name,"
              "sm.mirrorState,sm.relationshipType,sm.lagTime,"
@@ -53,30 +51,15 @@ def aiqum_snapmirrors(cnx):
              "WHERE sm.relationshipType='EXTENDED_DATA_PROTECTION'"
             )
     cursor.execute(query)
+    yield from aiqum_fetch_batches(cursor)
 
-    print("SourceVserver,SourceVolume,"
-          "DestinationVserver,DestinationVolume,"
-          "MirrorState,MirrorType,LagTime,"
-          "LastUpdated")
-    for row in cursor:
-        if row[6]:
-            lagTime = str(datetime.timedelta(seconds=(row[6])))
-            lagTime = lagTime.replace(",", "")
-        else:
-            lagTime = ""
-        epochtime = "%i" % (row[7] / 1000)
-        lastupdated = datetime.datetime.fromtimestamp(int(epochtime))
-        print("%s,%s,"
-              "%s,%s,"
-              "%s,%s,%s,"
-              "%s"
-              %
-              (row[0],row[1],
-               row[2],row[3],
-               row[4],row[5],lagTime,
-               lastupdated
-              )
-             )
+# Query AIQUM for volume data and write it in CSV format
+# to output (default stdout).
+def aiqum_snapmirrors(cnx,output=None):
+    writer = ReportWriter(SNAPMIRROR_COLUMNS,path=output)
+    for rows in aiqum_snapmirror_batches(cnx):
+        writer.write_batch(rows)
+    writer.close()
 
     return 1
 
@@ -84,23 +67,33 @@ def aiqum_snapmirrors(cnx):
 # MAIN
 # -----------------------------------------------------------------------------
 
-# Parse the command line
-parser = ArgumentParser(
-    usage="%(prog)s [options]",
-    description="Sample code to pull snapmirror details from the AIQUM Datbase."
-)
-parser.add_argument(
-    '-a', '--aiqumhost', nargs='?', required=True, help='AIQUM Host'
-)
-parser.add_argument(
-    '-u', '--username', nargs='?', required=True, help='AIQUM Username'
-)
-parser.add_argument(
-    '-p', '--password', nargs='?', help='Password for AIQUM username'
-)
-args = parser.parse_args()
-if not args.password: args.password = getpass()
+if __name__ == "__main__":
+    # Parse the command line
+    parser = ArgumentParser(
+        usage="%(prog)s [options]",
+        description="Sample code to pull snapmirror details from the AIQUM Datbase."
+    )
+    parser.add_argument(
+        '-a', '--aiqumhost', nargs='?', required=True, help='AIQUM Host'
+    )
+    parser.add_argument(
+        '-u', '--username', nargs='?', required=True, help='AIQUM Username'
+    )
+    parser.add_argument(
+        '-p', '--password', nargs='?', help='Password for AIQUM username'
+    )
+    aiqum_add_batch_args(parser)
+    aiqum_add_connection_args(parser)
+    aiqum_add_profile_args(parser)
+    args = parser.parse_args()
+    aiqum_common.BATCH_SIZE = args.batch_size
+    aiqum_connection_options(args)
+    if not args.password: args.password = getpass()
+    aiqum_profile_start(args)
 
-# Connect to AIQUM and print the snapmirror details.
-cnx = aiqum_db_connect(args.aiqumhost,args.username,args.password)
-aiqum_snapmirrors(cnx)
+    # Connect to AIQUM and print the snapmirror details.
+    with aiqum_phase('connect'):
+        cnx = aiqum_db_connect(args.aiqumhost,args.username,args.password)
+    cnx = aiqum_profile_connection(cnx)
+    aiqum_snapmirrors(cnx)
+    aiqum_profile_report(args)
@@ -18,34 +18,41 @@
 ################################################################################
 
 import mysql.connector
+import aiqum_common
+from aiqum_common import ReportWriter, aiqum_fetch_batches
+from aiqum_common import aiqum_add_batch_args, aiqum_in_list
+from aiqum_common import aiqum_db_connect, aiqum_open_sqlite
+from aiqum_common import aiqum_add_connection_args, aiqum_connection_options
+from aiqum_common import aiqum_add_profile_args, aiqum_profile_start
+from aiqum_common import aiqum_profile_connection, aiqum_profile_report
+from aiqum_common import aiqum_phase
+from aiqum_common import aiqum_add_delta_args, aiqum_delta_report
 import sys
-import datetime
 from argparse import ArgumentParser
 from getpass import getpass
 
-# Connection setup for AIQUM.
-def aiqum_db_connect(aiq_host,aiq_user,aiq_password):
-    try:
-        cnx = mysql.connector.connect(host=aiq_host,
-                                      user=aiq_user,
-                                      password=aiq_password,
-                                      database='netapp_model_view'
-                                     )
-    except:
-        print()
-        print("Error connecting to AIQUM Database. Exiting.")
-        print()
-        raise
-
-    return cnx
-
-# Query AIQUM for user quota data and print in CSV format.
-def aiqum_user_quotas(cnx):
-    cursor = cnx.cursor()
+# Report columns.  Quota Target may be a comma separated list, it is written
+# with semicolons.
+USER_QUOTA_COLUMNS = [("Cluster",None),("Vserver",None),("Volume",None),
+                      ("JunctionPath",None),("Qtree",None),
+                      ("UserID",None),("UserName",None),
+                      ("QuotaTarget","list"),("DiskLimit(GB)","kbgb"),
+                      ("DiskUsed(GB)","kbgb"),("Inodes",None),
+                      ("LastUpdated","ms")]
+
+# Query AIQUM for user quota data and yield it in batches of rows.
+# With clusterids (for --since-state), only those clusters are queried and
+# each row ends with the quota user and cluster objids.
+def aiqum_user_quota_batches(cnx,clusterids=None):
+    cursor = cnx.cursor(buffered=False)
     query = ("SELECT cluster.name,vserver.name,volume.name,volume.junctionPath,"
              "qtree.name,quota_user.quotaUserID,quota_user.quotaUserName,"
              "uq.quotaTarget,uq.diskLimit,uq.diskUsed,uq.fileUsed,"
              "cluster.lastUpdateTime "
+            )
+    if clusterids:
+        query = query + ",quota_user.objid,cluster.objid "
+    query = (query +
              "FROM user_quota AS uq "
              "INNER JOIN cluster ON uq.clusterId = cluster.objid "
              "INNER JOIN vserver ON uq.vserverId = vserver.objid "
@@ -53,31 +60,112 @@ def aiqum_user_quotas(cnx):
              "INNER JOIN qtree ON uq.qtreeId = qtree.objid "
              "INNER JOIN quota_user ON uq.objid = quota_user.userQuotaID "
             )
-    cursor.execute(query)
-
-    print("Cluster,Vserver,Volume,JunctionPath,"
-          "Qtree,UserID,UserName,"
-          "QuotaTarget,DiskLimit(GB),DiskUsed(GB),Inodes,"
-          "LastUpdated"
-         )
-    for row in cursor:
-        # Quota Target may be a comma separated list, convert to semicolon.
-        QuotaTarget = str(row[7]).replace(",", ";")
-        DiskLimitGB = "%.1f" % (row[8] / (1024*1024))
-        DiskUsedGB  = "%.1f" % (row[9] / (1024*1024))
-        epochtime   = "%i" % (row[11] / 1000)
-        lastupdated = datetime.datetime.fromtimestamp(int(epochtime))
-        print("%s,%s,%s,%s,"
-              "%s,%s,%s,"
-              "%s,%s,%s,%s,"
-              "%s"
-              %
-              (row[0],row[1],row[2],row[3],
-               row[4],row[5],row[6],
-               QuotaTarget,DiskLimitGB,DiskUsedGB,row[10],
-               lastupdated
-              )
-             )
+    if clusterids:
+        query = (query + "WHERE uq.clusterId IN " +
+                 aiqum_in_list(clusterids))
+    cursor.execute(query, clusterids)
+    yield from aiqum_fetch_batches(cursor)
+
+# Query AIQUM for user quota data and write it in CSV format
+# to output (default stdout).
+def aiqum_user_quotas(cnx,output=None):
+    writer = ReportWriter(USER_QUOTA_COLUMNS,path=output)
+    for rows in aiqum_user_quota_batches(cnx):
+        writer.write_batch(rows)
+    writer.close()
+
+    return 1
+
+# Schema of the --index store: the report rows, keyed by quota user objid,
+# with the percent of the disk limit used (NULL without a limit), and the
+# lastUpdateTime of each cluster the rows were taken at.
+QUOTA_INDEX_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS cluster ("
+    "objid INTEGER PRIMARY KEY,name TEXT,lastUpdateTime INTEGER)",
+    "CREATE TABLE IF NOT EXISTS quota ("
+    "objid INTEGER PRIMARY KEY,clusterId INTEGER,"
+    "cluster TEXT,vserver TEXT,volume TEXT,junctionPath TEXT,qtree TEXT,"
+    "userId TEXT,userName TEXT,quotaTarget TEXT,"
+    "diskLimit INTEGER,diskUsed INTEGER,fileUsed INTEGER,"
+    "lastUpdateTime INTEGER,percentUsed REAL)",
+    "CREATE INDEX IF NOT EXISTS quota_cluster ON quota (clusterId)",
+    "CREATE INDEX IF NOT EXISTS quota_username ON quota (userName)",
+    "CREATE INDEX IF NOT EXISTS quota_userid ON quota (userId)",
+    "CREATE INDEX IF NOT EXISTS quota_volume ON quota (volume)",
+    "CREATE INDEX IF NOT EXISTS quota_path ON quota (junctionPath)",
+    "CREATE INDEX IF NOT EXISTS quota_percent ON quota (percentUsed)",
+]
+
+# The report columns, in the order of USER_QUOTA_COLUMNS.
+QUOTA_INDEX_COLUMNS = ("cluster,vserver,volume,junctionPath,qtree,"
+                       "userId,userName,quotaTarget,diskLimit,diskUsed,"
+                       "fileUsed,lastUpdateTime")
+
+# Bring the --index store up to date with AIQUM.  Only the clusters whose
+# lastUpdateTime has moved since the last refresh are queried, and their rows
+# replaced; the rows of clusters no longer in AIQUM are dropped.  Returns the
+# number of clusters refreshed.
+def aiqum_refresh_quota_index(cnx,index):
+    cursor = cnx.cursor()
+    cursor.execute("SELECT objid,name,lastUpdateTime FROM cluster")
+    clusters = {row[0]: row for row in cursor.fetchall()}
+    cursor.close()
+    known = {row[0]: row[1] for row in
+             index.execute("SELECT objid,lastUpdateTime FROM cluster")}
+    changed = [clusterid for clusterid in clusters
+               if known.get(clusterid) != clusters[clusterid][2]]
+    removed = [clusterid for clusterid in known if clusterid not in clusters]
+
+    with index:
+        for clusterid in changed + removed:
+            index.execute("DELETE FROM quota WHERE clusterId = ?",
+                          (clusterid,))
+            index.execute("DELETE FROM cluster WHERE objid = ?", (clusterid,))
+        if changed:
+            for rows in aiqum_user_quota_batches(cnx,changed):
+                index.executemany(
+                    "INSERT OR REPLACE INTO quota (" + QUOTA_INDEX_COLUMNS +
+                    ",objid,clusterId,percentUsed) "
+                    "VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                    [tuple(row) +
+                     ((100.0 * row[9] / row[8]) if row[8] else None,)
+                     for row in rows])
+        index.executemany("INSERT INTO cluster (objid,name,lastUpdateTime) "
+                          "VALUES (?,?,?)",
+                          [clusters[clusterid] for clusterid in changed])
+
+    return len(changed)
+
+# Look up quotas in the --index store and write them in the report's CSV
+# format to output (default stdout).  user matches the user name or ID,
+# volume the volume name or junction path, and over (a percent) the quotas
+# using more than that much of their disk limit.  Every given filter must
+# match.
+def aiqum_quota_lookup(index,user=None,volume=None,over=None,output=None):
+    query = "SELECT " + QUOTA_INDEX_COLUMNS + " FROM quota "
+    where = []
+    params = []
+    if user:
+        where.append("(userName = ? OR userId = ?)")
+        params.extend((user, user))
+    if volume:
+        where.append("(volume = ? OR junctionPath = ?)")
+        params.extend((volume, volume))
+    if over is not None:
+        where.append("percentUsed > ?")
+        params.append(over)
+    if where:
+        query = query + "WHERE " + " AND ".join(where) + " "
+    query = query + "ORDER BY cluster,vserver,volume,qtree,userName"
+
+    writer = ReportWriter(USER_QUOTA_COLUMNS,path=output)
+    cursor = index.execute(query, params)
+    while True:
+        rows = cursor.fetchmany(aiqum_common.BATCH_SIZE)
+        if not rows:
+            break
+        writer.write_batch(rows)
+    writer.close()
 
     return 1
 
@@ -85,23 +173,75 @@ def aiqum_user_quotas(cnx):
 # MAIN
 # -----------------------------------------------------------------------------
 
-# Parse the command line
-parser = ArgumentParser(
-    usage="%(prog)s [options]",
-    description="Sample code to pull user quota details from the AIQUM Datbase."
-)
-parser.add_argument(
-    '-a', '--aiqumhost', nargs='?', required=True, help='AIQUM Host'
-)
-parser.add_argument(
-    '-u', '--username', nargs='?', required=True, help='AIQUM Username'
-)
-parser.add_argument(
-    '-p', '--password', nargs='?', help='Password for AIQUM username'
-)
-args = parser.parse_args()
-if not args.password: args.password = getpass()
-
-# Connect to AIQUM and print the user quota details.
-cnx = aiqum_db_connect(args.aiqumhost,args.username,args.password)
-aiqum_user_quotas(cnx)
+if __name__ == "__main__":
+    # Parse the command line
+    parser = ArgumentParser(
+        usage="%(prog)s [options]",
+        description="Sample code to pull user quota details from the AIQUM Datbase."
+    )
+    parser.add_argument(
+        '-a', '--aiqumhost', nargs='?', help='AIQUM Host'
+    )
+    parser.add_argument(
+        '-u', '--username', nargs='?', help='AIQUM Username'
+    )
+    parser.add_argument(
+        '-p', '--password', nargs='?', help='Password for AIQUM username'
+    )
+    parser.add_argument(
+        '--index', metavar='FILE',
+        help='Refresh the local SQLite quota index in FILE, or look up '
+             'quotas in it with --user, --volume or --over'
+    )
+    parser.add_argument(
+        '--user', help='Look up quotas of this user name or ID (--index)'
+    )
+    parser.add_argument(
+        '--volume', help='Look up quotas on this volume or junction path '
+                         '(--index)'
+    )
+    parser.add_argument(
+        '--over', type=float, metavar='PERCENT',
+        help='Look up quotas over this percent of their disk limit (--index)'
+    )
+    aiqum_add_batch_args(parser)
+    aiqum_add_connection_args(parser)
+    aiqum_add_profile_args(parser)
+    aiqum_add_delta_args(parser)
+    args = parser.parse_args()
+    aiqum_common.BATCH_SIZE = args.batch_size
+    aiqum_connection_options(args)
+    lookup = args.user or args.volume or args.over is not None
+    if lookup and not args.index:
+        parser.error("--user, --volume and --over require --index")
+    if args.index and args.since_state:
+        parser.error("--since-state cannot be used with --index")
+
+    # Lookups are answered from the index alone.
+    if lookup:
+        index = aiqum_open_sqlite(args.index,QUOTA_INDEX_SCHEMA)
+        aiqum_quota_lookup(index,args.user,args.volume,args.over)
+        index.close()
+        sys.exit(0)
+
+    if not (args.aiqumhost and args.username):
+        parser.error("-a/--aiqumhost and -u/--username are required")
+    if not args.password: args.password = getpass()
+    aiqum_profile_start(args)
+
+    # Connect to AIQUM and print the user quota details, or refresh the
+    # index with them.
+    with aiqum_phase('connect'):
+        cnx = aiqum_db_connect(args.aiqumhost,args.username,args.password)
+    cnx = aiqum_profile_connection(cnx)
+    if args.index:
+        index = aiqum_open_sqlite(args.index,QUOTA_INDEX_SCHEMA)
+        count = aiqum_refresh_quota_index(cnx,index)
+        index.close()
+        print("Refreshed %i clusters." % count, file=sys.stderr)
+    elif args.since_state:
+        aiqum_delta_report(cnx,aiqum_user_quota_batches,USER_QUOTA_COLUMNS,
+                           args.since_state)
+    else:
+        aiqum_user_quotas(cnx)
+    aiqum_profile_report(args)
@@ -21,155 +21,958 @@
 ################################################################################
 
 import mysql.connector
+import mysql.connector.pooling
+import aiqum_common
+from aiqum_common import VolumeMap, ReportWriter, aiqum_report_writer
+from aiqum_common import aiqum_db_pool, aiqum_fetch_batches, aiqum_percentile
+from aiqum_common import aiqum_save_json, aiqum_in_list
+from aiqum_common import aiqum_add_batch_args
+from aiqum_common import aiqum_db_connect
+from aiqum_common import aiqum_add_connection_args, aiqum_connection_options
+from aiqum_common import aiqum_add_profile_args, aiqum_profile_start
+from aiqum_common import aiqum_profile_connection, aiqum_profile_report
+from aiqum_common import aiqum_phase
+from aiqum_common import aiqum_add_output_args, aiqum_check_output_args
 import sys
+import os
+import json
 import datetime
 import time
+import heapq
+import pickle
+import tempfile
+import threading
 from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice, groupby
 from getpass import getpass
 
-# Connection setup for AIQUM.
-def aiqum_db_connect(aiq_host,aiq_user,aiq_password,aiq_db):
+# Maximum number of QoS objids pushed down in a single IN list.  Clusters with
+# more volume workloads than this are queried by objid range instead.
+QOS_INLIST_MAX = 20000
+
+# --join-mode server needs SELECT on both databases in one statement.  These
+# MySQL errors (database, table and column access denied) mean it was refused,
+# and the report falls back to --join-mode client.
+JOIN_DENIED_ERRORS = (1044, 1142, 1143)
+
+# --rollup intervals in milliseconds.  Buckets are aligned to the epoch (UTC).
+ROLLUPS = {'5m': 300000, '1h': 3600000, '1d': 86400000}
+
+# --top: the summary table column and report column name of each --by metric,
+# and the report column prefix of each --agg.
+TOP_METRICS = {'iops': ("ops", "IOPs"),
+               'throughput': ("totalData", "Throughput(bytes/sec)")}
+TOP_AGGS = {'max': "Peak", 'avg': "Avg", 'p95': "P95"}
+
+# Manifest of a chunked export (--chunk-hours), in its -o directory.
+MANIFEST = "manifest.json"
+
+# Per-volume columns for raw samples and for rollups.
+SAMPLE_COLUMNS = [("Cluster","name"),("Vserver","name"),("Volume","name"),
+                  ("Timestamp","ms"),("IOPs","float"),
+                  ("Throughput(bytes/sec)","float")]
+ROLLUP_COLUMNS = [("Cluster","name"),("Vserver","name"),("Volume","name"),
+                  ("Timestamp","ms"),("Samples","int"),
+                  ("AvgIOPs","float"),("PeakIOPs","float"),
+                  ("AvgThroughput(bytes/sec)","float"),
+                  ("P95Throughput(bytes/sec)","float")]
+
+# Mappings of objid to names for clusters, vservers, and volumes, filled in by
+# aiqum_object_mappings().
+# netapp_model qos_workload.holderid == volume.objid.
+# netapp_performance summary_qos_volume_workload_<clusterid>.objid == holderid.
+clustermap = {}
+vservermap = {}
+volmap = VolumeMap()
+
+# Incremental mode: per-cluster sample time to start after (from the state
+# file) and the last sample time fetched in this run.
+clusterstart = {}
+clusterhwm = {}
+
+# Row and byte counts for the summary printed on stderr.
+perfstats = {'qos_total': 0, 'rows': 0, 'skipped': 0, 'bytes': 0}
+perfstats_lock = threading.Lock()
+
+# Load the object mappings from the cache file.  The cache is only used when
+# it is younger than ttl seconds and every cluster's lastUpdateTime is the one
+# the cache was built from.
+def aiqum_load_map_cache(cachefile,lastupdate,ttl):
     try:
-        cnx = mysql.connector.connect(host=aiq_host,
-                                      user=aiq_user,
-                                      password=aiq_password,
-                                      database=aiq_db
-                                      )
-    except:
-        print()
-        print("Error connecting to AIQUM Database. Exiting.")
-        print()
-        raise
+        with open(cachefile) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    if time.time() - cache['created'] > ttl:
+        return 0
+    if cache['lastupdate'] != {str(objid): lastupdate[objid]
+                               for objid in lastupdate}:
+        return 0
+
+    for objid, name in cache['vservermap'].items():
+        vservermap[int(objid)] = name
+    volmap.load(cache['volmap'])
+    perfstats['qos_total'] = cache['qos_total']
 
-    return cnx
+    return 1
 
-# Query AIQUM for object mappings.
-def aiqum_object_mappings(cnx,clustercsv):
-    cursor = cnx.cursor()
+# Save the object mappings to the cache file.
+def aiqum_save_map_cache(cachefile,lastupdate):
+    cache = {'created': time.time(),
+             'lastupdate': lastupdate,
+             'vservermap': vservermap,
+             'volmap': volmap.to_dict(),
+             'qos_total': perfstats['qos_total']}
+    tmpfile = cachefile + ".tmp"
+    with open(tmpfile, "w") as f:
+        json.dump(cache, f)
+    os.replace(tmpfile, cachefile)
+
+# Query AIQUM for object mappings, or load them from cachefile when the
+# clusters have not been updated since the cache was written.  With
+# names=False only the clusters are looked up, for --join-mode server.
+def aiqum_object_mappings(cnx,clustercsv,cachefile=None,ttl=3600,names=True):
+    cursor = cnx.cursor(buffered=False)
 
     # Get cluster objid dict.
-    querytxt = "SELECT objid,name FROM cluster "
-    x = 0
-    for clustername in clustercsv.split(","):
-        if x == 0:
-            querytxt = querytxt + "WHERE name='" + clustername + "' "
-        else:
-            querytxt = querytxt + "OR name='" + clustername + "' "
-        x = x + 1
-    query = (querytxt)
-    cursor.execute(query)
+    lastupdate = {}
+    clusternames = clustercsv.split(",")
+    query = ("SELECT objid,name,lastUpdateTime FROM cluster "
+             "WHERE name IN " + aiqum_in_list(clusternames))
+    cursor.execute(query, clusternames)
     for row in cursor:
         clustermap[row[0]] = row[1]
+        lastupdate[row[0]] = row[2]
 
-    # Create where clause used for all the following queries.
-    x = 0
-    whereclause = ""
-    for clusterid in clustermap:
-        if x == 0:
-            whereclause = whereclause + "WHERE clusterid='" + str(clusterid) + "' "
-        else:
-            whereclause = whereclause + "OR clusterid='" + str(clusterid) + "' "
-        x = x + 1
+    if not names:
+        return 1
+    if cachefile and aiqum_load_map_cache(cachefile,lastupdate,ttl):
+        return 1
+
+    # None of the clusters are known, so there is nothing to map.
+    if not clustermap:
+        volmap.freeze()
+        return 1
+
+    # Where clause used for all the following queries, with its parameters.
+    clusterids = list(clustermap)
+    whereclause = "WHERE clusterid IN " + aiqum_in_list(clusterids)
 
     # Get vserver objid dict.
     query = ("SELECT objid,name FROM vserver " + whereclause)
-    cursor.execute(query)
+    cursor.execute(query, clusterids)
     for row in cursor:
         vservermap[row[0]] = row[1]
 
     # Get volume objid dict and populate mappings.
     query = ("SELECT objid,name,clusterid,vserverid FROM volume " + whereclause)
-    cursor.execute(query)
+    cursor.execute(query, clusterids)
     for row in cursor:
-        volmap[row[0]] = {}
-        volmap[row[0]]['name'] = row[1]
-        volmap[row[0]]['cluster'] = clustermap[row[2]]
-        volmap[row[0]]['vserver'] = vservermap[row[3]]
+        volmap.add_volume(row[0],clustermap[row[2]],vservermap[row[3]],row[1])
 
-    # Get map of QoS objid to volume objid (QoS holderid).
+    # Get map of QoS objid to volume objid (QoS holderid).  Workloads whose
+    # holder is not a volume are dropped when the map is frozen, which also
+    # groups the volume QoS objids per cluster for the performance queries.
     query = ("SELECT objid,holderid FROM qos_workload " + whereclause)
-    cursor.execute(query)
+    cursor.execute(query, clusterids)
     for row in cursor:
-        qosmap[row[0]] = row[1]
+        perfstats['qos_total'] += 1
+        volmap.add_qos(row[0],row[1])
+    volmap.freeze()
+
+    if cachefile:
+        aiqum_save_map_cache(cachefile,lastupdate)
+
+    return 1
+
+# Convert a --start/--end value (epoch seconds or an ISO date/time in local
+# time, e.g. "2024-01-31" or "2024-01-31 12:00") to epoch milliseconds.
+def aiqum_parse_time(value):
+    try:
+        if value.isdigit():
+            return int(value) * 1000
+        return int(datetime.datetime.fromisoformat(value).timestamp()) * 1000
+    except ValueError:
+        print("Invalid time value: " + value, file=sys.stderr)
+        raise
+
+# --join-mode server: the names selected, and the joins from a summary table
+# (as s) to the netapp_model_view tables that resolve them.  The inner joins
+# keep only volume workloads.
+JOINED_NAMES = "cluster.name,vserver.name,volume.name"
+JOINED_TABLES = ("INNER JOIN netapp_model_view.qos_workload AS qos "
+                 "ON s.objid = qos.objid "
+                 "INNER JOIN netapp_model_view.volume AS volume "
+                 "ON qos.holderId = volume.objid "
+                 "INNER JOIN netapp_model_view.vserver AS vserver "
+                 "ON volume.vserverId = vserver.objid "
+                 "INNER JOIN netapp_model_view.cluster AS cluster "
+                 "ON volume.clusterId = cluster.objid ")
+
+# Return the 95th percentile of the samples returned by GROUP_CONCAT, a comma
+# separated list (bytes from some connector and server versions).
+def p95_of(concat):
+    if isinstance(concat, (bytes, bytearray)):
+        concat = concat.decode()
+    return aiqum_percentile([float(value) for value in concat.split(",")], 95)
+
+# Turn samples ordered by objid, each row ending with the sample value, into
+# one row per objid with the sample count and 95th percentile appended to
+# head(first row of the run).  Only one objid's samples are held at a time.
+def p95_runs(rows,head):
+    for objid, run in groupby(rows, key=lambda row: row[0]):
+        first = next(run)
+        values = [float(first[-1])] + [float(row[-1]) for row in run]
+        yield head(first) + (len(values), aiqum_percentile(values, 95))
+
+# Query a cluster's summary table (as s) for samples in the [starttime,
+# endtime) window, ordered by time.  The table is named with its database so
+# that the query works on a netapp_model_view connection.
+#
+# With join "client" only the given (sorted) QoS objids are requested and
+# each row starts with the QoS objid.  With join "server" the summary table is
+# joined to the netapp_model_view tables, so that the server returns the
+# cluster, vserver and volume names in place of the objid (and qosids is not
+# used).
+#
+# With a rollup interval (milliseconds) the samples are grouped per workload
+# and interval in SQL, returning the sample count, average and peak IOPs,
+# average throughput and the throughput samples (for the client-side p95).
+def aiqum_perf_query(cursor,clusterid,qosids,starttime,endtime,rollup=None,
+                     join="client"):
+    select = "s.objid"
+    if join == "server":
+        select = JOINED_NAMES
+    if rollup:
+        cursor.execute("SET SESSION group_concat_max_len = 16777216")
+        bucket = "s.fromtime - (s.fromtime % " + str(rollup) + ")"
+        query = ("SELECT " + select + "," + bucket + " AS bucket,COUNT(*),"
+                 "AVG(s.ops),MAX(s.ops),AVG(s.totalData),"
+                 "GROUP_CONCAT(CAST(s.totalData AS CHAR)) ")
+    else:
+        query = "SELECT " + select + ",s.fromtime,s.ops,s.totalData "
+    query = (query +
+             "FROM netapp_performance.summary_qos_volume_workload_" +
+             str(clusterid) + " AS s "
+            )
+    if join == "server":
+        query = query + JOINED_TABLES
+    query = query + "WHERE s.fromtime >= %s "
+    params = [starttime]
+    if endtime:
+        query = query + "AND s.fromtime < %s "
+        params.append(endtime)
+    if join != "server":
+        if len(qosids) <= QOS_INLIST_MAX:
+            query = query + "AND s.objid IN " + aiqum_in_list(qosids) + " "
+            params.extend(qosids)
+        else:
+            query = query + "AND s.objid BETWEEN %s AND %s "
+            params.extend((qosids[0], qosids[-1]))
+    if rollup:
+        # With join "server" the names are grouped on too, as MySQL cannot
+        # tell through the views that they depend on the objid.
+        group = "s.objid,"
+        if join == "server":
+            group = group + JOINED_NAMES + ","
+        query = query + "GROUP BY " + group + "bucket ORDER BY bucket,s.objid"
+    else:
+        query = query + "ORDER BY s.fromtime,s.objid"
+
+    cursor.execute(query, params)
+    return cursor
+
+# Query one cluster's summary table and yield its volume samples in order.
+# Rows are streamed in fetchmany() batches from an unbuffered cursor, so
+# memory use does not grow with the number of samples.  With a rollup
+# interval, one row per volume and interval is yielded instead.
+#
+# With join "client" only the cluster's volume QoS workloads are requested
+# and their names are looked up in volmap.  Rows of non-volume workloads,
+# which can only show up when the cluster was queried by objid range, are
+# dropped here.  With join "server" (--join-mode server) the names come with
+# each row, so no mappings are needed beyond the cluster list.
+def aiqum_cluster_perf(cnx,clusterid,starttime,endtime,rollup=None,
+                       join="client"):
+    qosids = None
+    if join != "server":
+        qosids = volmap.cluster_qosids(clustermap[clusterid])
+        if not qosids:
+            return
+    # In incremental mode only fetch samples newer than the last one seen.
+    if clusterid in clusterstart:
+        starttime = max(starttime, clusterstart[clusterid] + 1)
+    cursor = cnx.cursor(buffered=False)
+    aiqum_perf_query(cursor,clusterid,qosids,starttime,endtime,rollup,join)
+
+    # The same workloads repeat at every timestamp, so resolve each one's names
+    # once per cluster.
+    volnames = {}
+    rowcount = 0
+    skipcount = 0
+    bytecount = 0
+    lasttime = None
+    for rows in aiqum_fetch_batches(cursor):
+        for row in rows:
+            # Approximate size on the wire: packet header plus each text value
+            # and its length prefix.
+            rowcount += 1
+            bytecount += 4 + sum(len(str(value)) + 1 for value in row)
+            if join == "server":
+                names = tuple(row[:3])
+                values = row[3:]
+            else:
+                if row[0] not in volnames:
+                    volrow = volmap.lookup(row[0])
+                    if volrow >= 0:
+                        volnames[row[0]] = volmap.names(volrow)
+                    else:
+                        volnames[row[0]] = None
+                names = volnames[row[0]]
+                if names is None:
+                    skipcount += 1
+                    continue
+                values = row[1:]
+            lasttime = values[0]
+            if rollup:
+                yield names + tuple(values[:5]) + (p95_of(values[5]),)
+            else:
+                yield names + tuple(values)
+    cursor.close()
+
+    with perfstats_lock:
+        perfstats['rows'] += rowcount
+        perfstats['skipped'] += skipcount
+        perfstats['bytes'] += bytecount
+        if lasttime is not None:
+            clusterhwm[clusterid] = lasttime
+
+# Return whether --join-mode server can be used on cnx, by running the joined
+# query of the first cluster over an empty time window.  False means the
+# cross-database access was denied.
+def aiqum_server_join_allowed(cnx):
+    if not clustermap:
+        return True
+    cursor = cnx.cursor(buffered=False)
+    try:
+        aiqum_perf_query(cursor,next(iter(clustermap)),None,0,1,join="server")
+        cursor.fetchall()
+    except mysql.connector.Error as error:
+        if error.errno in JOIN_DENIED_ERRORS:
+            print("Cross-database join denied (" + str(error) + "), "
+                  "using --join-mode client.", file=sys.stderr)
+            return False
+        raise
+    finally:
+        cursor.close()
+    return True
+
+# Pool worker: run one cluster's query on a pooled connection, spooling the
+# samples to a temporary file so that clusters fetched ahead are not held in
+# memory.
+def aiqum_pool_cluster_perf(pool,clusterid,starttime,endtime,rollup=None,
+                            join="client"):
+    cnx = pool.get_connection()
+    spool = tempfile.TemporaryFile()
+    try:
+        batch = []
+        for row in aiqum_cluster_perf(cnx,clusterid,starttime,endtime,
+                                      rollup,join):
+            batch.append(row)
+            if len(batch) >= aiqum_common.BATCH_SIZE:
+                pickle.dump(batch, spool)
+                batch = []
+        pickle.dump(batch, spool)
+    except:
+        spool.close()
+        raise
+    finally:
+        cnx.close()
+    spool.seek(0)
+    return spool
+
+# Yield the samples spooled by aiqum_pool_cluster_perf(), closing the spool.
+def aiqum_read_spool(spool):
+    with spool:
+        while True:
+            try:
+                yield from pickle.load(spool)
+            except EOFError:
+                return
+
+# Yield (clusterid, samples) for each cluster in cluster name order.  With a
+# pool, the clusters are queried by worker threads, with at most two clusters
+# per worker fetched ahead of the one currently being written.
+def aiqum_perf_clusters(cnx,starttime,endtime,workers,rollup=None,
+                        join="client"):
+    clusterids = sorted(clustermap, key=lambda clusterid: clustermap[clusterid])
+    if workers <= 1:
+        for clusterid in clusterids:
+            yield clusterid, aiqum_cluster_perf(cnx,clusterid,starttime,
+                                                endtime,rollup,join)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for clusterid in clusterids:
+            pending.append((clusterid,
+                            executor.submit(aiqum_pool_cluster_perf,
+                                            cnx,clusterid,starttime,endtime,
+                                            rollup,join)))
+            if len(pending) >= workers * 2:
+                clusterid, future = pending.popleft()
+                yield clusterid, aiqum_read_spool(future.result())
+        while pending:
+            clusterid, future = pending.popleft()
+            yield clusterid, aiqum_read_spool(future.result())
+
+# --top: query one cluster's summary table for one row per volume workload
+# with its sample count and the --agg of the column over the [starttime,
+# endtime) window.  max and avg are computed by the server, which also ranks
+# them and returns only the first limit rows when the volume workloads were
+# requested by IN list.  With join "server" the rows start with the three
+# names (as in aiqum_perf_query()), otherwise with the QoS objid.  For p95
+# the samples themselves are returned, ordered by objid, as rows of the objid
+# (and with join "server" the three names) and the sample, for p95_runs().
+def aiqum_top_query(cursor,clusterid,qosids,starttime,endtime,column,agg,
+                    limit,join="client"):
+    table = ("netapp_performance.summary_qos_volume_workload_" +
+             str(clusterid) + " AS s ")
+    if agg == "p95":
+        value = "s." + column
+        group = "ORDER BY s.objid "
+    else:
+        value = "COUNT(*)," + agg.upper() + "(s." + column + ") AS value"
+        group = "GROUP BY s.objid "
+    if join == "server":
+        if agg == "p95":
+            query = "SELECT s.objid," + JOINED_NAMES + "," + value + " "
+        else:
+            query = "SELECT " + JOINED_NAMES + "," + value + " "
+            group = "GROUP BY s.objid," + JOINED_NAMES + " "
+        query = query + "FROM " + table + JOINED_TABLES
+    else:
+        query = "SELECT s.objid," + value + " FROM " + table
+    query = query + "WHERE s.fromtime >= %s "
+    params = [starttime]
+    if endtime:
+        query = query + "AND s.fromtime < %s "
+        params.append(endtime)
+
+    # Rows of non-volume workloads in an objid range would be dropped after
+    # the LIMIT, so the ranking is only pushed down for exact workload lists.
+    ranked = agg != "p95"
+    if join != "server":
+        if len(qosids) <= QOS_INLIST_MAX:
+            query = query + "AND s.objid IN " + aiqum_in_list(qosids) + " "
+            params.extend(qosids)
+        else:
+            query = query + "AND s.objid BETWEEN %s AND %s "
+            params.extend((qosids[0], qosids[-1]))
+            ranked = False
+    query = query + group
+    if ranked:
+        query = query + "ORDER BY value DESC,s.objid LIMIT %s"
+        params.append(limit)
+
+    cursor.execute(query, params)
+    return cursor
+
+# --top: return the limit busiest volumes of one cluster as (cluster, vserver,
+# volume, samples, value) rows, busiest first.  Only one row per volume is
+# fetched (for p95, one volume's samples are held at a time), and only the
+# limit best are kept, so memory does not grow with the number of samples.
+def aiqum_cluster_top(cnx,clusterid,starttime,endtime,column,agg,limit,
+                      join="client"):
+    qosids = None
+    if join != "server":
+        qosids = volmap.cluster_qosids(clustermap[clusterid])
+        if not qosids:
+            return []
+    cursor = cnx.cursor(buffered=False)
+    aiqum_top_query(cursor,clusterid,qosids,starttime,endtime,column,agg,
+                    limit,join)
+
+    counts = {'rows': 0, 'skipped': 0, 'bytes': 0}
+    def fetched():
+        for rows in aiqum_fetch_batches(cursor):
+            for row in rows:
+                counts['rows'] += 1
+                counts['bytes'] += 4 + sum(len(str(value)) + 1
+                                           for value in row)
+                yield row
+    def volumes():
+        rows = fetched()
+        if agg == "p95":
+            if join == "server":
+                rows = p95_runs(rows, lambda row: tuple(row[1:4]))
+            else:
+                rows = p95_runs(rows, lambda row: (row[0],))
+        for row in rows:
+            if join == "server":
+                names = tuple(row[:3])
+            else:
+                volrow = volmap.lookup(row[0])
+                if volrow < 0:
+                    counts['skipped'] += 1
+                    continue
+                names = volmap.names(volrow)
+            yield names + (row[-2], float(row[-1]))
+    top = heapq.nlargest(limit, volumes(), key=lambda row: row[4])
+    cursor.close()
+
+    with perfstats_lock:
+        for key in counts:
+            perfstats[key] += counts[key]
+    return top
+
+# Pool worker: run aiqum_cluster_top() on a pooled connection.
+def aiqum_pool_cluster_top(pool,*args):
+    cnx = pool.get_connection()
+    try:
+        return aiqum_cluster_top(cnx,*args)
+    finally:
+        cnx.close()
+
+# Write the limit busiest volumes over the [starttime, endtime) window, by
+# the agg (a TOP_AGGS key) of the by metric (a TOP_METRICS key), busiest
+# first.  Each cluster's top volumes are found separately (in parallel for
+# workers > 1, cnx is then a pool) and merged.
+def aiqum_volumes_top(cnx,starttime,endtime,limit,by="iops",agg="max",
+                      workers=1,fmt="csv",output=None,join="client"):
+    column, label = TOP_METRICS[by]
+    columns = [("Cluster","name"),("Vserver","name"),("Volume","name"),
+               ("Samples","int"),(TOP_AGGS[agg] + label,"float")]
+    clusterids = sorted(clustermap, key=lambda clusterid: clustermap[clusterid])
+    args = (starttime,endtime,column,agg,limit,join)
+    if workers <= 1:
+        tops = [aiqum_cluster_top(cnx,clusterid,*args)
+                for clusterid in clusterids]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            tops = list(executor.map(
+                lambda clusterid: aiqum_pool_cluster_top(cnx,clusterid,*args),
+                clusterids))
+
+    writer = aiqum_report_writer(columns,fmt,output)
+    writer.write_batch(heapq.nlargest(limit,
+                                      (row for top in tops for row in top),
+                                      key=lambda row: row[4]))
+    writer.close()
+    aiqum_perf_summary(join)
 
     return 1
 
-# Query AIQUM for volume data and print in CSV format.
-def aiqum_volumes_perf(cnx,days):
-    cursor = cnx.cursor()
-
-    # Convert days requested to epoch time in history.
-    seconds = int(days) * 86400
-    starttime = int(time.time()) - seconds
-    starttime = starttime * 1000
-
-    print("Cluster,Vserver,Volume,Timestamp,IOPs,Throughput(bytes/sec)")
-    for clusterid in clustermap:
-        query = ("SELECT objid,fromtime,ops,totalData "
-                 "FROM summary_qos_volume_workload_" + str(clusterid) + " "
-                 "WHERE fromtime > " + str(starttime)
-                )
-        cursor.execute(query)
-        for row in cursor:
-            qosid = row[0]
-            if qosid in qosmap:
-                volid = qosmap[qosid]
-                if volid in volmap:
-                    epochtime = "%i" % (row[1] / 1000)
-                    timestamp = datetime.datetime.fromtimestamp(int(epochtime))
-                    print("%s,%s,%s,%s,%s,%s"
-                          %
-                          (volmap[volid]['cluster'],
-                          volmap[volid]['vserver'],
-                          volmap[volid]['name'],
-                          timestamp,row[2],row[3])
-                          )
+# Load the incremental state file.  It holds the last sample time seen per
+# cluster and the size of the output file when that state was saved.  A
+# missing state file starts a new output, so an existing non-empty output
+# (e.g. with a mistyped or deleted state file) is refused rather than cut off.
+def aiqum_load_state(statefile,output):
+    if not os.path.exists(statefile):
+        if os.path.exists(output) and os.path.getsize(output) > 0:
+            print("Output " + output + " exists but state file " + statefile +
+                  " does not. Exiting.", file=sys.stderr)
+            sys.exit(1)
+        return {'output': os.path.abspath(output), 'offset': 0, 'clusters': {}}
+    with open(statefile) as f:
+        state = json.load(f)
+    if state['output'] != os.path.abspath(output):
+        print("State file " + statefile + " belongs to output " +
+              state['output'] + ". Exiting.", file=sys.stderr)
+        sys.exit(1)
+    state['clusters'] = {int(clusterid): lasttime
+                         for clusterid, lasttime in state['clusters'].items()}
+    return state
+
+# Atomically replace the incremental state file.
+def aiqum_save_state(statefile,state):
+    aiqum_save_json(statefile,state)
+
+# Open the output file for an incremental run.  Anything written after the
+# last saved state (a crashed run) is cut off, as those samples are newer than
+# the saved high-water marks and will be fetched again.
+def aiqum_open_incremental(output,state):
+    with open(output, "a") as f:
+        f.truncate(state['offset'])
+    return open(output, "a", newline="")
+
+# Query AIQUM for volume data and write it in the requested format.
+# cnx is a connection, or a connection pool when workers > 1.
+# starttime and endtime are epoch milliseconds, endtime may be None.
+# With a statefile, CSV samples are appended to output and the state is saved
+# after each cluster is complete, so a rerun never loses or repeats samples.
+# With rollup (a ROLLUPS key), per-interval summaries are written instead.
+# join is the --join-mode; "server" needs only the cluster mappings.
+def aiqum_volumes_perf(cnx,starttime,endtime=None,workers=1,
+                       output=None,statefile=None,fmt="csv",rollup=None,
+                       join="client"):
+    columns = SAMPLE_COLUMNS
+    if rollup:
+        columns = ROLLUP_COLUMNS
+        rollup = ROLLUPS[rollup]
+    state = None
+    if statefile:
+        state = aiqum_load_state(statefile,output)
+        clusterstart.update(state['clusters'])
+        out = aiqum_open_incremental(output,state)
+        writer = ReportWriter(columns,stream=out,header=state['offset'] == 0)
+    else:
+        writer = aiqum_report_writer(columns,fmt,output)
+
+    for clusterid, rows in aiqum_perf_clusters(cnx,starttime,endtime,workers,
+                                               rollup,join):
+        writer.write_rows(rows)
+        if state:
+            writer.flush()
+            os.fsync(out.fileno())
+            state['offset'] = os.fstat(out.fileno()).st_size
+            if clusterid in clusterhwm:
+                state['clusters'][clusterid] = clusterhwm[clusterid]
+            aiqum_save_state(statefile,state)
+    writer.close()
+    if state:
+        out.close()
+    aiqum_perf_summary(join)
 
     return 1
 
+# Split [starttime, endtime) into ranges with boundaries on multiples of
+# chunkms (epoch milliseconds), so that rollup intervals which divide chunkms
+# are never split between chunks.
+def aiqum_chunk_ranges(starttime,endtime,chunkms):
+    ranges = []
+    start = starttime
+    while start < endtime:
+        end = min(start - start % chunkms + chunkms, endtime)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+# Part file name of a (cluster, time range) chunk.
+def aiqum_chunk_name(cluster,start,end,fmt):
+    return "%s_%i_%i.%s" % (cluster,start,end,fmt)
+
+# Write one chunk's samples to its part file in outdir and return the row
+# count.  The file is written under a temporary name and only renamed when
+# complete, so a part file that exists is always whole.
+def aiqum_write_chunk(cnx,clusterid,start,end,outdir,name,fmt,rollup,join):
+    columns = SAMPLE_COLUMNS
+    if rollup:
+        columns = ROLLUP_COLUMNS
+    path = os.path.join(outdir,name)
+    tmpfile = path + ".tmp"
+    rowcount = 0
+    try:
+        writer = aiqum_report_writer(columns,fmt,tmpfile)
+        rows = aiqum_cluster_perf(cnx,clusterid,start,end,rollup,join)
+        while True:
+            batch = list(islice(rows, aiqum_common.BATCH_SIZE))
+            if not batch:
+                break
+            writer.write_batch(batch)
+            rowcount += len(batch)
+        writer.close()
+    except:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+        raise
+    os.replace(tmpfile,path)
+    return rowcount
+
+# Pool worker: write one chunk on a pooled connection.
+def aiqum_pool_write_chunk(pool,*args):
+    cnx = pool.get_connection()
+    try:
+        return aiqum_write_chunk(cnx,*args)
+    finally:
+        cnx.close()
+
+# Load the manifest of a chunked export, checking that it is for clusters.
+def aiqum_load_manifest(manifestfile,clusters):
+    try:
+        with open(manifestfile) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as error:
+        print("Cannot read " + manifestfile + ": " + str(error) +
+              ". Exiting.", file=sys.stderr)
+        sys.exit(1)
+    if manifest['clusters'] != clusters:
+        print("Manifest " + manifestfile + " is for clusters " +
+              ",".join(manifest['clusters']) + ". Exiting.", file=sys.stderr)
+        sys.exit(1)
+    return manifest
+
+# Query AIQUM for volume data in (cluster, time range) chunks of chunkhours,
+# each written to its own part file in the outdir directory.  Each completed
+# chunk is recorded in the directory's manifest, with its row count.  With
+# resume, the time window, chunk size, format and rollup are taken from the
+# manifest and only the chunks it does not record are written.  The chunks
+# are also the units of work for workers > 1 (cnx is then a pool).  A failed
+# chunk is reported and skipped; the number of failed chunks is returned.
+def aiqum_volumes_perf_chunked(cnx,outdir,starttime=None,endtime=None,
+                               chunkhours=24,workers=1,fmt="csv",rollup=None,
+                               join="client",resume=False):
+    clusters = sorted(clustermap.values())
+    manifestfile = os.path.join(outdir,MANIFEST)
+    if resume:
+        manifest = aiqum_load_manifest(manifestfile,clusters)
+    elif os.path.exists(manifestfile):
+        print(outdir + " already has a " + MANIFEST + ", use --resume to "
+              "finish it. Exiting.", file=sys.stderr)
+        sys.exit(1)
+    else:
+        # An open-ended window is fixed at the first run, so that a resumed
+        # run writes the same chunks.
+        if not endtime:
+            endtime = int(time.time()) * 1000
+        manifest = {'clusters': clusters, 'start': starttime, 'end': endtime,
+                    'chunk_hours': chunkhours, 'format': fmt,
+                    'rollup': rollup, 'parts': {}}
+        os.makedirs(outdir, exist_ok=True)
+        aiqum_save_json(manifestfile,manifest)
+    fmt = manifest['format']
+    rollup = manifest['rollup']
+    if rollup:
+        rollup = ROLLUPS[rollup]
+
+    # The chunks not yet recorded (or whose part file has gone missing).
+    chunks = []
+    ranges = aiqum_chunk_ranges(manifest['start'],manifest['end'],
+                                manifest['chunk_hours'] * 3600000)
+    for clusterid in sorted(clustermap,
+                            key=lambda clusterid: clustermap[clusterid]):
+        for start, end in ranges:
+            name = aiqum_chunk_name(clustermap[clusterid],start,end,fmt)
+            if (name not in manifest['parts'] or
+                not os.path.exists(os.path.join(outdir,name))):
+                chunks.append((name,(clusterid,start,end,outdir,name,fmt,
+                                     rollup,join)))
+    print("%i of %i chunks to write." % (len(chunks),
+                                         len(ranges) * len(clusters)),
+          file=sys.stderr)
+
+    # Record each chunk in the manifest as it completes.
+    failed = 0
+    def finished(name,result):
+        nonlocal failed
+        try:
+            manifest['parts'][name] = result()
+        except (mysql.connector.Error, OSError) as error:
+            print("Chunk " + name + " failed: " + str(error), file=sys.stderr)
+            failed += 1
+            return
+        aiqum_save_json(manifestfile,manifest)
+
+    if workers <= 1:
+        for name, chunk in chunks:
+            finished(name,lambda: aiqum_write_chunk(cnx,*chunk))
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(aiqum_pool_write_chunk,cnx,*chunk): name
+                       for name, chunk in chunks}
+            for future in as_completed(futures):
+                finished(futures[future],future.result)
+    aiqum_perf_summary(join)
+
+    return failed
+
+# Summarize how much data the perf queries moved, on stderr.
+def aiqum_perf_summary(join="client"):
+    if join == "server":
+        print("Fetched %i rows (~%.1f MB) from %i clusters, names joined "
+              "server-side." % (perfstats['rows'],
+                                perfstats['bytes'] / (1024*1024),
+                                len(clustermap)),
+              file=sys.stderr)
+        return
+    print("Fetched %i rows (~%.1f MB) from %i clusters for %i of %i QoS "
+          "workloads (volume workloads only), %i rows dropped client-side."
+          % (perfstats['rows'],perfstats['bytes'] / (1024*1024),
+             len(clustermap),len(volmap.qosids),perfstats['qos_total'],
+             perfstats['skipped']),
+          file=sys.stderr)
+
 # -----------------------------------------------------------------------------
 # MAIN
 # -----------------------------------------------------------------------------
 
-# Parse the command line
-parser = ArgumentParser(
-    usage="%(prog)s [options]",
-    description="Sample code to pull volume details from the AIQUM Datbase."
-)
-parser.add_argument(
-    '-a', '--aiqumhost', nargs='?', required=True, help='AIQUM Host'
-)
-parser.add_argument(
-    '-u', '--username', nargs='?', required=True, help='AIQUM Username'
-)
-parser.add_argument(
-    '-p', '--password', nargs='?', help='Password for AIQUM username'
-)
-parser.add_argument(
-    '-c', '--clusters', nargs='?', required=True, help='CSV list of clusters'
-)
-parser.add_argument(
-    '-d', '--days', nargs='?', required=True, help='Days of history to pull'
-)
-args = parser.parse_args()
-if not args.password: args.password = getpass()
-
-# Connect to AIQUM - first to the netapp_model_view db.
-db = "netapp_model_view"
-cnx = aiqum_db_connect(args.aiqumhost,args.username,args.password,db)
-
-# Gather a mapping of objid to names for clusters, vservers, and volumes.
-# netapp_model qos_workload.holderid == volume.objid.
-# netapp_performance summary_qos_volume_workload_<clusterid>.objid == holderid.
-clustermap = {}
-vservermap = {}
-volmap = {}
-qosmap = {}
-aiqum_object_mappings(cnx,args.clusters)
+if __name__ == "__main__":
+    # Parse the command line
+    parser = ArgumentParser(
+        usage="%(prog)s [options]",
+        description="Sample code to pull volume details from the AIQUM Datbase."
+    )
+    parser.add_argument(
+        '-a', '--aiqumhost', nargs='?', required=True, help='AIQUM Host'
+    )
+    parser.add_argument(
+        '-u', '--username', nargs='?', required=True, help='AIQUM Username'
+    )
+    parser.add_argument(
+        '-p', '--password', nargs='?', help='Password for AIQUM username'
+    )
+    parser.add_argument(
+        '-c', '--clusters', nargs='?', required=True, help='CSV list of clusters'
+    )
+    parser.add_argument(
+        '-d', '--days', nargs='?', help='Days of history to pull'
+    )
+    parser.add_argument(
+        '--start', help='Pull samples from this time (epoch or YYYY-MM-DD[ HH:MM])'
+    )
+    parser.add_argument(
+        '--end', help='Pull samples before this time (epoch or YYYY-MM-DD[ HH:MM])'
+    )
+    parser.add_argument(
+        '-w', '--workers', type=int, default=1,
+        help='Parallel per-cluster queries (1-%i, default 1)'
+             % mysql.connector.pooling.CNX_POOL_MAXSIZE
+    )
+    aiqum_add_output_args(parser)
+    parser.add_argument(
+        '--incremental', metavar='STATEFILE',
+        help='Append only samples newer than those recorded in STATEFILE'
+    )
+    parser.add_argument(
+        '--chunk-hours', type=int, metavar='HOURS',
+        help='Write (cluster, time range) chunks of HOURS as part files in '
+             'the -o directory, recorded in its ' + MANIFEST
+    )
+    parser.add_argument(
+        '--resume', action='store_true',
+        help='Write only the chunks missing from the -o directory\'s '
+             + MANIFEST + ' (its time window and options are used)'
+    )
+    parser.add_argument(
+        '--rollup', choices=list(ROLLUPS),
+        help='Write per-volume averages, peaks and p95 per interval'
+    )
+    parser.add_argument(
+        '--top', type=int, metavar='N',
+        help='Write only the N busiest volumes over the window'
+    )
+    parser.add_argument(
+        '--by', choices=list(TOP_METRICS), default='iops',
+        help='Metric to rank --top volumes by (default iops)'
+    )
+    parser.add_argument(
+        '--agg', choices=list(TOP_AGGS), default='max',
+        help='How to combine each volume\'s samples for --top (default max)'
+    )
+    parser.add_argument(
+        '--map-cache', metavar='FILE',
+        help='Cache the cluster/vserver/volume/QoS mappings in FILE'
+    )
+    parser.add_argument(
+        '--map-cache-ttl', type=int, default=3600, metavar='SECONDS',
+        help='Maximum age of the mapping cache (default 3600)'
+    )
+    parser.add_argument(
+        '--join-mode', choices=['client','server'], default='client',
+        help='Resolve names from mappings built here (client, default) or '
+             'by joining to netapp_model_view in each query (server)'
+    )
+    aiqum_add_batch_args(parser)
+    aiqum_add_connection_args(parser)
+    aiqum_add_profile_args(parser)
+    args = parser.parse_args()
+    aiqum_common.BATCH_SIZE = args.batch_size
+    aiqum_connection_options(args)
+    aiqum_check_output_args(parser,args)
+    if args.incremental and not args.output:
+        parser.error("--incremental requires -o/--output")
+    if args.incremental and args.format != "csv":
+        parser.error("--incremental requires --format csv")
+    if args.incremental and args.rollup:
+        parser.error("--incremental cannot be used with --rollup")
+    if not 1 <= args.workers <= mysql.connector.pooling.CNX_POOL_MAXSIZE:
+        parser.error("--workers must be between 1 and %i"
+                     % mysql.connector.pooling.CNX_POOL_MAXSIZE)
+    if (args.chunk_hours or args.resume) and not args.output:
+        parser.error("--chunk-hours and --resume require -o/--output")
+    if (args.chunk_hours or args.resume) and args.incremental:
+        parser.error("--incremental cannot be used with --chunk-hours")
+    if args.chunk_hours is not None and args.chunk_hours < 1:
+        parser.error("--chunk-hours must be at least 1")
+    if (args.chunk_hours and args.rollup and
+        args.chunk_hours * 3600000 % ROLLUPS[args.rollup]):
+        parser.error("--chunk-hours must be a whole number of --rollup "
+                     "intervals")
+    if args.top is not None and args.top < 1:
+        parser.error("--top must be at least 1")
+    if args.top and (args.incremental or args.rollup or args.chunk_hours or
+                     args.resume):
+        parser.error("--top cannot be used with --incremental, --rollup, "
+                     "--chunk-hours or --resume")
+    if not args.days and not args.start and not args.resume:
+        parser.error("one of -d/--days or --start is required")
+    if not args.password: args.password = getpass()
+    aiqum_profile_start(args)
+
+    # Work out the sample time window in epoch milliseconds.
+    starttime = None
+    if args.start:
+        starttime = aiqum_parse_time(args.start)
+    elif args.days:
+        starttime = (int(time.time()) - int(args.days) * 86400) * 1000
+    endtime = None
+    if args.end:
+        endtime = aiqum_parse_time(args.end)
+
+    # Connect to AIQUM (the netapp_model_view db).  The performance queries
+    # name the netapp_performance tables in full, so they run on the same
+    # connection, or on a pool of connections when the per-cluster queries are
+    # to run in parallel.  The mappings are then gathered on one of the pooled
+    # connections, so that no other connection is held open.
+    db = "netapp_model_view"
+    pool = None
+    if args.workers > 1:
+        with aiqum_phase('connect'):
+            pool = aiqum_db_pool(args.aiqumhost,args.username,args.password,db,
+                                 args.workers)
+        pool = aiqum_profile_connection(pool)
+        cnx = pool.get_connection()
+    else:
+        with aiqum_phase('connect'):
+            cnx = aiqum_db_connect(args.aiqumhost,args.username,
+                                   args.password,db)
+        cnx = aiqum_profile_connection(cnx)
 
-# Connect to AIQUM - now to the netapp_performance db.
-db = "netapp_performance"
-cnx = aiqum_db_connect(args.aiqumhost,args.username,args.password,db)
+    # Gather the mapping of objid to names for clusters, vservers, and
+    # volumes.  With --join-mode server only the clusters are needed, unless
+    # the joined query is denied.
+    join = args.join_mode
+    with aiqum_phase('mappings'):
+        if join == "server":
+            aiqum_object_mappings(cnx,args.clusters,names=False)
+            if not aiqum_server_join_allowed(cnx):
+                join = "client"
+        if join == "client":
+            aiqum_object_mappings(cnx,args.clusters,args.map_cache,
+                                  args.map_cache_ttl)
+    if pool:
+        cnx.close()
+        cnx = pool
 
-# Gather and print the volume performance details for the target clusters.
-aiqum_volumes_perf(cnx,args.days)
+    # Gather and print the volume performance details for the target clusters,
+    # or write them in chunks to the -o directory.
+    failed = 0
+    if args.top:
+        aiqum_volumes_top(cnx,starttime,endtime,args.top,args.by,args.agg,
+                          args.workers,args.format,args.output,join)
+    elif args.chunk_hours or args.resume:
+        failed = aiqum_volumes_perf_chunked(cnx,args.output,starttime,endtime,
+                                            args.chunk_hours,args.workers,
+                                            args.format,args.rollup,join,
+                                            args.resume)
+    else:
+        aiqum_volumes_perf(cnx,starttime,endtime,args.workers,
+                           args.output,args.incremental,args.format,
+                           args.rollup,join)
+    aiqum_profile_report(args)
+    if failed:
+        print("%i chunks failed, rerun with --resume to finish them." % failed,
+              file=sys.stderr)
+        sys.exit(1)
@@ -18,30 +18,48 @@
 ################################################################################
 
 import mysql.connector
+import aiqum_common
+from aiqum_common import aiqum_report_writer, aiqum_fetch_batches
+from aiqum_common import aiqum_add_batch_args, aiqum_in_list
+from aiqum_common import aiqum_db_connect
+from aiqum_common import aiqum_add_connection_args, aiqum_connection_options
+from aiqum_common import aiqum_add_profile_args, aiqum_profile_start
+from aiqum_common import aiqum_profile_connection, aiqum_profile_report
+from aiqum_common import aiqum_phase
+from aiqum_common import aiqum_add_fleet_args, aiqum_fleet_hosts
+from aiqum_common import aiqum_fleet_report
+from aiqum_common import aiqum_add_delta_args, aiqum_delta_report
+from aiqum_common import aiqum_add_output_args, aiqum_check_output_args
 import sys
-import datetime
 from argparse import ArgumentParser
 from getpass import getpass
 
-# Connection setup for AIQUM.
-def aiqum_db_connect(aiq_host,aiq_user,aiq_password):
-    try:
-        cnx = mysql.connector.connect(host=aiq_host,
-                                      user=aiq_user,
-                                      password=aiq_password,
-                                      database='netapp_model_view'
-                                     )
-    except:
-        print()
-        print("Error connecting to AIQUM Database. Exiting.")
-        print()
-        raise
+# Report columns.
+VOLUME_COLUMNS = [("Cluster","name"),("Vserver","name"),("Volume","name"),
+                  ("JunctionPath","str"),("ExportPolicyName","name"),
+                  ("VolSize(GB)","gb"),("VolDataSize(GB)","gb"),
+                  ("VolUsed(GB)","gb"),("CloudTierUsed(GB)","gb0"),
+                  ("SecurityStyle","name"),("VolType","name"),
+                  ("VolStyle","name"),("SnapshotPolicy","name"),
+                  ("SnapshotCount","int"),
+                  ("SnapshotReserveSize(GB)","gb"),
+                  ("SnapshotUsed(GB)","gb"),
+                  ("UserID","str"),("GroupID","str"),
+                  ("Permissions","str"),("InodesTotal","int"),
+                  ("InodesUsed","int"),("QuotaStatus","name"),
+                  ("Aggregqate","name"),("AggregateType","name"),
+                  ("TieringPolicy","name"),
+                  ("TieringMinCoolingDays","int"),
+                  ("CompressionSaved(GB)","gb0"),
+                  ("DeduplicationSaved(GB)","gb0"),
+                ("LastUpdated","ms")]
 
-    return cnx
-
-# Query AIQUM for volume data and print in CSV format.
-def aiqum_volumes(cnx):
-    cursor = cnx.cursor()
+# Query AIQUM for volume data and yield it in batches of rows.  Rows with a
+# missing data size are logged to stderr and skipped.
+# With clusterids (for --since-state), only those clusters are queried and
+# each row ends with the volume and cluster objids.
+def aiqum_volume_batches(cnx,clusterids=None):
+    cursor = cnx.cursor(buffered=False)
     query = ("SELECT cluster.name,vserver.name,vol.name,vol.junctionPath,"
              "export_policy.name,vol.size,vol.sizeTotal,vol.sizeUsed,vol.cloudTierFootprintBytes,"
              "vol.securityStyle,vol.volType,vol.styleExtended,"
@@ -52,6 +70,10 @@ def aiqum_volumes(cnx):
              "vol.tieringPolicy,vol.tieringMinimumCoolingDays,"
              "vol.compressionSpaceSaved,vol.deduplicationSpaceSaved,"
              "cluster.lastUpdateTime "
+            )
+    if clusterids:
+        query = query + ",vol.objid,cluster.objid "
+    query = (query +
              "FROM volume AS vol "
              "INNER JOIN cluster ON vol.clusterId = cluster.objid "
              "INNER JOIN vserver ON vol.vserverId = vserver.objid "
@@ -60,67 +82,26 @@ def aiqum_volumes(cnx):
              "INNER JOIN snapshot_policy ON vol.snapshotPolicyId = snapshot_policy.objid "
              "WHERE (vol.volType='RW' or vol.volType='DP')"
             )
-    cursor.execute(query)
+    if clusterids:
+        query = (query + " AND vol.clusterId IN " +
+                 aiqum_in_list(clusterids))
+    cursor.execute(query, clusterids)
 
-    print("Cluster,Vserver,Volume,JunctionPath,"
-          "ExportPolicyName,VolSize(GB),VolDataSize(GB),VolUsed(GB),CloudTierUsed(GB),"
-          "SecurityStyle,VolType,VolStyle,"
-          "SnapshotPolicy,SnapshotCount,SnapshotReserveSize(GB),SnapshotUsed(GB),"
-          "UserID,GroupID,Permissions,"
-          "InodesTotal,InodesUsed,QuotaStatus,"
-          "Aggregqate,AggregateType,"
-          "TieringPolicy,TieringMinCoolingDays,"
-          "CompressionSaved(GB),DeduplicationSaved(GB),"
-          "LastUpdated")
-    for row in cursor:
-        # Skip this row and log an error if we are missing values.
-        if (row[6] is None):
-            print("Missing value in row:", file=sys.stderr)
-            print(row, file=sys.stderr)
-            print("Continuing.", file=sys.stderr)
-            continue
-        VolSizeGB     = "%.1f" % (row[5]  / (1024*1024*1024))
-        VolDataSizeGB = "%.1f" % (row[6]  / (1024*1024*1024))
-        VolUsedGB     = "%.1f" % (row[7]  / (1024*1024*1024))
-        if row[8]:
-            CloudUsedGB = "%.1f" % (row[8]  / (1024*1024*1024))
-        else:
-            CloudUsedGB = 0
-        SsResGB     = "%.1f" % (row[14] / (1024*1024*1024))
-        SsUsedGB    = "%.1f" % (row[15] / (1024*1024*1024))
-        if row[26]:
-            CompGB = "%.1f" % (row[26] / (1024*1024*1024))
-        else:
-            CompGB = 0
-        if row[27]:
-            DedupGB = "%.1f" % (row[27] / (1024*1024*1024))
-        else:
-            DedupGB = 0
-        epochtime   = "%i" % (row[28] / 1000)
-        lastupdated = datetime.datetime.fromtimestamp(int(epochtime))
-        print("%s,%s,%s,%s,%s,"
-              "%s,%s,%s,%s,"
-              "%s,%s,%s,"
-              "%s,%s,%s,%s,"
-              "%s,%s,%s,"
-              "%s,%s,%s,"
-              "%s,%s,"
-              "%s,%s,"
-              "%s,%s,"
-              "%s"
-              %
-              (row[0],row[1],row[2],row[3],
-               row[4],VolSizeGB,VolDataSizeGB,VolUsedGB,CloudUsedGB,
-               row[9],row[10],row[11],
-               row[12],row[13],SsResGB,SsUsedGB,
-               row[16],row[17],row[18],
-               row[19],row[20],row[21],
-               row[22],row[23],
-               row[24],row[25],
-	       CompGB,DedupGB,
-               lastupdated
-              )
-             )
+    for rows in aiqum_fetch_batches(cursor):
+        # Skip rows and log an error where we are missing values.
+        for row in rows:
+            if (row[6] is None):
+                print("Missing value in row:", file=sys.stderr)
+                print(row, file=sys.stderr)
+                print("Continuing.", file=sys.stderr)
+        yield [row for row in rows if row[6] is not None]
+
+# Query AIQUM for volume data and write it in the requested format.
+def aiqum_volumes(cnx,fmt="csv",output=None):
+    writer = aiqum_report_writer(VOLUME_COLUMNS,fmt,output)
+    for rows in aiqum_volume_batches(cnx):
+        writer.write_batch(rows)
+    writer.close()
 
     return 1
 
@@ -128,23 +109,55 @@ def aiqum_volumes(cnx):
 # MAIN
 # -----------------------------------------------------------------------------
 
-# Parse the command line
-parser = ArgumentParser(
-    usage="%(prog)s [options]",
-    description="Sample code to pull volume details from the AIQUM Datbase."
-)
-parser.add_argument(
-    '-a', '--aiqumhost', nargs='?', required=True, help='AIQUM Host'
-)
-parser.add_argument(
-    '-u', '--username', nargs='?', required=True, help='AIQUM Username'
-)
-parser.add_argument(
-    '-p', '--password', nargs='?', help='Password for AIQUM username'
-)
-args = parser.parse_args()
-if not args.password: args.password = getpass()
+if __name__ == "__main__":
+    # Parse the command line
+    parser = ArgumentParser(
+        usage="%(prog)s [options]",
+        description="Sample code to pull volume details from the AIQUM Datbase."
+    )
+    parser.add_argument(
+        '-a', '--aiqumhost', nargs='?',
+        help='AIQUM Host, or a CSV list of hosts to report on together'
+    )
+    parser.add_argument(
+        '-u', '--username', nargs='?', required=True, help='AIQUM Username'
+    )
+    parser.add_argument(
+        '-p', '--password', nargs='?', help='Password for AIQUM username'
+    )
+    aiqum_add_output_args(parser)
+    aiqum_add_batch_args(parser)
+    aiqum_add_connection_args(parser)
+    aiqum_add_profile_args(parser)
+    aiqum_add_fleet_args(parser)
+    aiqum_add_delta_args(parser)
+    args = parser.parse_args()
+    aiqum_common.BATCH_SIZE = args.batch_size
+    aiqum_connection_options(args)
+    hosts = aiqum_fleet_hosts(parser,args)
+    if args.since_state and (len(hosts) > 1 or args.hosts_file):
+        parser.error("--since-state works with a single AIQUM host")
+    aiqum_check_output_args(parser,args)
+    if not args.password: args.password = getpass()
+    aiqum_profile_start(args)
 
-# Connect to AIQUM and print the volume details.
-cnx = aiqum_db_connect(args.aiqumhost,args.username,args.password)
-aiqum_volumes(cnx)
+    # With several hosts, query them all at once and merge the volume details.
+    # Otherwise connect to AIQUM and write the volume details.
+    if len(hosts) > 1 or args.hosts_file:
+        failed = aiqum_fleet_report(hosts,args.username,args.password,
+                                    aiqum_volume_batches,VOLUME_COLUMNS,
+                                    args.format,args.output,
+                                    args.host_timeout)
+    else:
+        with aiqum_phase('connect'):
+            cnx = aiqum_db_connect(hosts[0],args.username,args.password)
+        cnx = aiqum_profile_connection(cnx)
+        if args.since_state:
+            aiqum_delta_report(cnx,aiqum_volume_batches,VOLUME_COLUMNS,
+                               args.since_state,args.format,args.output)
+        else:
+            aiqum_volumes(cnx,args.format,args.output)
+        failed = []
+    aiqum_profile_report(args)
+    if failed:
+        sys.exit(1)
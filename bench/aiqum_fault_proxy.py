@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+################################################################################
+#
+# TCP proxy that injects connection faults between a script and a MySQL
+# server, to exercise the retry path in aiqum_common (ResilientCursor,
+# ResilientPool and aiqum_db_connect).  Point a script's -a at the proxy's
+# address as HOST:PORT.  Per client connection the proxy can:
+#   --refuse P     close it at once (the connect fails) with probability P
+#   --drop P       cut it with probability P, after a random number of bytes
+#                  (up to --drop-after) have been sent to the client
+#   --delay MS     hold every chunk of data for MS milliseconds
+# Each fault is logged on stderr.  --seed makes a run repeatable.
+#
+# Usage: bench/aiqum_fault_proxy.py --target HOST[:PORT] [--port 13306]
+#                                   [--refuse P] [--drop P]
+#                                   [--drop-after BYTES] [--delay MS]
+#
+#   e.g. bench/aiqum_fault_proxy.py --target AIQUMHOST --refuse 0.3 --drop 0.2
+#        aiqum_aggr_report.py -a 127.0.0.1:13306 -u USERNAME --retries 6
+#
+################################################################################
+
+import sys
+import time
+import random
+import socket
+import threading
+from argparse import ArgumentParser
+
+# Bytes read from a socket at a time.
+CHUNK = 65536
+
+# Copy data from src to dst until either side closes.  With a byte limit the
+# connection is cut once that many bytes have been copied.
+def pump(src, dst, delay, limit, name):
+    copied = 0
+    try:
+        while True:
+            data = src.recv(CHUNK)
+            if not data:
+                break
+            if delay:
+                time.sleep(delay)
+            if limit is not None and copied + len(data) >= limit:
+                dst.sendall(data[:max(0, limit - copied)])
+                print("%s: dropped after %i bytes" % (name, limit),
+                      file=sys.stderr)
+                break
+            dst.sendall(data)
+            copied += len(data)
+    except OSError:
+        pass
+    finally:
+        for sock in (src, dst):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+# Handle one client connection: refuse it, or connect to the target and copy
+# both ways, possibly cutting the server to client direction early.
+def handle(client, address, args, rand):
+    name = "%s:%i" % address
+    if rand.random() < args.refuse:
+        print("%s: refused" % name, file=sys.stderr)
+        client.close()
+        return
+    try:
+        server = socket.create_connection(args.target)
+    except OSError as error:
+        print("%s: target unreachable: %s" % (name, error), file=sys.stderr)
+        client.close()
+        return
+    limit = None
+    if rand.random() < args.drop:
+        limit = rand.randint(0, args.drop_after)
+    delay = args.delay / 1000.0
+    upstream = threading.Thread(target=pump,
+                                args=(client, server, delay, None, name),
+                                daemon=True)
+    upstream.start()
+    pump(server, client, delay, limit, name)
+    upstream.join()
+    client.close()
+    server.close()
+
+def main():
+    parser = ArgumentParser(description="Fault-injecting TCP proxy for testing the connection retries.")
+    parser.add_argument('--target', required=True,
+                        help='MySQL server to forward to, HOST[:PORT]')
+    parser.add_argument('--listen', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=13306)
+    parser.add_argument('--refuse', type=float, default=0.0, metavar='P',
+                        help='Probability of refusing a connection')
+    parser.add_argument('--drop', type=float, default=0.0, metavar='P',
+                        help='Probability of cutting a connection early')
+    parser.add_argument('--drop-after', type=int, default=1000000,
+                        metavar='BYTES',
+                        help='Cut within this many bytes sent to the client')
+    parser.add_argument('--delay', type=float, default=0.0, metavar='MS',
+                        help='Latency added to every chunk')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+    host, _, port = args.target.partition(":")
+    args.target = (host, int(port or 3306))
+    rand = random.Random(args.seed)
+
+    listener = socket.create_server((args.listen, args.port))
+    print("Forwarding %s:%i to %s:%i" % ((args.listen, args.port) + args.target),
+          file=sys.stderr)
+    try:
+        while True:
+            client, address = listener.accept()
+            threading.Thread(target=handle,
+                             args=(client, address, args, rand),
+                             daemon=True).start()
+    except KeyboardInterrupt:
+        pass
+    listener.close()
+
+if __name__ == "__main__":
+    main()
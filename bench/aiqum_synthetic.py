@@ -0,0 +1,296 @@
+################################################################################
+#
+# Synthetic stand-in for the AIQUM netapp_model_view and netapp_performance
+# schemas, for benchmarking the report functions without a production AIQUM.
+#
+# Only the tables and columns that the reports use are created: cluster,
+# node, aggregate, aggregate_objectstore_config_mapping, vserver,
+# export_policy, export_rule, snapshot_policy, volume, qtree, user_quota,
+# quota_user, snap_mirror, qos_workload and summary_qos_volume_workload_<id>.
+#
+# Two backends are supported:
+#   sqlite - two database files in a directory; connect() returns a small
+#            wrapper that looks enough like a mysql.connector connection for
+#            the reports (the netapp_performance file is attached under that
+#            name, %s parameters are translated and SET statements ignored).
+#   mysql  - a local MySQL/MariaDB server, into netapp_model_view and
+#            netapp_performance databases.  Never point this at a real AIQUM
+#            server: the tables are dropped and recreated.
+#
+################################################################################
+
+import os
+import random
+import sqlite3
+import time
+import mysql.connector as mysql_connector
+
+GB = 1024 * 1024 * 1024
+
+# Model tables and their columns.  The types are accepted by MySQL and SQLite.
+MODEL_TABLES = {
+    'cluster': "objid BIGINT PRIMARY KEY, name VARCHAR(255), "
+               "lastUpdateTime BIGINT",
+    'node': "objid BIGINT PRIMARY KEY, name VARCHAR(255), model VARCHAR(255), "
+            "clusterId BIGINT",
+    'aggregate': "objid BIGINT PRIMARY KEY, name VARCHAR(255), "
+                 "clusterId BIGINT, nodeId BIGINT, sizeUsedPercent DOUBLE, "
+                 "sizeTotal BIGINT, sizeUsed BIGINT, "
+                 "aggregateType VARCHAR(255)",
+    'aggregate_objectstore_config_mapping': "aggregateid BIGINT, "
+                                            "usedSpace BIGINT",
+    'vserver': "objid BIGINT PRIMARY KEY, name VARCHAR(255), clusterId BIGINT",
+    'export_policy': "objid BIGINT PRIMARY KEY, name VARCHAR(255), "
+                     "clusterId BIGINT, vserverId BIGINT",
+    'export_rule': "objid BIGINT PRIMARY KEY, clusterId BIGINT, "
+                   "vserverId BIGINT, exportPolicyId BIGINT, "
+                   "clientMatch VARCHAR(255), roRule VARCHAR(255), "
+                   "rwRule VARCHAR(255), superUserSecurity VARCHAR(255)",
+    'snapshot_policy': "objid BIGINT PRIMARY KEY, name VARCHAR(255)",
+    'volume': "objid BIGINT PRIMARY KEY, name VARCHAR(255), clusterId BIGINT, "
+              "vserverId BIGINT, aggregateId BIGINT, exportPolicyId BIGINT, "
+              "snapshotPolicyId BIGINT, junctionPath VARCHAR(255), "
+              "size BIGINT, sizeTotal BIGINT, sizeUsed BIGINT, "
+              "cloudTierFootprintBytes BIGINT, securityStyle VARCHAR(255), "
+              "volType VARCHAR(255), styleExtended VARCHAR(255), "
+              "snapshotCount BIGINT, snapshotReserveSize BIGINT, "
+              "sizeUsedBySnapshots BIGINT, securityUserID VARCHAR(255), "
+              "securityGroupID VARCHAR(255), "
+              "securityPermissions VARCHAR(255), inodeFilesTotal BIGINT, "
+              "inodeFilesUsed BIGINT, quotaStatus VARCHAR(255), "
+              "tieringPolicy VARCHAR(255), tieringMinimumCoolingDays BIGINT, "
+              "compressionSpaceSaved BIGINT, deduplicationSpaceSaved BIGINT",
+    'qtree': "objid BIGINT PRIMARY KEY, name VARCHAR(255), volumeId BIGINT",
+    'user_quota': "objid BIGINT PRIMARY KEY, clusterId BIGINT, "
+                  "vserverId BIGINT, volumeId BIGINT, qtreeId BIGINT, "
+                  "quotaTarget VARCHAR(255), diskLimit BIGINT, "
+                  "diskUsed BIGINT, fileUsed BIGINT",
+    'quota_user': "objid BIGINT PRIMARY KEY, userQuotaID BIGINT, "
+                  "quotaUserID VARCHAR(255), quotaUserName VARCHAR(255)",
+    'snap_mirror': "objid BIGINT PRIMARY KEY, sourceVserver VARCHAR(255), "
+                   "sourceVolume VARCHAR(255), destinationClusterId BIGINT, "
+                   "destinationVserverId BIGINT, destinationVolumeId BIGINT, "
+                   "mirrorState VARCHAR(255), relationshipType VARCHAR(255), "
+                   "lagTime BIGINT",
+    'qos_workload': "objid BIGINT PRIMARY KEY, holderId BIGINT, "
+                    "clusterId BIGINT",
+}
+
+SUMMARY_TABLE = ("objid BIGINT, fromtime BIGINT, ops DOUBLE, totalData DOUBLE, "
+                 "PRIMARY KEY (objid, fromtime)")
+
+# Stand-in for a mysql.connector cursor on SQLite.
+class StandinCursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, query, params=None):
+        if query.startswith("SET "):
+            return
+        self.cursor.execute(query.replace("%s", "?"), params or ())
+
+    def executemany(self, query, rows):
+        self.cursor.executemany(query.replace("%s", "?"), rows)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchmany(self, size=1):
+        return self.cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def close(self):
+        self.cursor.close()
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+# Stand-in for a mysql.connector connection on SQLite.  The default database
+# is netapp_model_view, which is also attached under its name so that queries
+# naming both databases work, and netapp_performance is attached under its name.
+class StandinConnection:
+    def __init__(self, path):
+        self.path = path
+        self.cnx = sqlite3.connect(
+                       os.path.join(path, "netapp_model_view.db"),
+                       check_same_thread=False)
+        self.cnx.execute("ATTACH DATABASE ? AS netapp_model_view",
+                         (os.path.join(path, "netapp_model_view.db"),))
+        self.cnx.execute("ATTACH DATABASE ? AS netapp_performance",
+                         (os.path.join(path, "netapp_performance.db"),))
+
+    def cursor(self, **kwargs):
+        return StandinCursor(self.cnx.cursor())
+
+    def start_transaction(self, **kwargs):
+        pass
+
+    def commit(self):
+        self.cnx.commit()
+
+    def rollback(self):
+        self.cnx.rollback()
+
+    def close(self):
+        self.cnx.close()
+
+# Stand-in for a mysql.connector connection pool on SQLite.
+class StandinPool:
+    def __init__(self, path):
+        self.path = path
+
+    def get_connection(self):
+        return StandinConnection(self.path)
+
+# Return a connection to the synthetic schema: the SQLite stand-in in path,
+# or a mysql.connector connection when mysql_args is a dict of connect()
+# arguments.
+def connect(path=None, mysql_args=None):
+    if mysql_args:
+        return mysql_connector.connect(database="netapp_model_view",
+                                       **mysql_args)
+    return StandinConnection(path)
+
+# Build the synthetic schema.  The shape of the estate:
+#   clusters, each with one node and two aggregates;
+#   vservers per cluster, each with an export policy of three rules;
+#   volumes per vserver, each with a QoS workload, a qtree and two user
+#   quotas, and days of perf samples every interval seconds;
+#   one SnapMirror destination and one non-volume QoS workload per vserver.
+# A few values are left NULL the way AIQUM does (no aggregate, no data size,
+# no cloud tier).
+def build(path=None, mysql_args=None, clusters=4, vservers=5, volumes=50,
+          days=1, interval=300, seed=1):
+    rnd = random.Random(seed)
+    if mysql_args:
+        cnx = mysql_connector.connect(**mysql_args)
+        cursor = cnx.cursor()
+        for db in ("netapp_model_view", "netapp_performance"):
+            cursor.execute("CREATE DATABASE IF NOT EXISTS " + db)
+        cursor.execute("USE netapp_model_view")
+    else:
+        os.makedirs(path, exist_ok=True)
+        for db in ("netapp_model_view", "netapp_performance"):
+            if os.path.exists(os.path.join(path, db + ".db")):
+                os.remove(os.path.join(path, db + ".db"))
+        cnx = StandinConnection(path)
+        cursor = cnx.cursor()
+
+    def create(table, columns):
+        cursor.execute("DROP TABLE IF EXISTS " + table)
+        cursor.execute("CREATE TABLE " + table + " (" + columns + ")")
+
+    def insert(table, rows):
+        if rows:
+            cursor.executemany("INSERT INTO " + table + " VALUES (" +
+                               ",".join(["%s"] * len(rows[0])) + ")", rows)
+
+    for table, columns in MODEL_TABLES.items():
+        create(table, columns)
+
+    now = int(time.time()) // interval * interval
+    samples = days * 86400 // interval
+    insert("snapshot_policy", [(1, "default")])
+    volid = 0
+    qosid = 0
+    ruleid = 0
+    quotaid = 0
+    for clusterid in range(1, clusters + 1):
+        rows = {table: [] for table in MODEL_TABLES}
+        perf = []
+        clustername = "cluster%03i" % clusterid
+        rows['cluster'].append((clusterid, clustername,
+                                (now - clusterid * 60) * 1000))
+        nodeid = clusterid * 10
+        rows['node'].append((nodeid, clustername + "-01", "AFF-A400",
+                             clusterid))
+        for x in range(2):
+            aggrid = clusterid * 100 + x
+            rows['aggregate'].append((aggrid, "aggr%i_%s" % (x, clustername),
+                                      clusterid, nodeid,
+                                      rnd.randint(100, 990) / 10.0,
+                                      100 * GB, rnd.randint(0, 100 * GB),
+                                      "SSD"))
+            if x == 0:
+                rows['aggregate_objectstore_config_mapping'].append(
+                    (aggrid, rnd.randint(0, 10 * GB)))
+        for s in range(vservers):
+            vserverid = clusterid * 10000 + s
+            vservername = "svm%i_%s" % (s, clustername)
+            rows['vserver'].append((vserverid, vservername, clusterid))
+            policyid = vserverid * 10
+            rows['export_policy'].append((policyid, "default", clusterid,
+                                          vserverid))
+            for r in range(3):
+                ruleid += 1
+                clients = "10.%i.%i.0/24" % (s % 256, r)
+                if r == 2:
+                    clients = clients + ",admin%i" % s
+                rows['export_rule'].append((ruleid, clusterid, vserverid,
+                                            policyid, clients, "sys", "sys",
+                                            "none"))
+            for v in range(volumes):
+                volid += 1
+                aggrid = clusterid * 100 + v % 2
+                if v % 17 == 16:
+                    aggrid = None
+                sizetotal = 9 * GB + rnd.randint(0, GB)
+                if v % 23 == 22:
+                    sizetotal = None
+                rows['volume'].append(
+                    (volid, "vol%05i" % v, clusterid, vserverid, aggrid,
+                     policyid, 1, "/vol%05i" % v, 10 * GB, sizetotal,
+                     rnd.randint(0, 9 * GB),
+                     rnd.randint(0, GB) if v % 3 == 0 else None,
+                     "unix", "DP" if v % 5 == 4 else "RW", "flexvol", 5, GB,
+                     rnd.randint(0, GB), "0", "0", "755", 1000000,
+                     rnd.randint(0, 100000), "on", "auto", 31,
+                     rnd.randint(0, GB) if v % 2 else None,
+                     rnd.randint(0, GB)))
+                qosid += 1
+                rows['qos_workload'].append((qosid, volid, clusterid))
+                for t in range(samples):
+                    perf.append((qosid, (now - t * interval) * 1000,
+                                 rnd.randint(0, 50000) / 10.0,
+                                 float(rnd.randint(0, 10 ** 9))))
+                qtreeid = volid * 10
+                rows['qtree'].append((qtreeid, "", volid))
+                for u in range(2):
+                    quotaid += 1
+                    target = "user%i" % u
+                    if u:
+                        target = target + ",alias%i" % u
+                    rows['user_quota'].append(
+                        (quotaid, clusterid, vserverid, volid, qtreeid, target,
+                         10 * 1024 * 1024, rnd.randint(0, 10 * 1024 * 1024),
+                         rnd.randint(0, 100000)))
+                    rows['quota_user'].append((quotaid, quotaid,
+                                               str(1000 + u), "user%i" % u))
+                if v == 0:
+                    rows['snap_mirror'].append(
+                        (volid, "src_" + vservername, "srcvol%05i" % v,
+                         clusterid, vserverid, volid, "snapmirrored",
+                         "EXTENDED_DATA_PROTECTION",
+                         rnd.choice([None, 600, 3600, 270000])))
+            qosid += 1
+            rows['qos_workload'].append((qosid, 0, clusterid))
+            perf.append((qosid, now * 1000, 1.0, 1.0))
+        for table in MODEL_TABLES:
+            insert(table, rows[table])
+
+        summary = ("netapp_performance.summary_qos_volume_workload_" +
+                   str(clusterid))
+        create(summary, SUMMARY_TABLE)
+        if mysql_args:
+            cursor.execute("CREATE INDEX fromtime ON " + summary +
+                           " (fromtime)")
+        else:
+            cursor.execute("CREATE INDEX netapp_performance.fromtime_" +
+                           str(clusterid) + " ON summary_qos_volume_workload_" +
+                           str(clusterid) + " (fromtime)")
+        insert(summary, perf)
+        cnx.commit()
+
+    cnx.close()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+################################################################################
+#
+# Query overhead of the perf report's mapping queries for a large cluster
+# list, comparing:
+#   or-chain - the previous WHERE name='..' OR name='..' and
+#              WHERE clusterid='..' OR ... clauses, built as text
+#   in-list  - the parameterized IN (%s,...) clauses used now
+#
+# Each variant runs the cluster, vserver, volume and qos_workload queries on
+# one connection, --repeat times, and the time per run is split into building
+# the SQL text and executing and fetching it.  The OR chains grow with the
+# cluster list, and so does the time to parse and plan them.
+#
+# Usage: bench/bench_query_params.py [--clusters N] [--repeat N]
+#                                    [--mysql HOST -u USER -p PASSWORD]
+#
+################################################################################
+
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import aiqum_synthetic
+from aiqum_common import aiqum_in_list
+
+# The previous clauses, built as text.
+def or_chain_queries(names, clusterids):
+    querytxt = "SELECT objid,name,lastUpdateTime FROM cluster "
+    x = 0
+    for clustername in names:
+        if x == 0:
+            querytxt = querytxt + "WHERE name='" + clustername + "' "
+        else:
+            querytxt = querytxt + "OR name='" + clustername + "' "
+        x = x + 1
+    x = 0
+    whereclause = ""
+    for clusterid in clusterids:
+        if x == 0:
+            whereclause = whereclause + "WHERE clusterid='" + str(clusterid) + "' "
+        else:
+            whereclause = whereclause + "OR clusterid='" + str(clusterid) + "' "
+        x = x + 1
+    return [(querytxt, None),
+            ("SELECT objid,name FROM vserver " + whereclause, None),
+            ("SELECT objid,name,clusterid,vserverid FROM volume " + whereclause,
+             None),
+            ("SELECT objid,holderid FROM qos_workload " + whereclause, None)]
+
+# The parameterized clauses.
+def in_list_queries(names, clusterids):
+    whereclause = "WHERE clusterid IN " + aiqum_in_list(clusterids)
+    return [("SELECT objid,name,lastUpdateTime FROM cluster "
+             "WHERE name IN " + aiqum_in_list(names), names),
+            ("SELECT objid,name FROM vserver " + whereclause, clusterids),
+            ("SELECT objid,name,clusterid,vserverid FROM volume " + whereclause,
+             clusterids),
+            ("SELECT objid,holderid FROM qos_workload " + whereclause,
+             clusterids)]
+
+# Run a variant repeat times and return (rows per run, build seconds per run,
+# execute and fetch seconds per run).
+def run(cnx, build, names, clusterids, repeat):
+    cursor = cnx.cursor()
+    buildtime = 0.0
+    querytime = 0.0
+    rows = 0
+    for x in range(repeat):
+        start = time.perf_counter()
+        queries = build(names, clusterids)
+        buildtime += time.perf_counter() - start
+        start = time.perf_counter()
+        rows = 0
+        for query, params in queries:
+            cursor.execute(query, params)
+            rows += len(cursor.fetchall())
+        querytime += time.perf_counter() - start
+    cursor.close()
+    return rows, buildtime / repeat, querytime / repeat
+
+def main():
+    parser = ArgumentParser(description="Mapping query overhead, OR chains against IN lists.")
+    parser.add_argument('--clusters', type=int, default=500)
+    parser.add_argument('--vservers', type=int, default=2,
+                        help='Vservers per cluster')
+    parser.add_argument('--volumes', type=int, default=10,
+                        help='Volumes per vserver')
+    parser.add_argument('-n', '--repeat', type=int, default=20)
+    parser.add_argument('--dir', default=os.path.join(
+                            os.path.dirname(os.path.abspath(__file__)), "data"),
+                        help='Directory for the SQLite files')
+    parser.add_argument('--mysql', help='Build in this MySQL/MariaDB host instead')
+    parser.add_argument('-u', '--username', default="root")
+    parser.add_argument('-p', '--password', default="")
+    args = parser.parse_args()
+    mysql = None
+    if args.mysql:
+        mysql = {'host': args.mysql, 'user': args.username,
+                 'password': args.password}
+
+    aiqum_synthetic.build(args.dir,mysql,args.clusters,args.vservers,
+                          args.volumes,days=0)
+    cnx = aiqum_synthetic.connect(args.dir,mysql)
+    names = ["cluster%03i" % x for x in range(1, args.clusters + 1)]
+    clusterids = list(range(1, args.clusters + 1))
+
+    variants = [("or-chain", or_chain_queries),
+                ("in-list", in_list_queries)]
+    print("%i clusters, %i runs" % (args.clusters, args.repeat))
+    print("%-10s %9s %12s %14s" % ("Variant","Rows","Build ms","Execute ms"))
+    for name, build in variants:
+        try:
+            rows, buildtime, querytime = run(cnx,build,names,clusterids,
+                                             args.repeat)
+        except Exception as error:
+            # e.g. SQLite's expression depth limit on long OR chains.
+            print("%-10s failed: %s" % (name,error))
+            continue
+        print("%-10s %9i %12.2f %14.2f"
+              % (name,rows,buildtime * 1000,querytime * 1000))
+    cnx.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+################################################################################
+#
+# Time each report function against a synthetic AIQUM schema (see
+# aiqum_synthetic.py), and print per report: output rows, wall time, rows/sec,
+# the time spent in the database (execute and fetch), the time spent
+# formatting and writing (the rest), and the peak Python heap.
+#
+# By default the schema is built in SQLite files under bench/data; with
+# --mysql it is built in a local MySQL/MariaDB server instead.  Never point
+# --mysql at a real AIQUM server: the tables are dropped and recreated.
+#
+# The peak heap is measured with tracemalloc in a separate run of each report
+# (tracemalloc slows Python down), and does not include memory held by the
+# database driver's C code.  With -w above 1 the perf reports' database time
+# is summed over the workers, so no formatting time is shown for them.
+#
+# Usage: bench/bench_reports.py [--clusters N] [--vservers N] [--volumes N]
+#                               [--days N] [-r REPORT ...] [-n REPEAT]
+#                               [--mysql HOST -u USER -p PASSWORD]
+#
+################################################################################
+
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+import contextlib
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import aiqum_common
+import aiqum_synthetic
+import aiqum_aggr_report
+import aiqum_volume_report
+import aiqum_exports_report
+import aiqum_snapmirror_report
+import aiqum_user_quota_report
+import aiqum_volume_perf_report as perf
+
+# Database time per run: query execution and row fetching.
+class Timer:
+    def __init__(self):
+        self.seconds = 0.0
+
+# Cursor wrapper that adds the time spent in execute and fetch to a Timer.
+class TimedCursor:
+    def __init__(self, cursor, timer):
+        self.cursor = cursor
+        self.timer = timer
+
+    def timed(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self.timer.seconds += time.perf_counter() - start
+
+    def execute(self, *args):
+        return self.timed(self.cursor.execute, *args)
+
+    def fetchone(self):
+        return self.timed(self.cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self.timed(self.cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self.timed(self.cursor.fetchall)
+
+    def close(self):
+        self.cursor.close()
+
+    def __iter__(self):
+        rows = iter(self.cursor)
+        while True:
+            try:
+                row = self.timed(next, rows)
+            except StopIteration:
+                return
+            yield row
+
+# Connection wrapper that hands out TimedCursors.
+class TimedConnection:
+    def __init__(self, cnx, timer):
+        self.cnx = cnx
+        self.timer = timer
+
+    def cursor(self, **kwargs):
+        return TimedCursor(self.cnx.cursor(**kwargs), self.timer)
+
+    def __getattr__(self, name):
+        return getattr(self.cnx, name)
+
+# Pool wrapper that hands out TimedConnections.
+class TimedPool:
+    def __init__(self, pool, timer):
+        self.pool = pool
+        self.timer = timer
+
+    def get_connection(self):
+        return TimedConnection(self.pool.get_connection(), self.timer)
+
+# The perf report keeps its mappings in module globals, so start each run
+# from empty ones.
+def perf_reset():
+    perf.clustermap.clear()
+    perf.vservermap.clear()
+    perf.volmap = aiqum_common.VolumeMap()
+    perf.clusterstart.clear()
+    perf.clusterhwm.clear()
+    for key in perf.perfstats:
+        perf.perfstats[key] = 0
+
+def perf_report(cnx,output,args,rollup=None,pool=None):
+    perf_reset()
+    starttime = (int(time.time()) - args.days * 86400) * 1000
+    perf.aiqum_object_mappings(cnx,",".join("cluster%03i" % x for x in
+                                            range(1, args.clusters + 1)))
+    if args.workers > 1:
+        cnx = pool
+    perf.aiqum_volumes_perf(cnx,starttime,workers=args.workers,output=output,
+                            rollup=rollup)
+
+# The reports, by name: a function of (cnx, output, args, pool).
+REPORTS = {
+    'aggr': lambda cnx, output, args, pool:
+        aiqum_aggr_report.aiqum_aggregates(cnx,output=output),
+    'volume': lambda cnx, output, args, pool:
+        aiqum_volume_report.aiqum_volumes(cnx,output=output),
+    'exports': lambda cnx, output, args, pool:
+        aiqum_exports_report.aiqum_exports(cnx,output=output),
+    'snapmirror': lambda cnx, output, args, pool:
+        aiqum_snapmirror_report.aiqum_snapmirrors(cnx,output=output),
+    'quota': lambda cnx, output, args, pool:
+        aiqum_user_quota_report.aiqum_user_quotas(cnx,output=output),
+    'perf': lambda cnx, output, args, pool:
+        perf_report(cnx,output,args,pool=pool),
+    'perf-1h': lambda cnx, output, args, pool:
+        perf_report(cnx,output,args,'1h',pool),
+}
+
+# Run one report and return (rows, seconds, database seconds, peak bytes).
+# The report's own progress messages on stderr are discarded.
+def run(name,args,output,memory=False):
+    timer = Timer()
+    cnx = TimedConnection(aiqum_synthetic.connect(args.dir,args.mysql),timer)
+    pool = None
+    if args.workers > 1 and args.mysql:
+        pool = TimedPool(aiqum_common.aiqum_db_pool(
+                             args.mysql['host'],args.mysql['user'],
+                             args.mysql['password'],"netapp_model_view",
+                             args.workers,"bench"),timer)
+    elif args.workers > 1:
+        pool = TimedPool(aiqum_synthetic.StandinPool(args.dir),timer)
+    peak = 0
+    with open(os.devnull, "w") as devnull, \
+         contextlib.redirect_stderr(devnull):
+        if memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        REPORTS[name](cnx,output,args,pool)
+        seconds = time.perf_counter() - start
+        if memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    cnx.close()
+    with open(output) as f:
+        rows = sum(1 for line in f) - 1
+    return rows, seconds, timer.seconds, peak
+
+def main():
+    parser = ArgumentParser(description="Time the reports on a synthetic AIQUM schema.")
+    parser.add_argument('--clusters', type=int, default=4)
+    parser.add_argument('--vservers', type=int, default=5,
+                        help='Vservers per cluster')
+    parser.add_argument('--volumes', type=int, default=200,
+                        help='Volumes per vserver')
+    parser.add_argument('--days', type=int, default=1,
+                        help='Days of 5 minute perf samples')
+    parser.add_argument('-r', '--reports', nargs='+', choices=list(REPORTS),
+                        default=list(REPORTS))
+    parser.add_argument('-n', '--repeat', type=int, default=3,
+                        help='Runs per report, the fastest is shown')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Workers for the perf report')
+    parser.add_argument('-b', '--batch-size', type=int,
+                        default=aiqum_common.BATCH_SIZE)
+    parser.add_argument('--no-memory', action='store_true',
+                        help='Skip the tracemalloc run')
+    parser.add_argument('--no-build', action='store_true',
+                        help='Reuse the schema from a previous run')
+    parser.add_argument('--dir', default=os.path.join(
+                            os.path.dirname(os.path.abspath(__file__)), "data"),
+                        help='Directory for the SQLite files')
+    parser.add_argument('--mysql', help='Build in this MySQL/MariaDB host instead')
+    parser.add_argument('-u', '--username', default="root")
+    parser.add_argument('-p', '--password', default="")
+    args = parser.parse_args()
+    aiqum_common.BATCH_SIZE = args.batch_size
+    if args.mysql:
+        args.mysql = {'host': args.mysql, 'user': args.username,
+                      'password': args.password}
+
+    if not args.no_build:
+        start = time.perf_counter()
+        aiqum_synthetic.build(args.dir,args.mysql,args.clusters,args.vservers,
+                              args.volumes,args.days)
+        print("Built %i clusters, %i volumes, %i perf samples in %.1fs"
+              % (args.clusters,args.clusters * args.vservers * args.volumes,
+                 args.clusters * args.vservers * args.volumes *
+                 args.days * 288,time.perf_counter() - start))
+
+    print("%-11s %9s %8s %11s %8s %8s %9s" % ("Report","Rows","Secs",
+          "Rows/sec","DB secs","Fmt secs","Peak MB"))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name in args.reports:
+            output = os.path.join(tmpdir, name + ".csv")
+            rows, seconds, dbseconds, peak = min(
+                (run(name,args,output) for x in range(args.repeat)),
+                key=lambda result: result[1])
+            if not args.no_memory:
+                peak = run(name,args,output,memory=True)[3]
+            fmtseconds = "%.2f" % (seconds - dbseconds)
+            if args.workers > 1 and name.startswith("perf"):
+                fmtseconds = "-"
+            print("%-11s %9i %8.2f %11.0f %8.2f %8s %9s"
+                  % (name,rows,seconds,rows / seconds,dbseconds,fmtseconds,
+                     "-" if args.no_memory else "%.1f" % (peak / 1048576)))
+
+if __name__ == "__main__":
+    main()
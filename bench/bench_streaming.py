@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+################################################################################
+#
+# Peak RSS against row count for a report's fetch and output path.
+#
+# With --mysql, the rows come from a MySQL/MariaDB server and are read
+# through aiqum_common.aiqum_fetch_batches() from a mysql.connector cursor,
+# comparing a buffered cursor (the whole result is read into the client
+# before the first batch, as the reports did) with an unbuffered one (as the
+# reports now use).  This is the measurement that shows whether memory stays
+# flat against AIQUM.
+#
+# Without --mysql, the rows come from an in-memory SQLite query and the run
+# compares fetchall() with fetchmany() batches.  sqlite3 has no buffered
+# cursors, so this only measures the report writer path: holding the rows
+# in a list against writing them batch by batch.
+#
+# The rows are shaped like the perf report's output rows and are written
+# through aiqum_common.ReportWriter to /dev/null.  Each measurement runs in
+# its own process so that ru_maxrss is the peak of that run alone.
+#
+# Usage: bench/bench_streaming.py [-r ROWS [ROWS ...]] [-b BATCH_SIZE]
+#                                 [--mysql HOST -u USER -p PASSWORD]
+#
+################################################################################
+
+import os
+import sys
+import sqlite3
+import resource
+import subprocess
+from argparse import ArgumentParser, SUPPRESS
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import mysql.connector
+import aiqum_common
+from aiqum_common import ReportWriter, aiqum_fetch_batches
+
+COLUMNS = [("Cluster","name"),("Vserver","name"),("Volume","name"),
+           ("Timestamp","ms"),("IOPs","float"),
+           ("Throughput(bytes/sec)","float")]
+
+QUERY = ("WITH RECURSIVE n(x) AS "
+         "(SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < ?) "
+         "SELECT 'cluster' || (x % 40),'svm' || (x % 800),'vol' || (x % 20000),"
+         "1700000000000 + (x / 20000) * 300000,x % 5000 * 1.5,x * 1024.0 "
+         "FROM n")
+
+# Similar rows on MySQL/MariaDB, numbered by cross joining seven digit tables
+# (up to ten million rows), as their recursive CTE depth is limited.
+DIGITS = ("(SELECT 0 AS d UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL "
+          "SELECT 3 UNION ALL SELECT 4 UNION ALL SELECT 5 UNION ALL SELECT 6 "
+          "UNION ALL SELECT 7 UNION ALL SELECT 8 UNION ALL SELECT 9)")
+MYSQL_QUERY = ("SELECT CONCAT('cluster',x % 40),CONCAT('svm',x % 800),"
+               "CONCAT('vol',x % 20000),"
+               "1700000000000 + (x DIV 20000) * 300000,x % 5000 * 1.5,"
+               "x * 1024.0 FROM (SELECT 1 + d0.d + d1.d * 10 + d2.d * 100 + "
+               "d3.d * 1000 + d4.d * 10000 + d5.d * 100000 + "
+               "d6.d * 1000000 AS x FROM " +
+               ",".join("%s AS d%i" % (DIGITS, x) for x in range(7)) +
+               ") AS n LIMIT %s")
+
+# Write rows through the report writer and return this process's peak RSS.
+# mode is fetchall or fetchmany (SQLite), or buffered or unbuffered (MySQL,
+# with mysql_args a dict of connect() arguments).
+def run(mode,rows,batch_size,mysql_args=None):
+    aiqum_common.BATCH_SIZE = batch_size
+    if mysql_args:
+        cnx = mysql.connector.connect(**mysql_args)
+        cursor = cnx.cursor(buffered=(mode == "buffered"))
+        cursor.execute(MYSQL_QUERY, (rows,))
+    else:
+        cursor = sqlite3.connect(":memory:").cursor()
+        cursor.execute(QUERY, (rows,))
+    with open(os.devnull, "w", newline="") as devnull:
+        writer = ReportWriter(COLUMNS, stream=devnull)
+        if mode == "fetchall":
+            writer.write_rows(cursor.fetchall())
+        else:
+            for batch in aiqum_fetch_batches(cursor):
+                writer.write_batch(batch)
+        writer.close()
+    # ru_maxrss is in KB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def main():
+    parser = ArgumentParser(description="Peak RSS of buffered and streamed reports.")
+    parser.add_argument('-r', '--rows', type=int, nargs='+',
+                        default=[100000, 1000000, 3000000])
+    parser.add_argument('-b', '--batch-size', type=int,
+                        default=aiqum_common.BATCH_SIZE)
+    parser.add_argument('--mysql', help='Read the rows from this MySQL/MariaDB host')
+    parser.add_argument('-u', '--username', default="root")
+    parser.add_argument('-p', '--password', default="")
+    parser.add_argument('--child', nargs=2, help=SUPPRESS)
+    args = parser.parse_args()
+    mysql_args = None
+    if args.mysql:
+        mysql_args = {'host': args.mysql, 'user': args.username,
+                      'password': args.password}
+
+    if args.child:
+        print(run(args.child[0],int(args.child[1]),args.batch_size,
+                  mysql_args))
+        return
+
+    modes = ("fetchall", "fetchmany")
+    if mysql_args:
+        modes = ("buffered", "unbuffered")
+    print("%12s %18s %18s" % ("Rows",modes[0] + " RSS(MB)",
+                              modes[1] + " RSS(MB)"))
+    for rows in args.rows:
+        result = []
+        for mode in modes:
+            command = [sys.executable, __file__, "--child", mode, str(rows),
+                       "-b", str(args.batch_size)]
+            if mysql_args:
+                command.extend(["--mysql", args.mysql, "-u", args.username,
+                                "-p", args.password])
+            result.append(float(subprocess.check_output(command)))
+        print("%12i %18.1f %18.1f" % (rows,result[0],result[1]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+################################################################################
+#
+# Memory and lookup benchmark for the perf report's object mappings: the
+# original volmap/qosmap dicts versus aiqum_common.VolumeMap, on a synthetic
+# estate.
+#
+# Usage: bench/bench_volume_map.py [-v VOLUMES] [-c CLUSTERS] [-l LOOKUPS]
+#
+################################################################################
+
+import os
+import sys
+import time
+import random
+import tracemalloc
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from aiqum_common import VolumeMap
+
+# Synthetic model rows, shaped like the cluster, vserver, volume and
+# qos_workload queries in aiqum_object_mappings().  One QoS workload in ten
+# is not a volume workload.
+def synthetic_rows(volumes,clusters):
+    clusterrows = [(x, "cluster%03i" % x) for x in range(clusters)]
+    vservers = max(clusters * 20, 1)
+    vserverrows = [(10000 + x, "svm%05i" % x, x % clusters)
+                   for x in range(vservers)]
+    volumerows = []
+    qosrows = []
+    for x in range(volumes):
+        vserver = vserverrows[x % vservers]
+        volumerows.append((1000000 + x, "vol_%07i" % x, vserver[2], vserver[0]))
+        qosrows.append((5000000 + x, 1000000 + x))
+        if x % 10 == 0:
+            qosrows.append((9000000 + x, 42))
+    random.shuffle(qosrows)
+    return clusterrows, vserverrows, volumerows, qosrows
+
+def build_dicts(clusterrows,vserverrows,volumerows,qosrows):
+    clustermap = dict(clusterrows)
+    vservermap = {row[0]: row[1] for row in vserverrows}
+    volmap = {}
+    for row in volumerows:
+        volmap[row[0]] = {}
+        volmap[row[0]]['name'] = row[1]
+        volmap[row[0]]['cluster'] = clustermap[row[2]]
+        volmap[row[0]]['vserver'] = vservermap[row[3]]
+    qosmap = {}
+    for row in qosrows:
+        qosmap[row[0]] = row[1]
+    return volmap, qosmap
+
+def build_volume_map(clusterrows,vserverrows,volumerows,qosrows):
+    clustermap = dict(clusterrows)
+    vservermap = {row[0]: row[1] for row in vserverrows}
+    volmap = VolumeMap()
+    for row in volumerows:
+        volmap.add_volume(row[0],clustermap[row[2]],vservermap[row[3]],row[1])
+    for row in qosrows:
+        volmap.add_qos(row[0],row[1])
+    volmap.freeze()
+    return volmap
+
+# Build a structure from freshly copied rows (so the row strings count
+# against it, as they would coming off a cursor) and return it with its
+# retained size, peak size while building and build time.
+def measure(build,rows):
+    rows = tuple([tuple(row[:1]) + tuple(str(v) if isinstance(v, str) else v
+                                         for v in row[1:])
+                  for row in table] for table in rows)
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build(*rows)
+    elapsed = time.perf_counter() - start
+    del rows
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak, elapsed
+
+def main():
+    parser = ArgumentParser(description="Benchmark the perf report object maps.")
+    parser.add_argument('-v', '--volumes', type=int, default=500000)
+    parser.add_argument('-c', '--clusters', type=int, default=50)
+    parser.add_argument('-l', '--lookups', type=int, default=1000000)
+    args = parser.parse_args()
+
+    rows = synthetic_rows(args.volumes,args.clusters)
+    qosids = [random.choice(rows[3])[0] for x in range(args.lookups)]
+    print("%i volumes, %i QoS workloads, %i clusters, %i lookups"
+          % (len(rows[2]),len(rows[3]),args.clusters,args.lookups))
+    print("%-10s %12s %12s %10s %10s"
+          % ("Structure","Retained(MB)","Peak(MB)","Build(s)","Lookup(s)"))
+
+    (volmap, qosmap), current, peak, elapsed = measure(build_dicts,rows)
+    start = time.perf_counter()
+    for qosid in qosids:
+        volid = qosmap[qosid]
+        if volid in volmap:
+            names = (volmap[volid]['cluster'],volmap[volid]['vserver'],
+                     volmap[volid]['name'])
+    lookup = time.perf_counter() - start
+    print("%-10s %12.1f %12.1f %10.2f %10.2f"
+          % ("dicts",current / 1e6,peak / 1e6,elapsed,lookup))
+    del volmap, qosmap
+
+    volmap, current, peak, elapsed = measure(build_volume_map,rows)
+    start = time.perf_counter()
+    for qosid in qosids:
+        row = volmap.lookup(qosid)
+        if row >= 0:
+            names = volmap.names(row)
+    lookup = time.perf_counter() - start
+    print("%-10s %12.1f %12.1f %10.2f %10.2f"
+          % ("VolumeMap",current / 1e6,peak / 1e6,elapsed,lookup))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+################################################################################
+#
+# Checks of the connection retry layer in aiqum_common (aiqum_db_connect,
+# aiqum_db_pool, ResilientConnection and ResilientCursor) against a fake
+# mysql.connector connection, so that no MySQL server is needed.  The fake connection fails
+# the way mysql.connector does: a dropped connection raises 2013 from the
+# statement or fetch it dropped in, and after that refuses to make a cursor
+# with "MySQL Connection not available" (no errno).
+#
+# Each check prints ok or FAILED; the exit status is 1 if any failed.  For
+# faults on a real connection, see bench/aiqum_fault_proxy.py.
+#
+# Usage: bench/check_connection_retry.py
+#
+################################################################################
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import mysql.connector
+import mysql.connector.pooling
+from mysql.connector import errors
+import aiqum_common
+
+# Fake mysql.connector connection.  Faults are scheduled by adding them to
+# faults: 'connect', 'execute' or 'fetch' makes the next such call fail, and
+# 'idle' drops the connection before the next call.  Every call is logged.
+class FakeConnection:
+    def __init__(self):
+        self.connected = True
+        self.unread_result = False
+        self.faults = []
+        self.log = []
+
+    def fault(self, what):
+        if 'idle' in self.faults:
+            self.faults.remove('idle')
+            self.connected = False
+        if what in self.faults:
+            self.faults.remove(what)
+            self.connected = False
+            return True
+        return False
+
+    def lost(self):
+        return errors.OperationalError(msg="Lost connection to MySQL server "
+                                           "during query", errno=2013)
+
+    def cursor(self, *args, **kwargs):
+        self.fault('cursor')
+        if not self.connected:
+            raise errors.OperationalError("MySQL Connection not available")
+        return FakeCursor(self)
+
+    def is_connected(self):
+        self.fault('ping')
+        return self.connected
+
+    def disconnect(self):
+        self.log.append("disconnect")
+        self.connected = False
+
+    def connect(self):
+        self.log.append("connect")
+        if 'connect' in self.faults:
+            self.faults.remove('connect')
+            raise errors.InterfaceError(msg="Can't connect to MySQL server",
+                                        errno=2003)
+        self.connected = True
+
+    def start_transaction(self, **kwargs):
+        self.log.append("START TRANSACTION")
+
+    def rollback(self):
+        self.log.append("ROLLBACK")
+
+    def close(self):
+        self.connected = False
+
+# Fake connection for a pool, which only takes MySQLConnections.  Taking a
+# dropped connection from a pool reconnects it with reconnect(), which fails
+# the way mysql.connector's does, and returning it resets its session, which
+# fails on a dropped connection ('reset' drops it first).
+class FakePooledConnection(FakeConnection, mysql.connector.MySQLConnection):
+    def __init__(self):
+        FakeConnection.__init__(self)
+
+    def config(self, **kwargs):
+        pass
+
+    def reconnect(self):
+        try:
+            self.disconnect()
+            self.connect()
+        except errors.Error as error:
+            raise errors.InterfaceError("Can not reconnect to MySQL after 1 "
+                                        "attempt(s): %s" % error) from error
+
+    def reset_session(self):
+        self.fault('reset')
+        if not self.connected:
+            raise self.lost()
+        self.log.append("reset")
+
+class FakeCursor:
+    def __init__(self, cnx):
+        self.cnx = cnx
+        self.rows = []
+
+    def execute(self, query, params=None):
+        self.cnx.log.append(query)
+        if self.cnx.fault('execute') or not self.cnx.connected:
+            raise self.cnx.lost()
+        if query == "SELECT error":
+            raise errors.ProgrammingError(msg="You have an error in your SQL "
+                                              "syntax", errno=1064)
+        self.rows = [(x,) for x in range(5)]
+
+    def fetchmany(self, size=1):
+        if self.cnx.fault('fetch') or not self.cnx.connected:
+            raise self.cnx.lost()
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def fetchall(self):
+        return self.fetchmany(len(self.rows))
+
+    def close(self):
+        pass
+
+# Connect through aiqum_db_connect() to a FakeConnection, failing the first
+# refused connects with 2003.
+def fake_connect(refused=0):
+    attempts = [refused]
+    def connect(**args):
+        if attempts[0] > 0:
+            attempts[0] -= 1
+            raise errors.InterfaceError(msg="Can't connect to MySQL server",
+                                        errno=2003)
+        return FakeConnection()
+    mysql.connector.connect = connect
+    return aiqum_common.aiqum_db_connect("aiqum:3306","user","password")
+
+# Make a pool of FakePooledConnections through aiqum_db_pool().
+def fake_pool(size):
+    mysql.connector.pooling.connect = lambda **args: FakePooledConnection()
+    return aiqum_common.aiqum_db_pool("aiqum","user","password","db",size)
+
+def check_connect():
+    cnx = fake_connect(refused=2)
+    return isinstance(cnx.cnx, FakeConnection)
+
+def check_execute_drop():
+    cnx = fake_connect()
+    cursor = cnx.cursor()
+    cursor.execute("SET SESSION group_concat_max_len = 1000000")
+    cnx.cnx.faults = ['execute', 'connect']
+    del cnx.cnx.log[:]
+    cursor.execute("SELECT rows")
+    return (cursor.fetchall() == [(x,) for x in range(5)] and
+            cnx.cnx.log == ["SELECT rows", "disconnect", "connect",
+                            "disconnect", "connect",
+                            "SET SESSION group_concat_max_len = 1000000",
+                            "SELECT rows"])
+
+# A drop while fetching is raised, and the next statement (here on a new
+# cursor, as in the chunked perf export) reconnects rather than failing.
+def check_fetch_drop():
+    cnx = fake_connect()
+    cursor = cnx.cursor()
+    cursor.execute("SELECT chunk1")
+    cnx.cnx.faults = ['fetch']
+    try:
+        list(aiqum_common.aiqum_fetch_batches(cursor,2))
+        return False
+    except errors.OperationalError as error:
+        if error.errno != 2013:
+            return False
+    cursor = cnx.cursor()
+    cursor.execute("SELECT chunk2")
+    return len(list(cursor)) == 5 and cnx.cnx.log[-3:] == ["disconnect",
+                                                            "connect",
+                                                            "SELECT chunk2"]
+
+def check_idle_drop():
+    cnx = fake_connect()
+    cursor = cnx.cursor()
+    cursor.execute("SELECT first")
+    cursor.fetchall()
+    cnx.cnx.faults = ['idle']
+    cursor = cnx.cursor()
+    cursor.execute("SELECT second")
+    return len(cursor.fetchall()) == 5
+
+def check_not_retried():
+    cnx = fake_connect()
+    cursor = cnx.cursor()
+    try:
+        cursor.execute("SELECT error")
+        return False
+    except errors.ProgrammingError:
+        return cnx.cnx.log == ["SELECT error"]
+
+def check_gives_up():
+    cnx = fake_connect()
+    cursor = cnx.cursor()
+    cursor.execute("SELECT first")
+    cnx.cnx.faults = ['execute'] + ['connect'] * aiqum_common.RETRIES
+    try:
+        cursor.execute("SELECT second")
+        return False
+    except errors.InterfaceError as error:
+        return error.errno == 2003
+
+# SET statements repeated per cluster are replayed once after a reconnect.
+def check_session_once():
+    cnx = fake_connect()
+    cursor = cnx.cursor()
+    for cluster in range(3):
+        cursor.execute("SET SESSION group_concat_max_len = 1000000")
+    cnx.cnx.faults = ['execute']
+    del cnx.cnx.log[:]
+    cursor.execute("SELECT rows")
+    return cnx.cnx.log == ["SELECT rows", "disconnect", "connect",
+                           "SET SESSION group_concat_max_len = 1000000",
+                           "SELECT rows"]
+
+def check_transaction():
+    cnx = fake_connect()
+    cnx.start_transaction(readonly=True)
+    cursor = cnx.cursor()
+    cursor.execute("SELECT rows")
+    cursor.fetchall()
+    cursor.close()
+    cnx.rollback()
+    cnx.close()
+    return cnx.cnx.log == ["START TRANSACTION", "SELECT rows", "ROLLBACK"]
+
+# A connection goes back to its pool when closed, even if it was dropped and
+# resetting its session fails, so that a pool of one is never exhausted.
+def check_pool_round_trip():
+    pool = fake_pool(1)
+    for fault in ([], ['reset'], []):
+        cnx = pool.get_connection()
+        cursor = cnx.cursor()
+        cursor.execute("SELECT rows")
+        if len(cursor.fetchall()) != 5:
+            return False
+        cnx.cnx.faults = fault
+        cnx.close()
+    return True
+
+# A connection dropped while in the pool is reconnected when taken, and a
+# failed reconnect is retried.
+def check_pool_reconnect():
+    pool = fake_pool(1)
+    cnx = pool.get_connection()
+    fake = cnx.cnx._cnx
+    cnx.close()
+    fake.connected = False
+    fake.faults = ['connect']
+    cnx = pool.get_connection()
+    cursor = cnx.cursor()
+    cursor.execute("SELECT rows")
+    cnx.close()
+    return fake.log == ["reset", "disconnect", "connect", "disconnect",
+                        "connect", "SELECT rows", "reset"]
+
+CHECKS = [("connect retried", check_connect),
+          ("statement retried after a drop", check_execute_drop),
+          ("reconnect after a drop while fetching", check_fetch_drop),
+          ("reconnect after an idle drop", check_idle_drop),
+          ("other errors not retried", check_not_retried),
+          ("gives up after --retries", check_gives_up),
+          ("session settings replayed once", check_session_once),
+          ("transaction on a connection", check_transaction),
+          ("pooled connection returned on close", check_pool_round_trip),
+          ("pooled connection reconnected on take", check_pool_reconnect)]
+
+def main():
+    aiqum_common.RETRY_DELAY = 0.01
+    failed = 0
+    for name, check in CHECKS:
+        try:
+            ok = check()
+        except Exception as error:
+            print("%s: %s" % (name, error), file=sys.stderr)
+            ok = False
+        print("%-40s %s" % (name, "ok" if ok else "FAILED"))
+        failed += not ok
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()